@@ -0,0 +1,109 @@
+import time
+import cv2 as cv
+import numpy as np
+
+
+# Processes frames at full resolution and rate while someone is using the map, and falls back to a cheap idle scan
+# when no pointer marker has been seen for idle_after seconds.
+# In idle mode only idle_fps frames per second are retrieved from the camera (the others are grabbed and discarded
+# without decoding) and compared with the previous one on a small blurred thumbnail; at 30 FPS the default of 15
+# wakes up within two frames. Every idle_scan_interval seconds a frame is also processed with the detection
+# downscaled by idle_downscale, to catch a pointer held still. Motion in more than motion_fraction of the thumbnail,
+# or a pointer found by a scan, switches back to active mode and the frame that showed it is processed at full
+# resolution right away. active_fps limits the active rate (None: as fast as frames come).
+class AdaptiveScheduler:
+    def __init__(self, processor, idle_after=10.0, idle_fps=15.0, idle_scan_interval=1.0, idle_downscale=4.0,
+                 active_fps=None, motion_threshold=12, motion_fraction=0.002, thumbnail_width=240):
+        self.processor = processor
+        self.idle_after = idle_after
+        self.idle_fps = idle_fps
+        self.idle_scan_interval = idle_scan_interval
+        self.idle_downscale = idle_downscale
+        self.active_fps = active_fps
+        self.motion_threshold = motion_threshold  # gray level difference of a moving thumbnail pixel
+        self.motion_fraction = motion_fraction
+        self.thumbnail_width = thumbnail_width
+
+        self.mode = 'active'
+        self.mode_since = time.monotonic()
+        self.mode_times = {'active': 0.0, 'idle': 0.0}
+        self.switches = 0
+        self.last_pointer = None  # timestamp of the last frame with a pointer
+        self.last_scan = None
+        self.thumbnail = None
+        self.counts = {'active_frames': 0, 'motion_checks': 0, 'idle_scans': 0, 'wakeups': 0}
+
+    # Minimum seconds between the frames retrieved from the camera, for FrameGrabber
+    def frame_interval(self):
+        if self.mode == 'idle':
+            return 1.0 / self.idle_fps
+        return 1.0 / self.active_fps if self.active_fps else 0.0
+
+    # Processing function of the pipeline: returns the FrameResult, or None when the frame is skipped
+    def process(self, frame, timestamp):
+        if self.last_pointer is None:
+            self.last_pointer = timestamp
+        if self.mode == 'active':
+            result = self.processor.process(frame, timestamp)
+            self.counts['active_frames'] += 1
+            if self._pointer_seen(result):
+                self.last_pointer = timestamp
+            elif timestamp - self.last_pointer > self.idle_after:
+                self._switch('idle')
+                self.thumbnail = self._thumbnail(frame)
+                self.last_scan = timestamp
+            return result
+
+        self.counts['motion_checks'] += 1
+        thumbnail = self._thumbnail(frame)
+        moving = np.count_nonzero(cv.absdiff(thumbnail, self.thumbnail) > self.motion_threshold)
+        self.thumbnail = thumbnail
+        if moving > self.motion_fraction * thumbnail.size:
+            return self._wake(frame, timestamp)
+
+        if timestamp - self.last_scan >= self.idle_scan_interval:
+            self.last_scan = timestamp
+            self.counts['idle_scans'] += 1
+            result = self.processor.process(frame, timestamp, self.idle_downscale)
+            if self._pointer_seen(result):
+                return self._wake(frame, timestamp)
+            return result
+        return None
+
+    def stats(self):
+        mode_times = dict(self.mode_times)
+        mode_times[self.mode] += time.monotonic() - self.mode_since
+        return {'idle': int(self.mode == 'idle'), 'active_seconds': mode_times['active'],
+                'idle_seconds': mode_times['idle'], 'mode_switches': self.switches, **self.counts}
+
+    def report(self):
+        stats = self.stats()
+        total = max(stats['active_seconds'] + stats['idle_seconds'], 1e-9)
+        return (f"mode: {self.mode} active: {stats['active_seconds']:.0f} s " +
+                f"({100 * stats['active_seconds'] / total:.0f}%) idle: {stats['idle_seconds']:.0f} s " +
+                f"wakeups: {stats['wakeups']} idle scans: {stats['idle_scans']}")
+
+    def _wake(self, frame, timestamp):
+        self.counts['wakeups'] += 1
+        self._switch('active')
+        self.last_pointer = timestamp
+        return self.process(frame, timestamp)
+
+    # Whether a pointer marker was found in the frame, not only extrapolated by its filter
+    @staticmethod
+    def _pointer_seen(result):
+        return any(pointer.corners is not None for pointer in result.pointers.values())
+
+    def _switch(self, mode):
+        now = time.monotonic()
+        self.mode_times[self.mode] += now - self.mode_since
+        self.mode = mode
+        self.mode_since = now
+        self.switches += 1
+
+    def _thumbnail(self, frame):
+        height = frame.shape[0] * self.thumbnail_width // frame.shape[1]
+        small = cv.resize(frame, (self.thumbnail_width, height), interpolation=cv.INTER_LINEAR)
+        if small.ndim == 3:
+            small = cv.cvtColor(small, cv.COLOR_BGR2GRAY)
+        return cv.GaussianBlur(small, (5, 5), 0)
@@ -0,0 +1,156 @@
+import time
+import cv2 as cv
+import numpy as np
+
+
+# Reusable ArUco detector for several dictionaries, each only detected when asked for.
+# The first dictionary asked for in a frame is searched in the whole image, downscaled: one detectMarkers pass
+# thresholds it and traces the marker candidates. Any other dictionary asked for in the same frame is only searched
+# in the candidates that pass rejected (markers of the other dictionaries among them), so the whole image is
+# thresholded once per frame; while the board is tracked in regions, that pass looks for the pointer alone.
+# Corners are then refined with cornerSubPix on the full resolution image.
+# timings holds the time spent in the last frame downscaling the image ('pyramid') and detecting each dictionary.
+class ArucoDetector:
+    def __init__(self, dictionaries, downscale=1.0, refine_window=5):
+        self.names = list(dictionaries)
+        self.dictionaries = {name: cv.aruco.Dictionary_get(d) for name, d in dictionaries.items()}
+        self.downscale = max(float(downscale), 1.0)
+        self.refine_window = refine_window
+        self.refine_criteria = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER, 30, 0.1)
+
+        # Corners are refined on the full resolution image, so the downscaled pass does not refine them
+        self.params = cv.aruco.DetectorParameters_create()
+        self.params.cornerRefinementMethod = cv.aruco.CORNER_REFINE_NONE
+        # Small regions are already at full resolution and use the usual subpixel refinement
+        self.region_params = cv.aruco.DetectorParameters_create()
+        self.region_params.cornerRefinementMethod = cv.aruco.CORNER_REFINE_SUBPIX
+        self.min_perimeter_rate = self.region_params.minMarkerPerimeterRate
+        # Candidates are warped to a known size, so a single threshold window about the size of two marker cells
+        # is enough to decode them
+        self.candidate_params = cv.aruco.DetectorParameters_create()
+        self.candidate_params.cornerRefinementMethod = cv.aruco.CORNER_REFINE_NONE
+        self.candidate_params.adaptiveThreshWinSizeMin = 13
+        self.candidate_params.adaptiveThreshWinSizeMax = 13
+
+        self.image = None
+        self.image_small = None
+        self.candidates = None  # rejected candidates of the full-image pass, in full resolution coordinates
+        self.results = {}
+        self.timings = {}
+
+    # Sets the grayscale image of the current frame. Calling it again with the same image keeps the cached results,
+    # unless new_frame says the image has been read into again since.
+    def set_image(self, img_gray, new_frame=False):
+        if img_gray is self.image and not new_frame:
+            return
+        self.image = img_gray
+        self.image_small = None
+        self.candidates = None
+        self.results = {}
+        self.timings = dict.fromkeys(['pyramid'] + self.names, 0.0)
+
+    # Returns (corners, ids) of the markers of dictionary [name] in the whole image
+    def detect(self, name):
+        if name not in self.results:
+            self.results[name] = self._detect_full(name) if self.candidates is None else self._detect_candidates(name)
+        return self.results[name]
+
+    # Returns (corners, ids) of the markers of dictionary [name] inside regions (x0, y0, x1, y1) of the image, in
+    # image coordinates. The regions are copied side by side into one mosaic, padded with their replicated edges and
+    # [gap] pixels apart, so that a single detectMarkers call searches them all.
+    def detect_regions(self, name, regions, gap=8):
+        start = time.perf_counter()
+        height = max(y1 - y0 for x0, y0, x1, y1 in regions)
+        offsets = np.cumsum([0] + [x1 - x0 + gap for x0, y0, x1, y1 in regions])
+        mosaic = np.empty((height, offsets[-1]), dtype=self.image.dtype)
+        for (x0, y0, x1, y1), left, right in zip(regions, offsets[:-1], offsets[1:]):
+            cv.copyMakeBorder(self.image[y0:y1, x0:x1], 0, height - (y1 - y0), 0, gap, cv.BORDER_REPLICATE,
+                              dst=mosaic[:, left:right])
+        # The minimum marker size is relative to the image, so it is scaled to what it would be in the largest region
+        largest = max(max(x1 - x0, y1 - y0) for x0, y0, x1, y1 in regions)
+        self.region_params.minMarkerPerimeterRate = self.min_perimeter_rate * largest / max(mosaic.shape)
+        corners, ids, _ = cv.aruco.detectMarkers(mosaic, self.dictionaries[name], parameters=self.region_params)
+
+        # Back from the mosaic to the image, by the region each marker's center lies in
+        shifts = np.float32([[x0 - left, y0] for (x0, y0, x1, y1), left in zip(regions, offsets[:-1])])
+        tiles = np.searchsorted(offsets, [c[0, :, 0].mean() for c in corners], side='right') - 1
+        corners = tuple(c + shifts[tile] for c, tile in zip(corners, tiles))
+        self.timings[name] += time.perf_counter() - start
+        return corners, ids
+
+    def _detect_full(self, name):
+        if self.image_small is None:
+            start = time.perf_counter()
+            if self.downscale > 1.0:
+                self.image_small = cv.resize(self.image, None, fx=1.0 / self.downscale, fy=1.0 / self.downscale,
+                                             interpolation=cv.INTER_AREA)
+            else:
+                self.image_small = self.image
+            self.timings['pyramid'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        corners, ids, rejected = cv.aruco.detectMarkers(self.image_small, self.dictionaries[name],
+                                                        parameters=self.params)
+        self.candidates = [self._to_full_resolution(c).reshape(4, 2) for c in rejected]
+        corners = self._refine([self._to_full_resolution(c) for c in corners])
+        self.timings[name] += time.perf_counter() - start
+        return corners, ids
+
+    # Searches the candidates of the full-image pass: each one is warped, with the white border around it, to a tile
+    # of a mosaic in which it is [tile] pixels square, so that large candidates cost no more than small ones, and
+    # detectMarkers decodes the tiles. A marker found where its tile's candidate was warped to is that candidate,
+    # turned to the marker's orientation, as detectMarkers would return it; markers elsewhere in a tile are parts of
+    # the surroundings, which have candidates of their own. As in detectMarkers, a marker closer than
+    # minMarkerDistanceRate of its perimeter to another one with the same id (traced twice) is dropped.
+    def _detect_candidates(self, name, tile=32):
+        start = time.perf_counter()
+        if not self.candidates:
+            return (), None
+        size = 2 * tile
+        square = np.float32([[0, 0], [tile, 0], [tile, tile], [0, tile]]) + 0.5 * tile
+        mosaic = np.empty((size, size * len(self.candidates)), dtype=self.image.dtype)
+        for i, candidate in enumerate(self.candidates):
+            warp = cv.getPerspectiveTransform(candidate, square)
+            cv.warpPerspective(self.image, warp, (size, size), dst=mosaic[:, i * size:(i + 1) * size],
+                               flags=cv.INTER_LINEAR, borderMode=cv.BORDER_REPLICATE)
+        # Only quads of about the size of the warped candidates (4 * tile around) are traced in the tiles
+        self.candidate_params.minMarkerPerimeterRate = 2 * tile / max(mosaic.shape)
+        self.candidate_params.maxMarkerPerimeterRate = 6 * tile / max(mosaic.shape)
+        corners, ids, _ = cv.aruco.detectMarkers(mosaic, self.dictionaries[name], parameters=self.candidate_params)
+
+        found = []
+        found_ids = []
+        for c, marker_id in zip(corners, np.ravel(ids) if ids is not None else []):
+            i = int(c[0, :, 0].mean() // size)
+            pts = c.reshape(4, 2) - np.float32([i * size, 0])
+            errors = [np.max(np.abs(pts - np.roll(square, -k, axis=0))) for k in range(4)]
+            k = int(np.argmin(errors))
+            if errors[k] > 0.125 * tile:
+                continue
+            pts = np.roll(self.candidates[i], -k, axis=0).reshape(1, 4, 2).astype(np.float32)
+            min_distance = self.params.minMarkerDistanceRate * cv.arcLength(pts.reshape(-1, 1, 2), True)
+            if any(other_id == marker_id and np.mean(np.linalg.norm(other - pts, axis=2)) < min_distance
+                   for other, other_id in zip(found, found_ids)):
+                continue
+            found.append(pts)
+            found_ids.append(marker_id)
+        corners = self._refine(found)
+        self.timings[name] += time.perf_counter() - start
+        if not found:
+            return (), None
+        return corners, np.array(found_ids, dtype=np.int32).reshape(-1, 1)
+
+    def _to_full_resolution(self, corners):
+        if self.downscale == 1.0:
+            return corners
+        return ((corners + 0.5) * self.downscale - 0.5).astype(np.float32)
+
+    # Refines corners given in full resolution coordinates on the full resolution image
+    def _refine(self, corners):
+        refined = []
+        for c in corners:
+            pts = c.reshape(-1, 1, 2)
+            pts = cv.cornerSubPix(self.image, pts, (self.refine_window, self.refine_window), (-1, -1),
+                                  self.refine_criteria)
+            refined.append(pts.reshape(1, 4, 2))
+        return tuple(refined)
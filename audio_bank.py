@@ -0,0 +1,233 @@
+import collections
+import functools
+import os
+import queue
+import threading
+import time
+import numpy as np
+
+
+# Decodes a sound file to PCM. Returns the samples as a uint8 array and the format as (channels, sample_size,
+# sample_rate), e.g. to share decoded clips between processes.
+def decode_clip(path):
+    import pyglet.media
+    source = pyglet.media.load(path, streaming=True)
+    fmt = source.audio_format
+    chunks = []
+    while True:
+        audio_data = source.get_audio_data(1 << 20)
+        if not audio_data:
+            break
+        chunks.append(audio_data.get_string_data())
+    return np.frombuffer(b''.join(chunks), dtype=np.uint8), (fmt.channels, fmt.sample_size, fmt.sample_rate)
+
+
+# Static source over decoded PCM samples that it doesn't own, such as a clip in shared memory. Playback reads the
+# samples packet by packet, so the clip is never copied as a whole. Built on first use, on the audio thread.
+@functools.lru_cache(maxsize=None)
+def _pcm_source_class():
+    from pyglet.media.codecs.base import AudioData, StaticSource
+
+    class PcmSource(StaticSource):
+        def __init__(self, data, audio_format):
+            self._data = data
+            self._offset = 0
+            self.audio_format = audio_format
+            self._duration = len(data) / audio_format.bytes_per_second
+
+        def get_queue_source(self):
+            return PcmSource(self._data, self.audio_format)
+
+        def seek(self, timestamp):
+            offset = int(timestamp * self.audio_format.bytes_per_second)
+            self._offset = offset - offset % self.audio_format.bytes_per_sample
+
+        def get_audio_data(self, num_bytes, compensation_time=0.0):
+            num_bytes -= num_bytes % self.audio_format.bytes_per_sample
+            data = bytes(self._data[self._offset:self._offset + num_bytes])
+            if len(data) == 0:
+                return None
+            timestamp = self._offset / self.audio_format.bytes_per_second
+            self._offset += len(data)
+            return AudioData(data, len(data), timestamp, len(data) / self.audio_format.bytes_per_second, [])
+
+    return PcmSource
+
+
+# Decodes the sound clips of a map in the background and plays them without blocking the caller.
+# Decoded clips are kept as static sources in an LRU cache bounded to max_bytes of decoded audio. All pyglet calls
+# happen on the audio thread, play() and stop() only queue a command. Each channel (e.g. one per pointer) plays one
+# clip at a time, and a new clip pre-empts the one playing on the same channel. Each channel keeps one pyglet Player
+# that its clips are queued on (Source.play() would register a new player per clip in Source._players, where
+# pre-empted ones stay forever).
+# Clips in [decoded] (key -> (samples, format) as returned by decode_clip) are played from the given buffers
+# instead of being decoded, and don't count towards max_bytes. With open_sound (key -> file object), sound files are
+# read through it instead of from sound_dir, e.g. from a map package. With metrics (a camio_metrics.Metrics), the
+# playback start latencies are also recorded in its 'audio_start' histogram.
+class AudioBank:
+    def __init__(self, sound_dir, sounds, max_bytes=256 * 1024 * 1024, preload=True, decoded=None, open_sound=None,
+                 metrics=None):
+        self.decoded = decoded or {}
+        self.open_sound = open_sound
+        self.paths = self._paths(sound_dir, sounds, self.decoded, open_sound)
+        self.max_bytes = max_bytes
+        self.preload = preload
+
+        self.cache = collections.OrderedDict()  # key -> (source, size in bytes)
+        self.cache_bytes = 0
+        self.commands = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="AudioBank", daemon=True)
+        self.players = {}  # channel -> player
+
+        # Metrics
+        self.decode_times = {}  # key -> seconds spent decoding the clip
+        self.hits = 0
+        self.misses = 0
+        self.start_latencies = collections.deque(maxlen=100)  # seconds from play() to playback start
+        self.started = None  # perf_counter time of start()
+        self.preload_finished = None  # perf_counter time the preloading ended
+        self.preloaded = threading.Event()
+        self._metrics = metrics
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.thread.start()
+
+    def has_sound(self, key):
+        return key in self.paths
+
+    # Plays the clip of [key] on [channel], interrupting the clip currently playing on it
+    def play(self, key, channel=0):
+        self.commands.put(('play', key, time.monotonic(), channel))
+
+    # Stops the clip playing on [channel], or on all channels
+    def stop(self, channel=None):
+        self.commands.put(('stop', None, time.monotonic(), channel))
+
+    # Replaces the sounds with those of another map, as the arguments of the constructor: the playing clips are
+    # stopped, the cached ones dropped and the new ones decoded in the background (with preload)
+    def set_sounds(self, sound_dir, sounds, decoded=None, open_sound=None):
+        self.commands.put(('sounds', (sound_dir, sounds, decoded or {}, open_sound), time.monotonic(), 'sounds'))
+
+    def close(self):
+        self.commands.put(('close', None, time.monotonic(), None))
+        self.thread.join(timeout=1.0)
+
+    def metrics(self):
+        latencies = list(self.start_latencies)
+        return {'clips_cached': len(self.cache),
+                'cache_bytes': self.cache_bytes,
+                'cache_hits': self.hits,
+                'cache_misses': self.misses,
+                'decode_time': sum(self.decode_times.values()),
+                'start_latency': latencies[-1] if latencies else 0.0,
+                'mean_start_latency': sum(latencies) / len(latencies) if latencies else 0.0}
+
+    def _run(self):
+        import pyglet.media  # pyglet objects are only used from this thread
+
+        pending = sorted(self.paths) if self.preload else []
+        while True:
+            if not pending and not self.preloaded.is_set():
+                self.preload_finished = time.perf_counter()
+                self.preloaded.set()
+
+            # Decode the pending clips while there is nothing to play
+            try:
+                command = self.commands.get(timeout=None if not pending else 0)
+            except queue.Empty:
+                key = pending.pop(0)
+                if key not in self.cache and key in self.paths:
+                    self._load(pyglet.media, key)
+                continue
+
+            # Only the last command of each channel matters, older play requests are stale. A command for all
+            # channels overrides the ones before it, and a change of sounds also drops the requests for old clips.
+            # close ends the thread as soon as it is seen, whatever comes after it.
+            latest = {}
+            while command is not None:
+                if command[0] == 'close':
+                    self._stop()
+                    return
+                if command[0] == 'sounds':
+                    latest = {}
+                elif command[3] is None:
+                    latest = {channel: queued for channel, queued in latest.items() if queued[0] == 'sounds'}
+                latest[command[3]] = command
+                try:
+                    command = self.commands.get_nowait()
+                except queue.Empty:
+                    command = None
+
+            for action, key, requested, channel in latest.values():
+                if action == 'sounds':
+                    self._stop()
+                    sound_dir, sounds, self.decoded, self.open_sound = key
+                    self.paths = self._paths(sound_dir, sounds, self.decoded, self.open_sound)
+                    self.cache.clear()
+                    self.cache_bytes = 0
+                    pending = sorted(self.paths) if self.preload else []
+                    continue
+                self._stop(channel)
+                if action == 'play' and key in self.paths:
+                    source = self._get(pyglet.media, key)
+                    if source is not None:
+                        player = self.players.get(channel)
+                        if player is None:
+                            player = self.players[channel] = pyglet.media.Player()
+                        player.queue(source)
+                        player.play()
+                        self.start_latencies.append(time.monotonic() - requested)
+                        if self._metrics is not None:
+                            self._metrics.observe('audio_start', self.start_latencies[-1])
+
+    @staticmethod
+    def _paths(sound_dir, sounds, decoded, open_sound):
+        paths = {}
+        for key, filename in sounds.items():
+            path = os.path.join(sound_dir, filename)
+            if os.path.exists(path) or key in decoded or open_sound is not None:
+                paths[key] = path
+        return paths
+
+    # Stops the player of [channel], or all of them. Skipping the clip with nothing queued after it also releases
+    # the audio player; the Player is kept for the next clip of the channel.
+    def _stop(self, channel=None):
+        for player_channel in [channel] if channel is not None else list(self.players):
+            player = self.players.get(player_channel)
+            if player is not None and player.source is not None:
+                player.pause()
+                player.next_source()
+
+    def _get(self, media, key):
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key][0]
+        self.misses += 1
+        return self._load(media, key)
+
+    def _load(self, media, key):
+        if key in self.decoded:
+            from pyglet.media.codecs.base import AudioFormat
+            samples, (channels, sample_size, sample_rate) = self.decoded[key]
+            source = _pcm_source_class()(memoryview(samples).cast('B'), AudioFormat(channels, sample_size, sample_rate))
+            self.cache[key] = (source, 0)
+            return source
+
+        start = time.perf_counter()
+        try:
+            file = self.open_sound(key) if self.open_sound is not None else None
+            source = media.load(self.paths[key], file=file, streaming=False)
+        except Exception as e:
+            print(f"Could not decode {self.paths.pop(key)}: {e}")
+            return None
+        self.decode_times[key] = time.perf_counter() - start
+
+        size = int(source.duration * source.audio_format.bytes_per_second)
+        self.cache[key] = (source, size)
+        self.cache_bytes += size
+        while self.cache_bytes > self.max_bytes and len(self.cache) > 1:
+            _, (_, evicted_size) = self.cache.popitem(last=False)
+            self.cache_bytes -= evicted_size
+        return source
@@ -0,0 +1,303 @@
+import argparse
+import json
+import os
+import pickle
+import sys
+import time
+import cv2 as cv
+import numpy as np
+from map_parameters import *
+from frame_processor import FrameProcessor
+from zone_resolver import ZoneResolver
+from pointer_filter import PointerFilter
+from camera_capture import open_source
+
+
+# Renders synthetic camera frames of the printed map and a moving pointer at known poses.
+# Works as a drop-in replacement of cv.VideoCapture for the processing path and also returns the ground truth.
+class SyntheticScene:
+    def __init__(self, img_map_color, pixels_per_cm, intrinsic_matrix, frame_count, frame_size=(1920, 1080),
+                 fps=30.0, noise=2.0, texture_px_per_cm=40.0, border_cm=1.0, seed=0):
+        self.intrinsic_matrix = intrinsic_matrix
+        self.frame_count = frame_count
+        self.frame_size = frame_size
+        self.fps = fps
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.frame_num = 0
+
+        # Printed page: the map with the DICT_4X4_50 markers 0-3 drawn at the positions of obj, and a white border
+        scale = texture_px_per_cm / pixels_per_cm
+        border = int(border_cm * texture_px_per_cm)
+        self.page = cv.resize(img_map_color, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+        self.page = cv.copyMakeBorder(self.page, border, border, border, border, cv.BORDER_CONSTANT,
+                                      value=(255, 255, 255))
+        board_dict = cv.aruco.Dictionary_get(cv.aruco.DICT_4X4_50)
+        for marker in range(4):
+            x0, y0 = (obj[4 * marker, :2] * texture_px_per_cm).astype(int) + border
+            size = int(round((obj[4 * marker + 1, 0] - obj[4 * marker, 0]) * texture_px_per_cm))
+            margin = size // 4
+            self.page[y0 - margin:y0 + size + margin, x0 - margin:x0 + size + margin] = 255
+            self.page[y0:y0 + size, x0:x0 + size] = cv.cvtColor(cv.aruco.drawMarker(board_dict, marker, size),
+                                                                cv.COLOR_GRAY2BGR)
+        self.page_corners = np.float32([[0, 0, 0], [self.page.shape[1], 0, 0],
+                                        [self.page.shape[1], self.page.shape[0], 0],
+                                        [0, self.page.shape[0], 0]]) / texture_px_per_cm - (border_cm, border_cm, 0)
+
+        # Pointer card: 4x4 cm with the 3 cm DICT_5X5_50 marker 0 in the middle, the tip is the top-left corner
+        pointer_dict = cv.aruco.Dictionary_get(cv.aruco.DICT_5X5_50)
+        card_px = int(4 * texture_px_per_cm)
+        marker_px = int(3 * texture_px_per_cm)
+        offset = (card_px - marker_px) // 2
+        self.card = np.full((card_px, card_px, 3), 255, dtype=np.uint8)
+        self.card[offset:offset + marker_px, offset:offset + marker_px] = cv.cvtColor(
+            cv.aruco.drawMarker(pointer_dict, 0, marker_px), cv.COLOR_GRAY2BGR)
+
+        # Camera above the middle of the map
+        self.board_rvec = np.array([[0.15], [-0.1], [0.02]])
+        center = np.array([[obj[:, 0].max() / 2], [obj[:, 1].max() / 2], [0.0]])
+        self.board_tvec = np.array([[0.0], [0.0], [45.0]]) - center
+
+    def isOpened(self):
+        return self.frame_num < self.frame_count
+
+    def release(self):
+        self.frame_num = self.frame_count
+
+    # Tip position on the map in cm at frame [frame_num]: a slow Lissajous path over the map
+    def tip_position(self, frame_num):
+        t = frame_num / self.fps
+        x = 9.5 + 6.5 * np.sin(0.35 * t)
+        y = 13.0 + 9.5 * np.sin(0.22 * t + 0.5)
+        return np.array([[x], [y], [0.0]])
+
+    def read(self):
+        frame, _ = self.read_with_ground_truth()
+        return frame is not None, frame
+
+    # Returns the next frame and its ground truth: board rvec/tvec and pointer tip in map coordinates
+    def read_with_ground_truth(self):
+        if not self.isOpened():
+            return None, None
+        tip = self.tip_position(self.frame_num)
+        self.frame_num += 1
+
+        frame = np.full((self.frame_size[1], self.frame_size[0], 3), 90, dtype=np.uint8)
+        self._draw_texture(frame, self.page, self.page_corners)
+        card_corners = np.float32([[0, 0, 0], [4, 0, 0], [4, 4, 0], [0, 4, 0]]) + tip.T.astype(np.float32)
+        self._draw_texture(frame, self.card, card_corners)
+
+        if self.noise > 0:
+            frame = cv.GaussianBlur(frame, (3, 3), 0)
+            frame = np.clip(frame + self.rng.normal(0, self.noise, frame.shape), 0, 255).astype(np.uint8)
+        return frame, {'rvec': self.board_rvec, 'tvec': self.board_tvec, 'tip': tip}
+
+    def _draw_texture(self, frame, texture, corners_cm):
+        dst, _ = cv.projectPoints(corners_cm, self.board_rvec, self.board_tvec, self.intrinsic_matrix, None)
+        h, w = texture.shape[:2]
+        src = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+        transform = cv.getPerspectiveTransform(src, dst.reshape(4, 2).astype(np.float32))
+        cv.warpPerspective(texture, transform, self.frame_size, frame, borderMode=cv.BORDER_TRANSPARENT)
+
+
+# Rotation angle in degrees between two rotation vectors
+def rotation_error(rvec_a, rvec_b):
+    R_a, _ = cv.Rodrigues(rvec_a)
+    R_b, _ = cv.Rodrigues(rvec_b)
+    rvec_diff, _ = cv.Rodrigues(R_a.T @ R_b)
+    return float(np.degrees(np.linalg.norm(rvec_diff)))
+
+
+# Frames between each ground-truth zone change and the frame the filtered zone catches up with it
+def zone_change_latencies(true_zones, reported_zones):
+    latencies = []
+    for i in range(1, len(true_zones)):
+        zone = true_zones[i]
+        if zone == true_zones[i - 1] or zone == 0:
+            continue
+        for j in range(i, len(reported_zones)):
+            if reported_zones[j] == zone:
+                latencies.append(j - i)
+                break
+            if true_zones[j] != zone:
+                break  # left the zone before it was reported
+    return latencies
+
+
+# Summary statistics of a list of values, multiplied by [scale]
+def summarize(values, scale=1.0):
+    if len(values) == 0:
+        return {'mean': 0.0, 'p50': 0.0, 'p95': 0.0, 'max': 0.0}
+    values = np.array(values) * scale
+    return {'mean': float(np.mean(values)), 'p50': float(np.percentile(values, 50)),
+            'p95': float(np.percentile(values, 95)), 'max': float(np.max(values))}
+
+
+# Runs the processing path on every frame of [source] and returns the benchmark report
+def run_benchmark(source, processor, zone_resolver, audio_bank=None, fps=30.0):
+    stage_times = {}
+    frame_times = []
+    true_zones = []
+    reported_zones = []
+    rotation_errors = []
+    translation_errors = []
+    tip_errors = []
+    frames = 0
+    board_found = 0
+    pointer_found = 0
+    prev_zone = 0
+
+    while True:
+        if isinstance(source, SyntheticScene):
+            frame, truth = source.read_with_ground_truth()
+        else:
+            ret, frame = source.read()
+            frame, truth = (frame, None) if ret else (None, None)
+        if frame is None:
+            break
+
+        # Frames are timestamped at the nominal frame rate, as they would be captured live
+        start = time.perf_counter()
+        result = processor.process(frame, frames / fps)
+        frame_time = time.perf_counter() - start
+        if not isinstance(source, SyntheticScene):
+            source.release_frame(frame)
+
+        # Audio dispatch, as done by the output stage of simple_camio.py
+        start = time.perf_counter()
+        if result.zone != prev_zone and audio_bank is not None and audio_bank.has_sound(result.zone):
+            audio_bank.play(result.zone)
+        processor.timings['audio'] = time.perf_counter() - start
+        prev_zone = result.zone
+        frame_times.append(frame_time + processor.timings['audio'])
+
+        for stage, seconds in processor.timings.items():
+            stage_times.setdefault(stage, []).append(seconds)
+        frames += 1
+        board_found += result.rvec is not None
+        pointer_found += result.point_of_interest is not None
+        reported_zones.append(result.zone)
+
+        if truth is not None:
+            true_zones.append(zone_resolver.zone_at(truth['tip']))
+            if result.rvec is not None:
+                rotation_errors.append(rotation_error(result.rvec, truth['rvec']))
+                translation_errors.append(float(np.linalg.norm(result.tvec - truth['tvec'])))
+            if result.point_of_interest is not None:
+                tip_errors.append(float(np.linalg.norm(result.point_of_interest[:2] - truth['tip'][:2])))
+
+    report = {'frames': frames,
+              'board_found': board_found,
+              'pointer_found': pointer_found,
+              'fps': frames / sum(frame_times) if frames else 0.0,
+              'frame_time_ms': summarize(frame_times, 1000),
+              'stage_time_ms': {stage: summarize(times, 1000) for stage, times in stage_times.items()},
+              'zone_changes': int(np.count_nonzero(np.diff(reported_zones))) if frames else 0}
+    if len(true_zones) > 0:
+        latencies = zone_change_latencies(true_zones, reported_zones)
+        report['zone_change_latency_frames'] = summarize(latencies)
+        report['zone_change_latency_ms'] = summarize(latencies, 1000 / fps)
+        report['rotation_error_deg'] = summarize(rotation_errors)
+        report['translation_error_cm'] = summarize(translation_errors)
+        report['tip_error_cm'] = summarize(tip_errors)
+    return report
+
+
+def print_report(report):
+    print(f"frames: {report['frames']}  board found: {report['board_found']}  " +
+          f"pointer found: {report['pointer_found']}  zone changes: {report['zone_changes']}")
+    print(f"FPS: {report['fps']:.1f}")
+    print(f"{'':24}{'mean':>10}{'p50':>10}{'p95':>10}{'max':>10}")
+    rows = [('frame time (ms)', report['frame_time_ms'])]
+    rows += [(f"  {stage} (ms)", stats) for stage, stats in report['stage_time_ms'].items()]
+    for key, label in [('zone_change_latency_frames', 'zone latency (frames)'),
+                       ('zone_change_latency_ms', 'zone latency (ms)'),
+                       ('rotation_error_deg', 'rotation error (deg)'),
+                       ('translation_error_cm', 'translation error (cm)'),
+                       ('tip_error_cm', 'tip error (cm)')]:
+        if key in report:
+            rows.append((label, report[key]))
+    for label, stats in rows:
+        print(f"{label:24}{stats['mean']:10.3f}{stats['p50']:10.3f}{stats['p95']:10.3f}{stats['max']:10.3f}")
+
+
+# ========================================
+pixels_per_cm_obj = 118.49  # text-with-aruco.png
+focal_length_x = 1.88842395e+03
+focal_length_y = 1.89329463e+03
+camera_center_x = 9.21949329e+02
+camera_center_y = 3.34464319e+02
+distortion = np.array([0.09353041, -0.12232207, 0.00182885, -0.00131933, -0.30184632], dtype=np.float32) * 0
+# ========================================
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the CamIO processing path.')
+    parser.add_argument('--input1', help='Path to input zone image.', default='zone_map.png')
+    parser.add_argument('--video', help='Recorded video file, image directory or image sequence to replay instead of ' +
+                        'synthetic frames.')
+    parser.add_argument('--gray', help='Read the video as grayscale frames, as the stations do.', action='store_true')
+    parser.add_argument('--frames', help='Number of synthetic frames.', type=int, default=300)
+    parser.add_argument('--fps', help='Frame rate of the synthetic frames.', type=float, default=30.0)
+    parser.add_argument('--noise', help='Standard deviation of the noise added to synthetic frames.', type=float,
+                        default=2.0)
+    parser.add_argument('--downscale', help='Factor by which frames are downscaled for marker detection.',
+                        type=float, default=1.0)
+    parser.add_argument('--no-pointer-filter', help='Look up zones at the raw pointer tip of each frame.',
+                        action='store_true')
+    parser.add_argument('--audio', help='Dispatch zone sounds through the audio bank.', action='store_true')
+    parser.add_argument('--json', help='Save the report to this file.')
+    parser.add_argument('--baseline', help='Report of a previous run. Exits with an error if FPS regressed.')
+    parser.add_argument('--max-regression', help='Tolerated FPS drop with respect to the baseline.', type=float,
+                        default=0.1)
+    args = parser.parse_args()
+
+    if args.video is None:
+        # Synthetic frames are rendered with known intrinsics
+        focal_length_x = focal_length_y = 1400.0
+        camera_center_x, camera_center_y = 960.0, 540.0
+    elif os.path.isfile('camera_parameters.pkl'):
+        with open('camera_parameters.pkl', 'rb') as f:
+            params = pickle.load(f)
+            focal_length_x, focal_length_y, camera_center_x, camera_center_y = params[:4]
+            if len(params) > 4:
+                distortion = np.array(params[4:], dtype=np.float32)
+            print("loaded camera parameters from file.")
+    intrinsic_matrix = np.array([[focal_length_x, 0.00000000e+00, camera_center_x],
+                                 [0.00000000e+00, focal_length_y, camera_center_y],
+                                 [0.00000000e+00, 0.00000000e+00, 1.00000000e+00]], dtype=np.float32)
+
+    img_map_color = cv.imread(args.input1, cv.IMREAD_COLOR)
+    img_map = cv.cvtColor(img_map_color, cv.COLOR_BGR2GRAY)
+    # Same zone filter and pointer filter settings as simple_camio.py
+    zone_resolver = ZoneResolver(img_map, pixels_per_cm_obj, map_dict_ukraine.keys(),
+                                 10 if args.no_pointer_filter else 3)
+    pointer_filter = None if args.no_pointer_filter else PointerFilter()
+    processor = FrameProcessor(obj, intrinsic_matrix, distortion, zone_resolver, args.downscale, pointer_filter)
+
+    audio_bank = None
+    if args.audio:
+        from audio_bank import AudioBank
+        audio_bank = AudioBank('./MP3/', sound_dict_ukraine)
+        audio_bank.start()
+
+    if args.video is None:
+        source = SyntheticScene(img_map_color, pixels_per_cm_obj, intrinsic_matrix, args.frames, fps=args.fps,
+                                noise=args.noise)
+    else:
+        source = open_source(args.video, gray=args.gray)
+    report = run_benchmark(source, processor, zone_resolver, audio_bank, args.fps)
+    source.release()
+    if audio_bank is not None:
+        audio_bank.close()
+        report['audio'] = audio_bank.metrics()
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if report['fps'] < baseline['fps'] * (1 - args.max_regression):
+            print(f"FPS regressed: {report['fps']:.1f} < {baseline['fps']:.1f}")
+            sys.exit(1)
@@ -0,0 +1,119 @@
+import glob
+import os
+from dataclasses import dataclass
+import cv2 as cv
+import numpy as np
+from map_package import MapPackage
+from zone_resolver import ZoneResolver
+
+# Predefined 4x4 dictionaries by number of ids. Each one starts with the markers of the smaller ones, so a map
+# printed with ids 0-3 of DICT_4X4_50 is detected the same with DICT_4X4_1000.
+BOARD_DICTIONARIES = [(50, cv.aruco.DICT_4X4_50), (100, cv.aruco.DICT_4X4_100), (250, cv.aruco.DICT_4X4_250),
+                      (1000, cv.aruco.DICT_4X4_1000)]
+
+
+# Smallest 4x4 dictionary holding the marker ids up to max_id, as larger dictionaries take longer to match and
+# confuse more candidates with markers
+def board_dictionary(max_id):
+    for size, dictionary in BOARD_DICTIONARIES:
+        if max_id < size:
+            return dictionary
+    raise ValueError(f"marker id {max_id} is out of the 4x4 dictionaries")
+
+
+# Marker layout of a printed map: the ids of its markers and their corners in cm (4 rows per marker, in the order
+# of marker_ids), and the map package with its zones and sounds
+@dataclass(eq=False)
+class Board:
+    name: str
+    marker_ids: np.ndarray
+    obj: np.ndarray
+    package: str = ''
+
+
+# Boards with any number of markers each, looked up by marker id. board_of_id is a lookup table from marker id to
+# the index of its board (-1 for unused ids), so the boards in view are identified from the detected ids with an
+# array lookup and a bincount, however many maps are registered. BoardTracker finds the corners of each marker on
+# its board through a similar table (board_tracker.marker_slots).
+class BoardRegistry:
+    def __init__(self, boards):
+        self.boards = list(boards)
+        max_id = max((int(np.max(board.marker_ids)) for board in self.boards if len(board.marker_ids)), default=0)
+        self.dictionary = board_dictionary(max_id)
+        self.board_of_id = np.full(max_id + 1, -1, dtype=np.int32)
+        for index, board in enumerate(self.boards):
+            if len(board.obj) != 4 * len(board.marker_ids):
+                raise ValueError(f"{board.name} has {len(board.marker_ids)} markers but {len(board.obj)} corners")
+            for marker_id in board.marker_ids:
+                if self.board_of_id[marker_id] >= 0:
+                    raise ValueError(f"marker {marker_id} is on both {self.boards[self.board_of_id[marker_id]].name} " +
+                                     f"and {board.name}")
+                self.board_of_id[marker_id] = index
+
+    # Returns the board with the most markers among [ids] (as returned by detectMarkers), if it has at least
+    # min_markers of them, else None. Ids of no registered board are ignored.
+    def identify(self, ids, min_markers=1):
+        if ids is None or not self.boards:
+            return None
+        ids = np.ravel(ids)
+        ids = ids[(ids >= 0) & (ids < len(self.board_of_id))]
+        boards = self.board_of_id[ids]
+        boards = boards[boards >= 0]
+        if len(boards) == 0:
+            return None
+        counts = np.bincount(boards, minlength=len(self.boards))
+        best = int(np.argmax(counts))
+        return self.boards[best] if counts[best] >= min_markers else None
+
+
+# Zone resolver, zone names and sounds of the map on a board, as loaded by MapLibrary
+@dataclass
+class LoadedMap:
+    board: Board
+    package: MapPackage
+    zone_resolver: ZoneResolver
+
+    @property
+    def name(self):
+        return self.board.name
+
+    @property
+    def zone_names(self):
+        return self.package.zones
+
+
+# Library of map packages (.camio files in a directory, or a list of paths) a station can switch between. Only
+# the package metadata is read up front; the zone raster of a map is memory-mapped when it is first loaded.
+# zone_settings are passed on to the ZoneResolver of each map (filter_size, min_votes, dwell_frames).
+# FrameProcessor switches to a map once its board has been identified in switch_frames consecutive frames, and to
+# tell maps apart their markers must have different ids (see map_package.py build --first-id and --markers).
+class MapLibrary:
+    def __init__(self, packages, switch_frames=3, min_markers=1, **zone_settings):
+        if isinstance(packages, str):
+            packages = sorted(glob.glob(os.path.join(packages, '*.camio')))
+        self.packages = [MapPackage(path) for path in packages]
+        self.registry = BoardRegistry(Board(package.name or os.path.basename(package.path),
+                                            np.asarray(package.marker_ids, dtype=int), package.obj, package.path)
+                                      for package in self.packages)
+        self.switch_frames = switch_frames
+        self.min_markers = min_markers
+        self.zone_settings = zone_settings
+        self.loaded = {}  # board index -> LoadedMap
+
+    def __len__(self):
+        return len(self.packages)
+
+    # Returns the LoadedMap of [board], loading it on first use
+    def load(self, board):
+        index = self.registry.boards.index(board)
+        loaded = self.loaded.get(index)
+        if loaded is None:
+            package = self.packages[index]
+            zone_resolver = ZoneResolver(None, package.pixels_per_cm, package.zones.keys(), zone_map=package.zone_map,
+                                         **self.zone_settings)
+            loaded = self.loaded[index] = LoadedMap(board, package, zone_resolver)
+        return loaded
+
+    def describe(self):
+        return '\n'.join(f"{board.name}: markers {', '.join(map(str, board.marker_ids))}"
+                         for board in self.registry.boards)
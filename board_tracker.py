@@ -0,0 +1,133 @@
+import cv2 as cv
+import numpy as np
+
+
+# Lookup table from marker id to the index of the marker in marker_ids, -1 for the ids not in it
+def marker_slots(marker_ids):
+    marker_ids = np.asarray(marker_ids, dtype=int)
+    slot_of_id = np.full(marker_ids.max() + 1 if len(marker_ids) else 0, -1, dtype=np.int32)
+    slot_of_id[marker_ids] = np.arange(len(marker_ids))
+    return slot_of_id
+
+
+# Function to sort corners by id based on how they are arranged: the corners of the marker in slot s (looked up in
+# slot_of_id, by default the ids 0 to len(scene) / 4 - 1) go to rows 4s to 4s + 3 of scene. Other ids are ignored.
+def sort_corners_by_id(corners, ids, scene, slot_of_id=None):
+    use_index = np.zeros(len(scene), dtype=bool)
+    if ids is None:
+        return scene, use_index
+    if slot_of_id is None:
+        slot_of_id = np.arange(len(scene) // 4)
+    ids = ids.ravel()
+    known = (ids >= 0) & (ids < len(slot_of_id))
+    slots = np.full(len(ids), -1)
+    slots[known] = slot_of_id[ids[known]]
+    for i in np.flatnonzero(slots >= 0):
+        slot = slots[i]
+        scene[4 * slot:4 * slot + 4, :] = corners[i][0]
+        use_index[4 * slot:4 * slot + 4] = True
+    return scene, use_index
+
+
+# Mean distance in pixels between the observed corners and the corners reprojected with rvec/tvec
+def reprojection_error(obj_pts, scene_pts, rvec, tvec, intrinsic_matrix, distortion=None):
+    backprojection_pts, _ = cv.projectPoints(obj_pts, rvec, tvec, intrinsic_matrix, distortion)
+    return float(np.mean(np.linalg.norm(backprojection_pts.reshape(-1, 2) - scene_pts, axis=1)))
+
+
+# Tracks the pose of the map markers from frame to frame. obj holds the 4 corners of each marker, in the order of
+# marker_ids (by default 0, 1, 2...); a pose is solved from however many of them are found, so boards with more
+# markers are tracked through larger occlusions.
+# Once the board has been found, markers are only searched in small regions around the corners predicted by the last
+# pose (all of them in one detection pass over a mosaic of the regions), and solvePnP is warm-started from that pose. A
+# full-frame search is only run when no marker is found in the regions or when the reprojection error jumps.
+class BoardTracker:
+    def __init__(self, obj, intrinsic_matrix, detector, name='board', roi_margin=30,
+                 max_reprojection_error=2.0, error_jump_ratio=3.0, distortion=None, marker_ids=None):
+        self.obj = obj
+        self.marker_ids = np.arange(len(obj) // 4) if marker_ids is None else np.asarray(marker_ids, dtype=int)
+        self.slot_of_id = marker_slots(self.marker_ids)
+        self.intrinsic_matrix = intrinsic_matrix
+        self.distortion = distortion
+        self.detector = detector  # ArucoDetector holding the dictionary [name] of the map markers
+        self.name = name
+        self.roi_margin = roi_margin  # minimum margin around each marker in pixels
+        self.max_reprojection_error = max_reprojection_error  # errors below this never trigger a full search
+        self.error_jump_ratio = error_jump_ratio  # error increase over the running mean that triggers a full search
+
+        self.scene = np.empty((len(obj), 2), dtype=np.float32)
+        self.use_index = np.zeros(len(obj), dtype=bool)
+        self.rvec = None
+        self.tvec = None
+        self.mean_error = None
+        self.full_searches = 0
+        self.roi_searches = 0
+
+    def reset(self):
+        self.rvec = None
+        self.tvec = None
+        self.mean_error = None
+
+    # Returns (rvec, tvec) of the board in the image, or None if the board was not found
+    def track(self, img_scene):
+        self.detector.set_image(img_scene)
+        if self.rvec is not None:
+            pose = self._track_rois(img_scene)
+            if pose is not None:
+                return pose
+        return self._full_search()
+
+    def _full_search(self):
+        self.full_searches += 1
+        self.reset()
+        corners, ids = self.detector.detect(self.name)
+        self.scene, self.use_index = sort_corners_by_id(corners, ids, self.scene, self.slot_of_id)
+        if not any(self.use_index):
+            return None
+        return self._solve(use_guess=False)
+
+    def _track_rois(self, img_scene):
+        self.roi_searches += 1
+        predicted_pts, _ = cv.projectPoints(self.obj, self.rvec, self.tvec, self.intrinsic_matrix, self.distortion)
+        predicted_pts = predicted_pts.reshape(-1, 4, 2)
+        height, width = img_scene.shape[:2]
+
+        regions = []
+        for marker_pts in predicted_pts:
+            x0, y0 = marker_pts.min(axis=0)
+            x1, y1 = marker_pts.max(axis=0)
+            margin = max(self.roi_margin, 0.5 * max(x1 - x0, y1 - y0))
+            x0 = int(max(x0 - margin, 0))
+            y0 = int(max(y0 - margin, 0))
+            x1 = int(min(x1 + margin, width))
+            y1 = int(min(y1 + margin, height))
+            if x1 - x0 < 2 * self.roi_margin or y1 - y0 < 2 * self.roi_margin:
+                continue  # marker predicted out of the image
+            regions.append((x0, y0, x1, y1))
+        if not regions:
+            return None
+
+        corners, ids = self.detector.detect_regions(self.name, regions)
+        self.scene, self.use_index = sort_corners_by_id(corners, ids, self.scene, self.slot_of_id)
+        if not any(self.use_index):
+            return None
+        return self._solve(use_guess=True)
+
+    def _solve(self, use_guess):
+        obj_pts = self.obj[self.use_index, :]
+        scene_pts = self.scene[self.use_index, :]
+        if use_guess:
+            retval, rvec, tvec = cv.solvePnP(obj_pts, scene_pts, self.intrinsic_matrix, self.distortion,
+                                             self.rvec.copy(), self.tvec.copy(), useExtrinsicGuess=True)
+        else:
+            retval, rvec, tvec = cv.solvePnP(obj_pts, scene_pts, self.intrinsic_matrix, self.distortion)
+        if not retval:
+            return None
+
+        error = reprojection_error(obj_pts, scene_pts, rvec, tvec, self.intrinsic_matrix, self.distortion)
+        if use_guess and error > max(self.max_reprojection_error, self.error_jump_ratio * self.mean_error):
+            return None
+        self.mean_error = error if self.mean_error is None else 0.9 * self.mean_error + 0.1 * error
+        self.rvec = rvec
+        self.tvec = tvec
+        return rvec, tvec
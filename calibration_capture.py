@@ -0,0 +1,139 @@
+import threading
+import cv2 as cv
+import numpy as np
+from calibration_solver import calibrate
+
+
+# Pose features used to compare calibration views: board normal in camera coordinates, distance to the board,
+# and center and area of the board in the image (relative to the frame size)
+def pose_features(rvec, tvec, scene_pts, frame_size):
+    R, _ = cv.Rodrigues(rvec)
+    normal = R[:, 2] if R[2, 2] >= 0 else -R[:, 2]
+    width, height = frame_size
+    hull = cv.convexHull(scene_pts.astype(np.float32))
+    return {'normal': normal,
+            'distance': float(np.linalg.norm(tvec)),
+            'center': np.mean(scene_pts, axis=0) / (width, height),
+            'area': cv.contourArea(hull) / (width * height)}
+
+
+# Variance of the Laplacian in the bounding box of the board, higher is sharper
+def board_sharpness(img_gray, scene_pts):
+    x0, y0 = np.maximum(np.floor(scene_pts.min(axis=0)).astype(int), 0)
+    x1, y1 = np.ceil(scene_pts.max(axis=0)).astype(int) + 1
+    roi = img_gray[y0:y1, x0:x1]
+    if roi.size == 0:
+        return 0.0
+    return float(cv.Laplacian(roi, cv.CV_64F).var())
+
+
+# Picks informative calibration views: a view is kept if the board is sharp, held still and its pose differs from
+# every view already collected by at least one step in viewing angle, distance or position in the image.
+class PoseDiversitySelector:
+    def __init__(self, angle_step=10.0, distance_step=0.15, position_step=0.15, min_sharpness=50.0,
+                 max_motion=1.0, min_corners=12):
+        self.angle_step = angle_step  # degrees between board normals
+        self.distance_step = distance_step  # difference of log distances
+        self.position_step = position_step  # distance between board centers, relative to the frame size
+        self.min_sharpness = min_sharpness
+        self.max_motion = max_motion  # mean corner motion in pixels since the previous frame
+        self.min_corners = min_corners
+        self.views = []
+        self.prev_scene_pts = None
+
+    # Novelty of a view: 0 for a pose already collected, >= 1 once it differs by a full step from all the views
+    def novelty(self, features):
+        if len(self.views) == 0:
+            return np.inf
+        scores = []
+        for view in self.views:
+            angle = np.degrees(np.arccos(np.clip(np.dot(features['normal'], view['normal']), -1.0, 1.0)))
+            distance = abs(np.log(features['distance'] / view['distance']))
+            position = np.linalg.norm(features['center'] - view['center'])
+            scores.append(max(angle / self.angle_step, distance / self.distance_step, position / self.position_step))
+        return float(min(scores))
+
+    # Returns True if the view should be added to the calibration, in which case it is recorded
+    def consider(self, img_gray, rvec, tvec, scene_pts):
+        prev_scene_pts = self.prev_scene_pts
+        self.prev_scene_pts = scene_pts.copy()
+        if len(scene_pts) < self.min_corners:
+            return False
+        if prev_scene_pts is None or prev_scene_pts.shape != scene_pts.shape or \
+                np.mean(np.linalg.norm(scene_pts - prev_scene_pts, axis=1)) > self.max_motion:
+            return False
+        features = pose_features(rvec, tvec, scene_pts, (img_gray.shape[1], img_gray.shape[0]))
+        if self.novelty(features) < 1.0:
+            return False
+        if board_sharpness(img_gray, scene_pts) < self.min_sharpness:
+            return False
+        self.views.append(features)
+        return True
+
+
+# Re-solves the calibration in the background every time a view is added, warm-started from the last solution.
+# converged is set once there are at least min_views views and the relative standard deviation of fx, fy, cx and
+# cy stays below tolerance for stable_solves solves in a row.
+class BackgroundCalibrator(threading.Thread):
+    def __init__(self, initial, initial_distortion=None, estimate_distortion=False, tolerance=0.005, min_views=6,
+                 stable_solves=3):
+        super().__init__(name="BackgroundCalibrator", daemon=True)
+        self.initial = list(initial)
+        self.initial_distortion = initial_distortion
+        self.estimate_distortion = estimate_distortion
+        self.tolerance = tolerance
+        self.min_views = min_views
+        self.stable_solves = stable_solves
+
+        self.lock = threading.Lock()
+        self.new_view = threading.Event()
+        self.converged = threading.Event()
+        self.stop_event = threading.Event()
+        self.obj_list = []
+        self.scene_list = []
+        self.result = None
+        self.stable_count = 0
+
+    def add_view(self, obj_pts, scene_pts):
+        with self.lock:
+            self.obj_list.append(obj_pts.copy())
+            self.scene_list.append(scene_pts.copy())
+        self.new_view.set()
+
+    def view_count(self):
+        with self.lock:
+            return len(self.obj_list)
+
+    def stop(self):
+        self.stop_event.set()
+        self.new_view.set()
+        self.join(timeout=1.0)
+
+    def run(self):
+        while not self.stop_event.is_set() and not self.converged.is_set():
+            self.new_view.wait()
+            self.new_view.clear()
+            if self.stop_event.is_set():
+                break
+            with self.lock:
+                obj_list = list(self.obj_list)
+                scene_list = list(self.scene_list)
+
+            # The camera center can only be estimated from several views at different angles
+            fixed = () if len(obj_list) >= 3 else ('cx', 'cy')
+            if self.result is None:
+                initial, initial_distortion = self.initial, self.initial_distortion
+            else:
+                initial, initial_distortion = self.result.parameters()[:4], self.result.distortion
+            result = calibrate(obj_list, scene_list, initial, initial_distortion, self.estimate_distortion, fixed)
+            self.result = result
+
+            values = result.parameters()
+            relative_std = [result.std.get(name, np.inf) / abs(value)
+                            for name, value in zip(['fx', 'fy', 'cx', 'cy'], values)]
+            if len(obj_list) >= self.min_views and max(relative_std) < self.tolerance:
+                self.stable_count += 1
+            else:
+                self.stable_count = 0
+            if self.stable_count >= self.stable_solves:
+                self.converged.set()
@@ -0,0 +1,158 @@
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import cv2 as cv
+import numpy as np
+from scipy import optimize, sparse
+
+# Camera parameters in the order they are stored in the parameter vector
+INTRINSIC_NAMES = ['fx', 'fy', 'cx', 'cy', 'k1', 'k2', 'p1', 'p2', 'k3']
+
+
+@dataclass
+class CalibrationResult:
+    intrinsic_matrix: np.ndarray
+    distortion: np.ndarray
+    std: dict  # standard deviation of each estimated camera parameter
+    covariance: np.ndarray  # covariance of the estimated camera parameters, in the order of names
+    names: list
+    rvecs: np.ndarray
+    tvecs: np.ndarray
+    rms_error: float  # RMS reprojection error in pixels
+    view_errors: np.ndarray  # mean reprojection error of each view in pixels
+
+    # Parameters as saved in camera_parameters.pkl
+    def parameters(self):
+        return [float(self.intrinsic_matrix[0, 0]), float(self.intrinsic_matrix[1, 1]),
+                float(self.intrinsic_matrix[0, 2]), float(self.intrinsic_matrix[1, 2])] + \
+            [float(d) for d in self.distortion]
+
+
+# Loads [fx, fy, cx, cy] and the distortion (None if not saved) from a camera_parameters.pkl file
+def load_camera_parameters(path='camera_parameters.pkl'):
+    if not os.path.isfile(path):
+        return None, None
+    with open(path, 'rb') as f:
+        params = pickle.load(f)
+    distortion = np.array(params[4:], dtype=np.float32) if len(params) > 4 else None
+    return list(params[:4]), distortion
+
+
+# Rotation matrices of an array of rotation vectors (N x 3)
+def rodrigues(rvecs):
+    theta = np.linalg.norm(rvecs, axis=1)
+    k = rvecs / np.maximum(theta, 1e-12)[:, None]
+    K = np.zeros((len(rvecs), 3, 3))
+    K[:, 0, 1] = -k[:, 2]
+    K[:, 0, 2] = k[:, 1]
+    K[:, 1, 0] = k[:, 2]
+    K[:, 1, 2] = -k[:, 0]
+    K[:, 2, 0] = -k[:, 1]
+    K[:, 2, 1] = k[:, 0]
+    sin = np.sin(theta)[:, None, None]
+    cos = np.cos(theta)[:, None, None]
+    return np.eye(3)[None] + sin * K + (1 - cos) * (K @ K)
+
+
+# Projects points (N x 3) seen from the views view_index (N) with poses rvecs/tvecs (V x 3) and camera parameters
+def project_points(obj_pts, view_index, rvecs, tvecs, intrinsics):
+    fx, fy, cx, cy, k1, k2, p1, p2, k3 = intrinsics
+    R = rodrigues(rvecs)[view_index]
+    pts = np.einsum('nij,nj->ni', R, obj_pts) + tvecs[view_index]
+    x = pts[:, 0] / pts[:, 2]
+    y = pts[:, 1] / pts[:, 2]
+    r2 = x * x + y * y
+    radial = 1 + r2 * (k1 + r2 * (k2 + r2 * k3))
+    x_d = x * radial + 2 * p1 * x * y + p2 * (r2 + 2 * x * x)
+    y_d = y * radial + p1 * (r2 + 2 * y * y) + 2 * p2 * x * y
+    return np.stack([fx * x_d + cx, fy * y_d + cy], axis=1)
+
+
+def intrinsic_matrix_from(intrinsics):
+    fx, fy, cx, cy = intrinsics[:4]
+    return np.array([[fx, 0.0, cx], [0.0, fy, cy], [0.0, 0.0, 1.0]], dtype=np.float32)
+
+
+# Pose of a single view, used to warm-start the solver. Module level so that it can run in a process pool.
+def solve_view_pose(obj, scene, intrinsics):
+    retval, rvec, tvec = cv.solvePnP(obj, scene, intrinsic_matrix_from(intrinsics), np.float32(intrinsics[4:]))
+    return rvec.ravel(), tvec.ravel()
+
+
+# Estimates the camera parameters from several views of the board with scipy.optimize.least_squares.
+# All views are solved jointly: the unknowns are the free camera parameters and the pose of every view, and the
+# residuals are the reprojection offsets of all corners, computed in one vectorized pass. initial is
+# [fx, fy, cx, cy] (e.g. from camera_parameters.pkl) and initial_distortion the 5 distortion coefficients.
+# Parameters in fixed are kept at their initial value, distortion is only estimated if estimate_distortion is set
+# and equal_focal ties fy to fx. With workers > 1 the initial pose of each view is solved in a process pool, on
+# platforms that can fork: spawned workers would re-run the calling script, which has no __main__ guard.
+def calibrate(obj_list, scene_list, initial, initial_distortion=None, estimate_distortion=False, fixed=(),
+              equal_focal=False, workers=1):
+    intrinsics = np.zeros(len(INTRINSIC_NAMES))
+    intrinsics[:4] = initial
+    if initial_distortion is not None:
+        intrinsics[4:] = np.ravel(initial_distortion)[:5]
+    free = np.array([name not in fixed for name in INTRINSIC_NAMES])
+    if not estimate_distortion:
+        free[4:] = False
+    if equal_focal:
+        free[1] = False
+        intrinsics[1] = intrinsics[0]
+
+    # Initial pose of each view
+    obj_list = [np.asarray(o, dtype=np.float32) for o in obj_list]
+    scene_list = [np.asarray(s, dtype=np.float32) for s in scene_list]
+    if workers > 1 and len(obj_list) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            poses = list(pool.map(solve_view_pose, obj_list, scene_list, [intrinsics] * len(obj_list)))
+    else:
+        poses = [solve_view_pose(o, s, intrinsics) for o, s in zip(obj_list, scene_list)]
+
+    n_views = len(obj_list)
+    n_free = int(np.count_nonzero(free))
+    obj_pts = np.concatenate(obj_list).astype(np.float64)
+    observed = np.concatenate(scene_list).astype(np.float64)
+    view_index = np.concatenate([np.full(len(o), i) for i, o in enumerate(obj_list)])
+
+    def unpack(x):
+        values = intrinsics.copy()
+        values[free] = x[:n_free]
+        if equal_focal:
+            values[1] = values[0]
+        views = x[n_free:].reshape(n_views, 6)
+        return values, views[:, :3], views[:, 3:]
+
+    def residuals(x):
+        values, rvecs, tvecs = unpack(x)
+        return (project_points(obj_pts, view_index, rvecs, tvecs, values) - observed).ravel()
+
+    # Each residual only depends on the camera parameters and the pose of its own view
+    rows = np.arange(2 * len(obj_pts))
+    point_view = np.repeat(view_index, 2)
+    jac_sparsity = sparse.lil_matrix((len(rows), n_free + 6 * n_views), dtype=int)
+    jac_sparsity[:, :n_free] = 1
+    for j in range(6):
+        jac_sparsity[rows, n_free + 6 * point_view + j] = 1
+
+    x0 = np.concatenate([intrinsics[free]] + [np.concatenate(pose) for pose in poses])
+    solution = optimize.least_squares(residuals, x0, jac_sparsity=jac_sparsity, x_scale='jac', method='trf')
+
+    values, rvecs, tvecs = unpack(solution.x)
+    offsets = solution.fun.reshape(-1, 2)
+    distances = np.linalg.norm(offsets, axis=1)
+    view_errors = np.array([np.mean(distances[view_index == i]) for i in range(n_views)])
+
+    # Covariance of the camera parameters from the Jacobian at the solution
+    jac = solution.jac.toarray() if sparse.issparse(solution.jac) else solution.jac
+    dof = max(len(solution.fun) - len(solution.x), 1)
+    sigma2 = 2 * solution.cost / dof
+    covariance = np.linalg.pinv(jac.T @ jac)[:n_free, :n_free] * sigma2
+    names = [name for name, f in zip(INTRINSIC_NAMES, free) if f]
+    std = dict(zip(names, np.sqrt(np.diag(covariance))))
+
+    return CalibrationResult(intrinsic_matrix=intrinsic_matrix_from(values),
+                             distortion=values[4:].astype(np.float32),
+                             std=std, covariance=covariance, names=names, rvecs=rvecs, tvecs=tvecs,
+                             rms_error=float(np.sqrt(np.mean(distances ** 2))), view_errors=view_errors)
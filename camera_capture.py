@@ -0,0 +1,323 @@
+import glob
+import os
+import threading
+import time
+import cv2 as cv
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+# Fixed ring of up to [size] reusable frame buffers. A buffer is out from the time a frame is read into it until the
+# frame is handed back with release(), which the consumers do once they no longer use it (CameraPipeline does it
+# for the frames it drops and for each result once the next one is taken), so a frame in use is never overwritten.
+# [size] should cover the depth of the pipeline; when every buffer is out, frames are allocated and not pooled.
+class FramePool:
+    def __init__(self, size=8):
+        self.size = size
+        self.buffers = []
+        self.free = []
+        self.lock = threading.Lock()
+        self.reused = 0
+        self.allocated = 0
+
+    # Returns a free buffer, or None to let the reader allocate one
+    def take(self):
+        with self.lock:
+            return self.free.pop() if self.free else None
+
+    # Called with the frame that was read into [buffer]: counts the reuse, or keeps a newly allocated frame
+    def give(self, buffer, frame):
+        if frame is buffer:
+            self.reused += 1
+            return
+        self.allocated += 1
+        with self.lock:
+            if buffer is not None and (frame.shape, frame.dtype) == (buffer.shape, buffer.dtype):
+                self.free.append(buffer)  # the reader allocated its own frame (e.g. cv.imdecode), buffer unused
+            elif buffer is not None:
+                self.buffers[self._slot(buffer)] = frame  # the size or type of the frames changed
+            elif len(self.buffers) < self.size:
+                self.buffers.append(frame)
+
+    # Hands the buffer of [frame] back for reuse. Frames that are not pooled, or already released, are ignored.
+    def release(self, frame):
+        with self.lock:
+            slot = self._slot(frame)
+            if slot is not None and not any(buffer is frame for buffer in self.free):
+                self.free.append(frame)
+
+    def _slot(self, frame):
+        for slot, buffer in enumerate(self.buffers):
+            if buffer is frame:
+                return slot
+        return None
+
+
+# Converts a frame as delivered by the backend with RGB conversion off into a grayscale image, in [buffer] when
+# possible: YUYV frames arrive as two channels of which the Y one is kept, and backends that ignore the setting
+# still deliver BGR. MJPG frames arrive as a single row of JPEG bytes and only their luminance is decoded, into a new
+# array as cv.imdecode can't decode into a buffer. Frames that are already gray are copied, as [raw] is read into
+# again by the next read.
+def to_gray(raw, buffer=None):
+    if raw.ndim == 2 and raw.shape[0] == 1:
+        return cv.imdecode(raw, cv.IMREAD_GRAYSCALE)
+    if raw.ndim == 3 and raw.shape[2] == 2:
+        return cv.cvtColor(raw, cv.COLOR_YUV2GRAY_YUYV, dst=buffer)
+    if raw.ndim == 3:
+        return cv.cvtColor(raw, cv.COLOR_BGR2GRAY, dst=buffer)
+    if buffer is None or buffer.shape != raw.shape or buffer.dtype != raw.dtype:
+        return raw.copy()
+    np.copyto(buffer, raw)
+    return buffer
+
+
+# Frame source with the grab()/read()/isOpened()/release() interface of cv.VideoCapture used by the pipeline.
+# Frames are read into the buffers of a FramePool instead of a new array each time, and handed back with
+# release_frame() once used (except for gray MJPG frames, which are decoded into new arrays). With gray, frames are
+# single-channel images, decoded as such when the backend allows it. With realtime, frames are delivered no faster
+# than fps, as a camera would.
+class FrameSource:
+    def __init__(self, gray=False, pool_size=8, fps=None, realtime=False):
+        self.gray = gray
+        self.pool = FramePool(pool_size)
+        self.fps = fps
+        self.realtime = realtime
+        self.next_frame = None
+        self.frames = 0
+
+    def isOpened(self):
+        return False
+
+    def grab(self):
+        self._pace()
+        return self._grab()
+
+    def read(self):
+        self._pace()
+        buffer = self.pool.take()
+        ret, frame = self._read(buffer)
+        if not ret or frame is None:
+            if buffer is not None:
+                self.pool.release(buffer)
+            return False, None
+        self.pool.give(buffer, frame)
+        self.frames += 1
+        return True, frame
+
+    def release(self):
+        pass
+
+    # Hands a frame returned by read() back, so that its buffer can be read into again
+    def release_frame(self, frame):
+        self.pool.release(frame)
+
+    # One line describing the source and its negotiated settings
+    def describe(self):
+        return type(self).__name__
+
+    def stats(self):
+        return {'frames': self.frames, 'buffers': len(self.pool.buffers), 'buffers_reused': self.pool.reused,
+                'buffers_allocated': self.pool.allocated}
+
+    def _grab(self):
+        return self._read(None)[0]
+
+    def _read(self, buffer):
+        return False, None
+
+    def _pace(self):
+        if not self.realtime or not self.fps:
+            return
+        now = time.monotonic()
+        if self.next_frame is None or self.next_frame < now:
+            self.next_frame = now
+        else:
+            time.sleep(self.next_frame - now)
+        self.next_frame += 1.0 / self.fps
+
+
+# Video file, stream URL or printf-style image sequence (frames/%04d.png) read through cv.VideoCapture
+class VideoSource(FrameSource):
+    def __init__(self, path, gray=False, pool_size=8, realtime=False):
+        self.path = path
+        self.cap = cv.VideoCapture(path)
+        fps = self.cap.get(cv.CAP_PROP_FPS) if self.cap.isOpened() else 0.0
+        super().__init__(gray, pool_size, fps or 30.0, realtime)
+        self.raw = None  # frame before the grayscale conversion, reused as to_gray never hands it out
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def release(self):
+        self.cap.release()
+
+    def describe(self):
+        width = int(self.cap.get(cv.CAP_PROP_FRAME_WIDTH))
+        height = int(self.cap.get(cv.CAP_PROP_FRAME_HEIGHT))
+        return f"{self.path}: {width}x{height} at {self.fps:g} FPS{' gray' if self.gray else ''}"
+
+    def _grab(self):
+        return self.cap.grab()
+
+    def _read(self, buffer):
+        if not self.gray:
+            return self.cap.read(buffer)
+        ret, self.raw = self.cap.read(self.raw)
+        return ret, to_gray(self.raw, buffer) if ret else None
+
+
+# Directory or glob pattern of images, read in name order at fps. With loop, starts over after the last image.
+class ImageSequenceSource(FrameSource):
+    def __init__(self, pattern, gray=False, fps=30.0, realtime=False, loop=False):
+        super().__init__(gray, 0, fps, realtime)
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*')
+        self.pattern = pattern
+        self.paths = sorted(path for path in glob.glob(pattern)
+                            if os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS)
+        self.loop = loop
+        self.index = 0
+
+    def isOpened(self):
+        return bool(self.paths)
+
+    def describe(self):
+        return f"{self.pattern}: {len(self.paths)} images at {self.fps:g} FPS{' gray' if self.gray else ''}"
+
+    def _grab(self):
+        return self._next() is not None
+
+    # cv.imread can't read into a buffer, so images are allocated as they are decoded
+    def _read(self, buffer):
+        path = self._next()
+        if path is None:
+            return False, None
+        frame = cv.imread(path, cv.IMREAD_GRAYSCALE if self.gray else cv.IMREAD_COLOR)
+        return frame is not None, frame
+
+    def _next(self):
+        if self.index >= len(self.paths):
+            if not self.loop or not self.paths:
+                return None
+            self.index = 0
+        self.index += 1
+        return self.paths[self.index - 1]
+
+
+# Settings a camera is asked for. Many UVC webcams only reach their full frame rate at 1080p with MJPG; uncompressed
+# YUYV is limited by USB bandwidth to a few FPS.
+DEFAULT_CAMERA_SETTINGS = {'width': 1920, 'height': 1080, 'fps': 30.0, 'fourcc': 'MJPG', 'buffer_size': 1}
+
+
+def fourcc_name(code):
+    code = int(code)
+    return ''.join(chr((code >> shift) & 0xFF) for shift in (0, 8, 16, 24)).strip('\0') if code else ''
+
+
+# Camera by index. The format, size, frame rate and driver buffer size are requested in the order V4L2 needs (the
+# format first, as it limits the sizes and rates on offer) and read back, and [granted] holds what the camera
+# actually runs at. Autofocus is turned off and the focus set to [focus]. With gray, RGB conversion is turned off in
+# the backend, so MJPG frames only have their luminance decoded and YUYV frames are not converted at all.
+class CameraSource(FrameSource):
+    def __init__(self, index, gray=False, pool_size=8, width=1920, height=1080, fps=30.0, fourcc='MJPG',
+                 buffer_size=1, focus=0, api=cv.CAP_ANY):
+        super().__init__(gray, pool_size)
+        self.index = index
+        self.requested = {'fourcc': fourcc, 'width': width, 'height': height, 'fps': fps,
+                          'buffer_size': buffer_size}
+        self.cap = cv.VideoCapture(index, api)
+        self.granted = {}
+        self.raw = None  # undecoded frame in gray mode, reused as to_gray never hands it out
+        if not self.cap.isOpened():
+            return
+        if fourcc:
+            self.cap.set(cv.CAP_PROP_FOURCC, cv.VideoWriter_fourcc(*fourcc))
+        self.cap.set(cv.CAP_PROP_FRAME_WIDTH, width)
+        self.cap.set(cv.CAP_PROP_FRAME_HEIGHT, height)
+        if fps:
+            self.cap.set(cv.CAP_PROP_FPS, fps)
+        self.cap.set(cv.CAP_PROP_BUFFERSIZE, buffer_size)
+        self.cap.set(cv.CAP_PROP_AUTOFOCUS, 0)
+        self.cap.set(cv.CAP_PROP_FOCUS, focus)
+        if gray:
+            self.cap.set(cv.CAP_PROP_CONVERT_RGB, 0)
+        self.granted = {'fourcc': fourcc_name(self.cap.get(cv.CAP_PROP_FOURCC)),
+                        'width': int(self.cap.get(cv.CAP_PROP_FRAME_WIDTH)),
+                        'height': int(self.cap.get(cv.CAP_PROP_FRAME_HEIGHT)),
+                        'fps': self.cap.get(cv.CAP_PROP_FPS),
+                        'buffer_size': int(self.cap.get(cv.CAP_PROP_BUFFERSIZE))}
+        self.fps = self.granted['fps']
+
+    # Requested settings the camera didn't grant, as name -> (requested, granted). Settings the backend can't read
+    # back (reported as 0) are not listed.
+    def mismatches(self):
+        mismatches = {}
+        for name, requested in self.requested.items():
+            granted = self.granted.get(name)
+            if not requested or not granted:
+                continue
+            if (abs(granted - requested) > 0.5) if name == 'fps' else (granted != requested):
+                mismatches[name] = (requested, granted)
+        return mismatches
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def release(self):
+        self.cap.release()
+
+    def describe(self):
+        if not self.granted:
+            return f"camera {self.index}: not opened"
+        granted = self.granted
+        text = (f"camera {self.index}: {granted['fourcc'] or '?'} {granted['width']}x{granted['height']} at " +
+                f"{granted['fps']:g} FPS, buffer {granted['buffer_size']}{' gray' if self.gray else ''}")
+        mismatches = self.mismatches()
+        if mismatches:
+            asked = ', '.join(f"{name} {requested}" for name, (requested, _) in mismatches.items())
+            text += f" (asked for {asked})"
+        return text
+
+    def _grab(self):
+        return self.cap.grab()
+
+    def _read(self, buffer):
+        if not self.gray:
+            return self.cap.read(buffer)
+        ret, self.raw = self.cap.read(self.raw)
+        return ret, to_gray(self.raw, buffer) if ret else None
+
+
+# Opens a frame source: a camera index (an int, or a string of digits), a directory or glob pattern of images, or a
+# video file, printf-style image sequence or stream URL. camera_settings override DEFAULT_CAMERA_SETTINGS for
+# cameras; realtime paces files at their frame rate.
+def open_source(source, gray=False, realtime=False, pool_size=8, **camera_settings):
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    if isinstance(source, int):
+        return CameraSource(source, gray, pool_size, **{**DEFAULT_CAMERA_SETTINGS, **camera_settings})
+    if os.path.isdir(source) or any(c in source for c in '*?['):
+        return ImageSequenceSource(source, gray, camera_settings.get('fps') or 30.0, realtime)
+    return VideoSource(source, gray, pool_size, realtime)
+
+
+# Opens the frame source on its own thread, as opening and configuring a camera is often the slowest step of startup
+class CameraOpener(threading.Thread):
+    def __init__(self, source, **options):
+        super().__init__(name="CameraOpener", daemon=True)
+        self.source = source
+        self.options = options
+        self.cap = None
+        self.started = None
+        self.finished = None
+
+    def run(self):
+        self.started = time.perf_counter()
+        self.cap = open_source(self.source, **self.options)
+        self.finished = time.perf_counter()
+
+    # Waits for the source and returns it
+    def result(self):
+        self.join()
+        return self.cap
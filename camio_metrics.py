@@ -0,0 +1,237 @@
+import bisect
+import contextlib
+import csv
+import http.server
+import math
+import threading
+import time
+
+# Upper bounds in seconds of the latency histogram buckets: 10 per decade from 10 us to 10 s, then overflow
+BUCKET_BOUNDS = [10 ** (exponent / 10) for exponent in range(-50, 11)] + [math.inf]
+
+
+# Latency histogram with fixed log-spaced buckets, so observing a value is a bisection and a few additions.
+# Percentiles are the upper bound of the bucket they fall in (within 26% of the true value), capped at the maximum.
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKET_BOUNDS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def copy(self):
+        histogram = Histogram()
+        histogram.counts = list(self.counts)
+        histogram.count = sum(histogram.counts)
+        histogram.sum = self.sum
+        histogram.max = self.max
+        return histogram
+
+    # Histogram of the values observed since [older], a copy of this histogram taken earlier
+    def since(self, older):
+        histogram = Histogram()
+        histogram.counts = [new - old for new, old in zip(self.counts, older.counts)]
+        histogram.count = sum(histogram.counts)
+        histogram.sum = self.sum - older.sum
+        last = max((i for i, count in enumerate(histogram.counts) if count), default=None)
+        histogram.max = 0.0 if last is None else min(BUCKET_BOUNDS[last], self.max)
+        return histogram
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def percentile(self, q):
+        if self.count == 0:
+            return 0.0
+        rank = q / 100 * self.count
+        cumulative = 0
+        for bound, count in zip(BUCKET_BOUNDS, self.counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                return min(bound, self.max)
+        return self.max
+
+
+# Counters, gauges and latency histograms of a running station.
+# Each counter and histogram should only be written by one thread (e.g. one pipeline stage), as with
+# PipelineCounters, so recording takes no lock; readers get slightly stale values at worst. Existing metrics such as
+# PipelineCounters or AudioBank.metrics() are read when a snapshot is taken, through add_source().
+class Metrics:
+    def __init__(self):
+        self.start = time.monotonic()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.sources = []  # functions returning a dict of gauge values
+        self._lock = threading.Lock()
+
+    def increment(self, name, count=1):
+        self.counters[name] = self.counters.get(name, 0) + count
+
+    def set_gauge(self, name, value):
+        self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        histogram.observe(seconds)
+
+    # Observes the time spent in the block in histogram [name]
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    # Adds a function returning a dict of values (e.g. vars(pipeline.counters)), read as gauges on each snapshot.
+    # Non-numeric values are ignored.
+    def add_source(self, source, prefix=''):
+        self.sources.append((source, prefix))
+
+    # Returns (uptime, counters, gauges, histograms), with copies of the histograms
+    def snapshot(self):
+        gauges = dict(self.gauges)
+        for source, prefix in self.sources:
+            for name, value in source().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    gauges[prefix + name] = value
+        with self._lock:
+            histograms = {name: histogram.copy() for name, histogram in self.histograms.items()}
+        return time.monotonic() - self.start, dict(self.counters), gauges, histograms
+
+    # Metrics in the Prometheus text format: counters, gauges, and the histograms as summaries in seconds
+    def text(self):
+        uptime, counters, gauges, histograms = self.snapshot()
+        lines = [f"camio_uptime_seconds {uptime:.3f}"]
+        for name, value in sorted(counters.items()):
+            lines.append(f"camio_{name}_total {value}")
+        for name, value in sorted(gauges.items()):
+            lines.append(f"camio_{name} {value:g}")
+        for name, histogram in sorted(histograms.items()):
+            for q in (50, 95, 99):
+                lines.append(f'camio_stage_seconds{{stage="{name}",quantile="{q / 100}"}} ' +
+                             f"{histogram.percentile(q):.6f}")
+            lines.append(f'camio_stage_seconds_max{{stage="{name}"}} {histogram.max:.6f}')
+            lines.append(f'camio_stage_seconds_sum{{stage="{name}"}} {histogram.sum:.6f}')
+            lines.append(f'camio_stage_seconds_count{{stage="{name}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    # Short human-readable table of the histograms, in ms
+    def report(self):
+        uptime, counters, gauges, histograms = self.snapshot()
+        lines = [f"{'stage (ms)':20}{'count':>8}{'mean':>8}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}"]
+        for name, histogram in histograms.items():
+            lines.append(f"{name:20}{histogram.count:8d}{histogram.mean() * 1000:8.2f}" +
+                         f"{histogram.percentile(50) * 1000:8.2f}{histogram.percentile(95) * 1000:8.2f}" +
+                         f"{histogram.percentile(99) * 1000:8.2f}{histogram.max * 1000:8.2f}")
+        if counters:
+            lines.append(' '.join(f"{name}: {value}" for name, value in counters.items()))
+        return '\n'.join(lines)
+
+
+# Serves Metrics.text() at http://host:port/metrics (and /) on a background thread
+class MetricsServer:
+    def __init__(self, metrics, port, host='127.0.0.1'):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.text().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="MetricsServer", daemon=True)
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# Appends the metrics to a CSV file every [interval] seconds, one row per value:
+# time, metric, value. Histograms cover the last interval only and are written as <name>.count, .mean_ms, .p50_ms,
+# .p95_ms and .max_ms; counters and gauges are written as they are.
+class CsvDumper(threading.Thread):
+    def __init__(self, metrics, path, interval=10.0):
+        super().__init__(name="CsvDumper", daemon=True)
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.previous = {}
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.dump()
+
+    def dump(self):
+        uptime, counters, gauges, histograms = self.metrics.snapshot()
+        now = time.strftime('%Y-%m-%dT%H:%M:%S')
+        rows = [(now, name, value) for name, value in {**counters, **gauges}.items()]
+        for name, histogram in histograms.items():
+            interval = histogram.since(self.previous[name]) if name in self.previous else histogram
+            rows += [(now, f"{name}.count", interval.count),
+                     (now, f"{name}.mean_ms", round(interval.mean() * 1000, 3)),
+                     (now, f"{name}.p50_ms", round(interval.percentile(50) * 1000, 3)),
+                     (now, f"{name}.p95_ms", round(interval.percentile(95) * 1000, 3)),
+                     (now, f"{name}.max_ms", round(interval.max * 1000, 3))]
+        self.previous = histograms
+        with open(self.path, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if f.tell() == 0:
+                writer.writerow(['time', 'metric', 'value'])
+            writer.writerows(rows)
+
+    def stop(self):
+        self.stop_event.set()
+        self.join(timeout=1.0)
+        self.dump()
+
+
+# Prints each kind of message at most once per [interval] seconds, so that per-frame messages don't slow down the
+# loop at console speed. A message printed after others were suppressed says how many.
+class RateLimitedLog:
+    def __init__(self, interval=1.0, output=print):
+        self.interval = interval
+        self.output = output
+        self.last = {}  # key -> time the last message was printed
+        self.suppressed = {}
+
+    # Prints [message] unless a message with the same key (default: the message) was printed less than [interval]
+    # seconds ago. Returns whether it was printed.
+    def log(self, message, key=None):
+        key = message if key is None else key
+        now = time.monotonic()
+        if now - self.last.get(key, -math.inf) < self.interval:
+            self.suppressed[key] = self.suppressed.get(key, 0) + 1
+            return False
+        suppressed = self.suppressed.pop(key, 0)
+        self.output(f"{message} ({suppressed} suppressed)" if suppressed else message)
+        self.last[key] = now
+        return True
@@ -0,0 +1,176 @@
+import queue
+import threading
+import time
+import traceback
+
+
+# Bounded queue that keeps only the newest items, dropping the oldest ones (passed to on_drop) when it is full
+class LatestQueue:
+    def __init__(self, maxsize=1, on_drop=None):
+        self._queue = queue.Queue(maxsize)
+        self.on_drop = on_drop
+
+    # Puts an item in the queue and returns the number of stale items that were dropped to make room
+    def put(self, item):
+        dropped = 0
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return dropped
+            except queue.Full:
+                try:
+                    stale = self._queue.get_nowait()
+                    dropped += 1
+                except queue.Empty:
+                    continue
+                if self.on_drop is not None:
+                    self.on_drop(stale)
+
+    # Returns the oldest item in the queue, or None if nothing arrived before the timeout
+    def get(self, timeout=None):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+# Frame counters of the pipeline stages. Each counter is only written by a single stage.
+class PipelineCounters:
+    def __init__(self):
+        self.captured = 0
+        self.dropped_frames = 0
+        self.processed = 0
+        self.skipped = 0  # frames the processing function returned no result for
+        self.dropped_results = 0
+        self.latency = 0.0  # capture-to-result time of the last processed frame, in seconds
+
+    def __str__(self):
+        return (f"captured: {self.captured} processed: {self.processed} skipped: {self.skipped} " +
+                f"dropped frames: {self.dropped_frames} dropped results: {self.dropped_results} " +
+                f"latency: {self.latency * 1000:.1f} ms")
+
+
+# Capture stage: reads frames as fast as the camera delivers them and only keeps the newest one.
+# With frame_interval (a function returning seconds), frames closer than that to the last one kept are only grabbed,
+# not decoded.
+class FrameGrabber(threading.Thread):
+    def __init__(self, cap, frames, counters, stop_event, metrics=None, frame_interval=None):
+        super().__init__(name="FrameGrabber", daemon=True)
+        self.cap = cap
+        self.frames = frames
+        self.counters = counters
+        self.stop_event = stop_event
+        self.metrics = metrics
+        self.frame_interval = frame_interval
+
+    def run(self):
+        last_kept = 0.0
+        try:
+            while not self.stop_event.is_set():
+                if self.frame_interval is not None and time.monotonic() - last_kept < self.frame_interval():
+                    if not self.cap.grab():
+                        print("No camera image returned.")
+                        break
+                    continue
+                last_kept = time.monotonic()
+                start = time.perf_counter()
+                ret, frame = self.cap.read()
+                if self.metrics is not None:
+                    self.metrics.observe('capture', time.perf_counter() - start)
+                if not ret:
+                    print("No camera image returned.")
+                    break
+                self.counters.captured += 1
+                self.counters.dropped_frames += self.frames.put((time.monotonic(), frame))
+        finally:
+            self.stop_event.set()
+
+
+# Processing stage: runs process(frame, timestamp) on the newest captured frame. process may return None to skip
+# the frame, which is then passed to release_frame.
+class ProcessingWorker(threading.Thread):
+    def __init__(self, process, frames, results, counters, stop_event, metrics=None, release_frame=None):
+        super().__init__(name="ProcessingWorker", daemon=True)
+        self.process = process
+        self.frames = frames
+        self.results = results
+        self.counters = counters
+        self.stop_event = stop_event
+        self.metrics = metrics
+        self.release_frame = release_frame
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                item = self.frames.get(timeout=0.1)
+                if item is None:
+                    continue
+                timestamp, frame = item
+                start = time.perf_counter()
+                result = self.process(frame, timestamp)
+                if result is None:
+                    self.counters.skipped += 1
+                    if self.release_frame is not None:
+                        self.release_frame(frame)
+                    continue
+                self.counters.processed += 1
+                self.counters.latency = time.monotonic() - timestamp
+                if self.metrics is not None:
+                    self.metrics.observe('process', time.perf_counter() - start)
+                    self.metrics.observe('latency', self.counters.latency)
+                self.counters.dropped_results += self.results.put(result)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self.stop_event.set()
+
+
+# Capture -> processing -> output pipeline. The output stage is whoever calls get_result().
+# With metrics, the capture and processing times and the capture-to-result latency of each frame are recorded in
+# histograms, and the counters are read from it as gauges. frame_interval is passed on to FrameGrabber.
+# With a source that reuses frame buffers (camera_capture.FrameSource), the frames dropped or skipped by the pipeline
+# are released back to it, and so is the frame of each result once the next result is taken: the output stage must
+# copy a frame it keeps for longer (as DebugView does).
+class CameraPipeline:
+    def __init__(self, cap, process, max_results=1, metrics=None, frame_interval=None):
+        self.cap = cap
+        self.counters = PipelineCounters()
+        if metrics is not None:
+            metrics.add_source(lambda: vars(self.counters), 'pipeline_')
+        self.stop_event = threading.Event()
+        self.release_frame = getattr(cap, 'release_frame', None)
+        self.frames = LatestQueue(1, self._release_item)
+        self.results = LatestQueue(max_results, self._release_result)
+        self.grabber = FrameGrabber(cap, self.frames, self.counters, self.stop_event, metrics, frame_interval)
+        self.worker = ProcessingWorker(process, self.frames, self.results, self.counters, self.stop_event, metrics,
+                                       self.release_frame)
+        self.result = None  # last result returned by get_result
+
+    def start(self):
+        self.grabber.start()
+        self.worker.start()
+
+    def is_running(self):
+        return not self.stop_event.is_set()
+
+    # Returns the newest processed result, or None if nothing arrived before the timeout
+    def get_result(self, timeout=None):
+        result = self.results.get(timeout=timeout)
+        if result is not None:
+            self._release_result(self.result)
+            self.result = result
+        return result
+
+    def stop(self):
+        self.stop_event.set()
+        self.worker.join(timeout=1.0)
+        self.grabber.join(timeout=1.0)
+        self.cap.release()
+
+    def _release_item(self, item):
+        if self.release_frame is not None:
+            self.release_frame(item[1])
+
+    def _release_result(self, result):
+        if self.release_frame is not None and result is not None:
+            self.release_frame(result.frame)
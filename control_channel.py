@@ -0,0 +1,47 @@
+import queue
+import signal
+import sys
+import threading
+
+# Commands understood by the main loop and the stdin lines that send them
+COMMANDS = {'q': 'quit', 'quit': 'quit', 'exit': 'quit',
+            's': 'snapshot', 'snapshot': 'snapshot',
+            'stats': 'stats'}
+
+
+# Control input of the main loop that doesn't need a GUI window.
+# Commands come from stdin lines, from signals (SIGINT/SIGTERM quit, SIGUSR1 prints stats) or from put().
+class ControlChannel:
+    def __init__(self):
+        self.commands = queue.Queue()
+
+    def put(self, command):
+        self.commands.put(command)
+
+    # Returns the commands received since the last call
+    def poll(self):
+        commands = []
+        while True:
+            try:
+                commands.append(self.commands.get_nowait())
+            except queue.Empty:
+                return commands
+
+    def start_stdin(self):
+        threading.Thread(target=self._read_stdin, name="ControlStdin", daemon=True).start()
+
+    # Must be called from the main thread
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGINT, lambda signum, frame: self.put('quit'))
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.put('quit'))
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.put('stats'))
+
+    def _read_stdin(self):
+        # A closed stdin (e.g. when running as a service) just means there is no console input
+        for line in sys.stdin:
+            command = COMMANDS.get(line.strip().lower())
+            if command is not None:
+                self.put(command)
+            elif line.strip():
+                print(f"Unknown command: {line.strip()}. Commands: {', '.join(COMMANDS)}")
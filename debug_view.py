@@ -0,0 +1,103 @@
+import dataclasses
+import datetime
+import threading
+import time
+import cv2 as cv
+import numpy as np
+
+
+# Draws the axes on the image
+def drawAxes(img, imgpts):
+    imgpts = imgpts.astype(int)
+    corner = tuple(imgpts[3].ravel())
+    img = cv.line(img, corner, tuple(imgpts[0].ravel()), (255, 0, 0), 5)
+    img = cv.line(img, corner, tuple(imgpts[1].ravel()), (0, 255, 0), 5)
+    img = cv.line(img, corner, tuple(imgpts[2].ravel()), (0, 0, 255), 5)
+    return img
+
+
+# Draws the board pose and the pointer of a processed frame on the image
+def draw_result(img, result, obj, intrinsic_matrix, distortion):
+    if result.rvec is None:
+        return img
+
+    # Draw axes on the image
+    axis = np.float32([[6, 0, 0], [0, 6, 0], [0, 0, -6], [0, 0, 0]]).reshape(-1, 3)
+    axis_pts, other = cv.projectPoints(axis, result.rvec, result.tvec, intrinsic_matrix, None)
+    img = drawAxes(img, axis_pts)
+
+    # Draw circles on the backprojected corner points
+    backprojection_pts, other = cv.projectPoints(obj, result.rvec, result.tvec, intrinsic_matrix, None)
+    for idx, pts in enumerate(backprojection_pts):
+        cv.circle(img, (int(pts[0, 0]), int(pts[0, 1])), 4, (255, 255, 255), 2)
+        cv.line(img, (int(pts[0, 0] - 1), int(pts[0, 1])), (int(pts[0, 0]) + 1, int(pts[0, 1])),
+                (255, 0, 0), 1)
+        cv.line(img, (int(pts[0, 0]), int(pts[0, 1]) - 1), (int(pts[0, 0]), int(pts[0, 1]) + 1),
+                (255, 0, 0), 1)
+
+    for pointer in result.pointers.values():
+        if pointer.corners is None:
+            continue
+        for i in range(4):
+            cv.circle(img, (int(pointer.corners[i, 0]), int(pointer.corners[i, 1])), 3, (255, 255, 255), 2)
+        # Project the pointer tip and draw it on the image, with the marker id
+        tip_pt, other = cv.projectPoints(pointer.position.reshape(1, 3), np.zeros(3), np.zeros(3), intrinsic_matrix,
+                                         distortion)
+        tip = (int(tip_pt[0, 0, 0]), int(tip_pt[0, 0, 1]))
+        cv.circle(img, tip, 2, (0, 255, 0), 2)
+        cv.putText(img, str(pointer.marker_id), (tip[0] + 6, tip[1] - 6), cv.FONT_HERSHEY_SIMPLEX, 0.6,
+                   (0, 255, 0), 2)
+    return img
+
+
+# Debug window rendered on its own thread at no more than max_fps. The main loop only hands over the latest result with
+# update(), so drawing and the window never slow down tracking; its frame is copied there, no more than max_fps times a
+# second, as the capture stage reads into the frame buffer again once the main loop moves on. All HighGUI calls happen
+# on this thread. Escape sends 'quit' to the control channel and 's' saves the rendered image.
+class DebugView(threading.Thread):
+    def __init__(self, draw, controls, max_fps=15.0, window_name='image reprojection'):
+        super().__init__(name="DebugView", daemon=True)
+        self.draw = draw  # draw(img, result) -> img
+        self.controls = controls
+        self.period = 1.0 / max_fps
+        self.window_name = window_name
+        self.snapshot = None
+        self.last_update = -self.period
+        self.stop_event = threading.Event()
+
+    # Hands over the latest result and the status text to show with it
+    def update(self, result, text=''):
+        now = time.monotonic()
+        if now - self.last_update < self.period:
+            return
+        self.last_update = now
+        self.snapshot = (dataclasses.replace(result, frame=result.frame.copy()), text)
+
+    def stop(self):
+        self.stop_event.set()
+        self.join(timeout=1.0)
+
+    def run(self):
+        shown = None
+        while not self.stop_event.is_set():
+            start = time.monotonic()
+            snapshot = self.snapshot
+            if snapshot is not None and snapshot is not shown:
+                shown = snapshot
+                result, text = snapshot
+                if result.frame.ndim == 2:
+                    img = self.draw(cv.cvtColor(result.frame, cv.COLOR_GRAY2BGR), result)
+                else:
+                    img = self.draw(result.frame.copy(), result)
+                cv.putText(img, text, (10, 30), cv.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+                cv.imshow(self.window_name, img)
+
+            waitkey = cv.waitKey(1)
+            if waitkey == ord('s') and shown is not None:
+                now = datetime.datetime.now()
+                cv.imwrite(f'{now.strftime("%Y.%m.%d.%H.%M.%S")}_backproject.jpg', img)
+            if waitkey == 27:  # Escape key
+                print('Escape.')
+                self.controls.put('quit')
+            self.stop_event.wait(max(self.period - (time.monotonic() - start), 0.0))
+        cv.destroyAllWindows()
@@ -0,0 +1,265 @@
+import time
+import cv2 as cv
+import numpy as np
+from dataclasses import dataclass, field
+from aruco_detector import ArucoDetector
+from board_tracker import BoardTracker
+from board_registry import board_dictionary
+
+
+# Function to reverse the projection of a point given a rvec and tvec
+def reverse_project(point, rvec, tvec):
+    poi = np.matrix(point)
+    R, _ = cv.Rodrigues(rvec)
+    R_mat = np.matrix(R)
+    R_inv = np.linalg.inv(R_mat)
+    T = np.matrix(tvec)
+    return np.array(R_inv * (poi - T))
+
+
+# reverse_project for N x 3 points at once, returns N x 3 points in board coordinates
+def reverse_project_points(points, rvec, tvec):
+    R, _ = cv.Rodrigues(rvec)
+    return (np.asarray(points, dtype=np.float64) - np.reshape(tvec, (1, 3))) @ R
+
+
+# Rotates the vector v by each of the N x 3 rotation vectors (Rodrigues' formula), returns N x 3 vectors
+def rotate_vector(rvecs, v):
+    rvecs = np.reshape(rvecs, (-1, 3)).astype(np.float64)
+    theta = np.linalg.norm(rvecs, axis=1, keepdims=True)
+    k = rvecs / np.maximum(theta, 1e-12)
+    cos = np.cos(theta)
+    return v * cos + np.cross(k, v) * np.sin(theta) + k * (k @ v)[:, None] * (1 - cos)
+
+
+# One pointer marker in a processed frame. Detection fields are None when the marker was not found in this frame
+# but the pointer is still tracked.
+@dataclass
+class PointerResult:
+    marker_id: int
+    corners: np.ndarray = None  # image corners of the marker, 4 x 2
+    rvec: np.ndarray = None  # rotation of the marker, in the frame of estimatePoseSingleMarkers
+    position: np.ndarray = None  # tip in camera coordinates, 3 x 1
+    point_of_interest: np.ndarray = None  # measured tip in map coordinates, 3 x 1
+    tip: np.ndarray = None  # filtered tip, predicted to when its sound would start
+    tip_confidence: float = 0.0
+    zone: int = 0
+
+
+# Output of the processing stage for a single frame. Pose fields are None when the markers were not found.
+# pointers holds every tracked pointer by marker id; the pointer fields repeat the one with the lowest id.
+@dataclass
+class FrameResult:
+    frame: np.ndarray
+    timestamp: float
+    rvec: np.ndarray = None
+    tvec: np.ndarray = None
+    pointer_corners: np.ndarray = None
+    rvec_aruco: np.ndarray = None
+    tvec_aruco: np.ndarray = None
+    point_of_interest: np.ndarray = None
+    tip: np.ndarray = None  # filtered tip, predicted to when its sound would start
+    tip_confidence: float = 0.0
+    zone: int = 0
+    pointers: dict = field(default_factory=dict)
+    map: object = None  # board_registry.LoadedMap the zones were looked up in, with a MapLibrary
+
+
+# Marker detection, pose estimation and zone lookup for one camera frame.
+# Every pointer marker in view (or only those in pointer_ids) is tracked separately by marker id, with its own copy
+# of pointer_filter and of the zone filter of zone_resolver. The poses of all the pointers are solved in one batched
+# call and their tips are transformed to map coordinates and looked up in the zone map in single array operations.
+# A pointer that has not been seen for pointer_timeout seconds is forgotten. If a marker id appears twice in a frame,
+# only the first detection is used.
+# With a pointer_filter the zone is looked up at the filtered tip, otherwise at the raw tip of the frame.
+# timings holds the time in seconds spent by each stage on the last frame. With metrics, the stages that ran and
+# each detectMarkers pass (detect_<dictionary>) are also recorded in its histograms.
+# obj holds the corners of the map markers, in the order of marker_ids (by default 0, 1, 2...). With maps (a
+# board_registry.MapLibrary), obj and zone_resolver may be None: whenever the board is lost, the map is identified
+# from the ids of the markers in view and, once the same other map has been seen in maps.switch_frames frames in a
+# row, its markers and zones replace the current ones and the pointers start over.
+class FrameProcessor:
+    def __init__(self, obj, intrinsic_matrix, distortion, zone_resolver, downscale=1.0, pointer_filter=None,
+                 metrics=None, pointer_ids=None, pointer_timeout=1.0, marker_ids=None, maps=None):
+        self.obj = obj
+        self.intrinsic_matrix = intrinsic_matrix
+        self.distortion = distortion
+        self.zone_resolver = zone_resolver
+        self.pointer_filter = pointer_filter
+        self.metrics = metrics
+        self.pointer_ids = None if pointer_ids is None else set(pointer_ids)
+        self.pointer_timeout = pointer_timeout
+        self.maps = maps
+        self.map = None  # LoadedMap in use, with maps
+        self.candidate = None  # board seen in place of the current map, and in how many frames in a row
+        self.candidate_frames = 0
+        self.map_switches = 0
+
+        # Map markers and pointer marker are detected on the same downscaled image, the map ones only while the map is
+        # not tracked
+        if maps is not None:
+            board_dict = maps.registry.dictionary
+        else:
+            board_dict = board_dictionary(max(marker_ids) if marker_ids is not None else len(obj) // 4 - 1)
+        self.detector = ArucoDetector({'board': board_dict, 'pointer': cv.aruco.DICT_5X5_50}, downscale)
+
+        # if we are just using 1 large marker
+        self.obj_aruco = np.array([[0.5, 0.5, 0], [3.5, 0.5, 0], [3.5, 3.5, 0], [0.5, 3.5, 0]], dtype=np.float32)
+        # The tip is the origin of obj_aruco. estimatePoseSingleMarkers puts the origin at the marker center with
+        # y and z flipped, so this is where the tip lies in its frame.
+        self.pointer_size = float(np.linalg.norm(self.obj_aruco[1] - self.obj_aruco[0]))
+        self.tip_offset = -self.obj_aruco.mean(axis=0).astype(np.float64) * [1, -1, -1]
+        self.pointer_filters = {}  # marker id -> PointerFilter
+        self.zone_resolvers = {}  # marker id -> ZoneResolver
+        self.last_seen = {}  # marker id -> timestamp of the last frame it was found in
+        self.board_tracker = None
+        if obj is not None:
+            self.board_tracker = BoardTracker(obj, intrinsic_matrix, self.detector, 'board', distortion=distortion,
+                                              marker_ids=marker_ids)
+        self.timings = {}
+
+    # downscale overrides the detection downscale for this frame, e.g. for a low-resolution scan
+    def process(self, frame, timestamp, downscale=None):
+        result = FrameResult(frame=frame, timestamp=timestamp, map=self.map)
+        self.timings = dict.fromkeys(['grayscale', 'detection', 'solvepnp', 'reverse_project', 'filter', 'zone'],
+                                     0.0)
+
+        # load images grayscale, unless the frame source already delivers them so
+        start = time.perf_counter()
+        img_scene = frame if frame.ndim == 2 else cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+        self.timings['grayscale'] = time.perf_counter() - start
+
+        default_downscale = self.detector.downscale
+        if downscale is not None:
+            self.detector.downscale = max(float(downscale), 1.0)
+        self.detector.set_image(img_scene, new_frame=True)
+        try:
+            # Track the map markers and run solvePnP using the markers that have been observed
+            start = time.perf_counter()
+            if self.maps is not None and (self.board_tracker is None or self.board_tracker.rvec is None):
+                self._select_map()
+                result.map = self.map
+            pose = self.board_tracker.track(img_scene) if self.board_tracker is not None else None
+            self.timings['solvepnp'] = time.perf_counter() - start - sum(self.detector.timings.values())
+            if pose is None:
+                return result
+            result.rvec, result.tvec = pose
+
+            # Detect the pointer markers and solve their poses in one pass
+            corners, ids = self.detector.detect('pointer')
+            detected = {}
+            for i in range(len(corners)):
+                marker_id = int(ids[i, 0])
+                if marker_id not in detected and (self.pointer_ids is None or marker_id in self.pointer_ids):
+                    detected[marker_id] = i
+            if detected:
+                start = time.perf_counter()
+                pointer_corners = [corners[i] for i in detected.values()]
+                rvecs, tvecs, _ = cv.aruco.estimatePoseSingleMarkers(pointer_corners, self.pointer_size,
+                                                                     self.intrinsic_matrix, self.distortion)
+                positions = rotate_vector(rvecs, self.tip_offset) + tvecs.reshape(-1, 3)
+                self.timings['solvepnp'] += time.perf_counter() - start
+
+                # Get the pointer locations in coordinates of the aruco markers
+                start = time.perf_counter()
+                points = reverse_project_points(positions, result.rvec, result.tvec)
+                self.timings['reverse_project'] = time.perf_counter() - start
+
+                for j, marker_id in enumerate(detected):
+                    result.pointers[marker_id] = PointerResult(marker_id, pointer_corners[j][0], rvecs[j].reshape(3, 1),
+                                                               positions[j].reshape(3, 1), points[j].reshape(3, 1))
+                    if marker_id not in self.last_seen:
+                        self.zone_resolvers[marker_id] = self.zone_resolver.copy()
+                        if self.pointer_filter is not None:
+                            self.pointer_filters[marker_id] = self.pointer_filter.copy()
+                    self.last_seen[marker_id] = timestamp
+
+            # Filter each tip and predict where it will be when the sound starts
+            start = time.perf_counter()
+            for marker_id in sorted(self.last_seen):
+                if timestamp - self.last_seen[marker_id] > self.pointer_timeout:
+                    self._forget(marker_id)
+                    continue
+                pointer = result.pointers.setdefault(marker_id, PointerResult(marker_id))
+                if self.pointer_filter is None:
+                    pointer.tip = pointer.point_of_interest
+                    pointer.tip_confidence = 0.0 if pointer.tip is None else 1.0
+                else:
+                    pointer_filter = self.pointer_filters[marker_id]
+                    pointer_filter.update(pointer.point_of_interest, timestamp)
+                    play_time = timestamp + pointer_filter.lead_time
+                    pointer.tip = pointer_filter.predict(play_time)
+                    pointer.tip_confidence = pointer_filter.confidence(play_time)
+            self.timings['filter'] = time.perf_counter() - start
+
+            # Look up the zones of all the tips at once, then filter each pointer's zone over its last frames
+            start = time.perf_counter()
+            located = [pointer for pointer in result.pointers.values() if pointer.tip is not None]
+            zones = self.zone_resolver.zones_at(np.array([pointer.tip.ravel() for pointer in located])) \
+                if located else []
+            for pointer, zone in zip(located, zones):
+                pointer.zone = int(zone)
+            for pointer in result.pointers.values():
+                pointer.zone = self.zone_resolvers[pointer.marker_id].update_zone(pointer.zone)
+            self.timings['zone'] = time.perf_counter() - start
+
+            if result.pointers:
+                self._set_primary(result, result.pointers[min(result.pointers)])
+            return result
+        finally:
+            self.detector.downscale = default_downscale
+            self.timings['detection'] = sum(self.detector.timings.values())
+            if self.metrics is not None:
+                self._record()
+
+    def _set_primary(self, result, pointer):
+        result.pointer_corners = pointer.corners
+        result.point_of_interest = pointer.point_of_interest
+        result.tip = pointer.tip
+        result.tip_confidence = pointer.tip_confidence
+        result.zone = pointer.zone
+        if pointer.position is not None:
+            # Pose of the obj_aruco frame, whose origin is the tip
+            R, _ = cv.Rodrigues(pointer.rvec)
+            result.rvec_aruco, _ = cv.Rodrigues(R * [1, -1, -1])
+            result.tvec_aruco = pointer.position
+
+    # Switches to the map whose markers are in view, if it is not the current one and has been seen long enough.
+    # The ids come from the full-frame detection pass that the board search would run anyway.
+    def _select_map(self):
+        _, ids = self.detector.detect('board')
+        board = self.maps.registry.identify(ids, self.maps.min_markers)
+        if board is None or (self.map is not None and board is self.map.board):
+            self.candidate = None
+            return
+        if board is not self.candidate:
+            self.candidate = board
+            self.candidate_frames = 0
+        self.candidate_frames += 1
+        if self.candidate_frames < self.maps.switch_frames:
+            return
+
+        self.map = self.maps.load(board)
+        self.obj = board.obj
+        self.zone_resolver = self.map.zone_resolver
+        self.board_tracker = BoardTracker(board.obj, self.intrinsic_matrix, self.detector, 'board',
+                                          distortion=self.distortion, marker_ids=board.marker_ids)
+        for marker_id in list(self.last_seen):
+            self._forget(marker_id)
+        self.candidate = None
+        self.map_switches += 1
+        if self.metrics is not None:
+            self.metrics.increment('map_switches')
+
+    def _forget(self, marker_id):
+        del self.last_seen[marker_id]
+        del self.zone_resolvers[marker_id]
+        self.pointer_filters.pop(marker_id, None)
+
+    def _record(self):
+        for stage, seconds in self.timings.items():
+            if seconds > 0 and stage != 'detection':
+                self.metrics.observe(stage, seconds)
+        for name, seconds in self.detector.timings.items():
+            if seconds > 0:
+                self.metrics.observe(f"detect_{name}", seconds)
@@ -0,0 +1,174 @@
+import argparse
+import io
+import json
+import os
+import struct
+import numpy as np
+
+# File layout: magic, format version and metadata length, the JSON metadata, then the zone raster (uncompressed,
+# page aligned so that it can be memory-mapped) and the sound files, stored as they are (e.g. MP3).
+MAGIC = b'CAMIOMAP'
+VERSION = 1
+HEADER = struct.Struct('<8sII')
+PAGE_SIZE = 4096
+
+
+def _align(offset, alignment=PAGE_SIZE):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+# Marker ids and corners in cm of square markers of size_cm, from their top-left corners (marker id -> (x, y)),
+# in the corner order of map_parameters.obj
+def marker_corners(positions, size_cm=2.0):
+    positions = {int(marker_id): position for marker_id, position in positions.items()}
+    marker_ids = sorted(positions)
+    square = np.float32([[0, 0, 0], [size_cm, 0, 0], [size_cm, size_cm, 0], [0, size_cm, 0]])
+    obj = np.float32([square + [*positions[marker_id], 0] for marker_id in marker_ids]).reshape(-1, 3)
+    return marker_ids, obj
+
+
+# Writes a map package. zone_map is the zone raster as used by ZoneResolver (e.g. the output of nearest_zone_map),
+# zones maps zone ids to names, sounds maps zone ids to the sound files in sound_dir (missing files are skipped)
+# and obj holds the corners of the map markers in cm, in the order of marker_ids (by default 0, 1, 2...).
+def build_package(path, zone_map, pixels_per_cm, zones, sound_dir, sounds, obj, name='', marker_ids=None):
+    if marker_ids is None:
+        marker_ids = range(len(obj) // 4)
+    zone_map = np.ascontiguousarray(zone_map)
+    blobs = {}
+    for key, filename in sounds.items():
+        sound_path = os.path.join(sound_dir, filename)
+        if os.path.isfile(sound_path):
+            with open(sound_path, 'rb') as f:
+                blobs[key] = (filename, f.read())
+        else:
+            print(f"Missing sound file {sound_path}, skipped.")
+
+    # The metadata holds the offsets of the data that follows it, so its size is fixed by laying it out twice
+    def metadata(data_offset):
+        offset = data_offset + zone_map.nbytes
+        sound_table = {}
+        for key, (filename, blob) in blobs.items():
+            sound_table[str(key)] = {'filename': filename, 'offset': offset, 'size': len(blob)}
+            offset += len(blob)
+        return json.dumps({'name': name,
+                           'pixels_per_cm': pixels_per_cm,
+                           'zones': {str(key): value for key, value in zones.items()},
+                           'sounds': sound_table,
+                           'obj': np.asarray(obj).tolist(),
+                           'marker_ids': [int(marker_id) for marker_id in marker_ids],
+                           'raster': {'offset': data_offset, 'shape': list(zone_map.shape),
+                                      'dtype': zone_map.dtype.str}}).encode()
+
+    data_offset = _align(HEADER.size + len(metadata(0)) + 64)
+    header = metadata(data_offset)
+    assert HEADER.size + len(header) <= data_offset
+
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(header)))
+        f.write(header)
+        f.write(b'\0' * (data_offset - f.tell()))
+        f.write(zone_map.tobytes())
+        for filename, blob in blobs.values():
+            f.write(blob)
+
+
+# Read-only view of a map package. Opening it only reads the metadata: the zone raster is memory-mapped on first
+# use, so only the pages under the pointer are ever read, and sound files are read when they are opened.
+class MapPackage:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, version, header_size = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a map package")
+            if version != VERSION:
+                raise ValueError(f"{path} has format version {version}, expected {VERSION}")
+            metadata = json.loads(f.read(header_size))
+        self.name = metadata['name']
+        self.pixels_per_cm = metadata['pixels_per_cm']
+        self.zones = {int(key): value for key, value in metadata['zones'].items()}
+        self.sound_table = {int(key): value for key, value in metadata['sounds'].items()}
+        self.obj = np.array(metadata['obj'], dtype=np.float32)
+        self.marker_ids = metadata.get('marker_ids', list(range(len(self.obj) // 4)))
+        self.raster = metadata['raster']
+        self._zone_map = None
+
+    @property
+    def zone_map(self):
+        if self._zone_map is None:
+            self._zone_map = np.memmap(self.path, dtype=np.dtype(self.raster['dtype']), mode='r',
+                                       offset=self.raster['offset'], shape=tuple(self.raster['shape']))
+        return self._zone_map
+
+    # Sound file names by zone id, as expected by AudioBank
+    def sounds(self):
+        return {key: entry['filename'] for key, entry in self.sound_table.items()}
+
+    # Returns a file object with the sound file of [key]
+    def open_sound(self, key):
+        entry = self.sound_table[key]
+        with open(self.path, 'rb') as f:
+            f.seek(entry['offset'])
+            return io.BytesIO(f.read(entry['size']))
+
+    def info(self):
+        shape = self.raster['shape']
+        lines = [f"name: {self.name}",
+                 f"file size: {os.path.getsize(self.path)} bytes",
+                 f"pixels per cm: {self.pixels_per_cm}",
+                 f"zone raster: {shape[1]} x {shape[0]} {np.dtype(self.raster['dtype']).name}, " +
+                 f"{shape[1] / self.pixels_per_cm:.1f} x {shape[0] / self.pixels_per_cm:.1f} cm",
+                 f"markers: {len(self.obj) // 4} (ids {', '.join(map(str, self.marker_ids))})",
+                 f"zones: {len(self.zones)}",
+                 f"sounds: {len(self.sound_table)}, " +
+                 f"{sum(entry['size'] for entry in self.sound_table.values())} bytes"]
+        for key, zone_name in sorted(self.zones.items()):
+            entry = self.sound_table.get(key)
+            lines.append(f"  {key:3d} {zone_name:40} {entry['filename'] if entry else '-'}")
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import cv2 as cv
+    import map_parameters
+    from zone_resolver import nearest_zone_map
+
+    maps = {'default': (map_parameters.map_dict, map_parameters.sound_dict),
+            'ukraine': (map_parameters.map_dict_ukraine, map_parameters.sound_dict_ukraine)}
+
+    parser = argparse.ArgumentParser(description='Builds and inspects CamIO map packages.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='Build a map package.')
+    build.add_argument('output', help='Path of the package to write.')
+    build.add_argument('--input1', help='Path to input zone image.', default='zone_map.png')
+    build.add_argument('--map', help='Zone names and sounds from map_parameters.py.', choices=maps,
+                       default='ukraine')
+    build.add_argument('--sound-dir', help='Folder with the sound files.', default='./MP3/')
+    build.add_argument('--pixels-per-cm', help='Resolution of the zone image.', type=float, default=118.49)
+    build.add_argument('--max-gap-cm', help='Gaps between zones narrower than this resolve to the nearest zone.',
+                       type=float, default=0.2)
+    build.add_argument('--name', help='Name of the map.')
+    build.add_argument('--markers', help='JSON file with the map markers, as {"size_cm": 2, "markers": {"<id>": ' +
+                       '[x, y], ...}} with the top-left corner of each marker in cm (default: the markers 0-3 of ' +
+                       'map_parameters.py).')
+    build.add_argument('--first-id', help='Number the markers of map_parameters.py from this id, to tell maps ' +
+                       'printed with different ids apart.', type=int, default=0)
+    info = subparsers.add_parser('info', help='Print the contents of a map package.')
+    info.add_argument('package', help='Path of the package.')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        img_map = cv.imread(args.input1, cv.IMREAD_GRAYSCALE)
+        zones, sounds = maps[args.map]
+        zone_map = nearest_zone_map(img_map, args.max_gap_cm * args.pixels_per_cm, zones.keys())
+        if args.markers:
+            with open(args.markers) as f:
+                layout = json.load(f)
+            marker_ids, obj = marker_corners(layout['markers'], layout.get('size_cm', 2.0))
+        else:
+            obj = map_parameters.obj
+            marker_ids = range(args.first_id, args.first_id + len(obj) // 4)
+        build_package(args.output, zone_map, args.pixels_per_cm, zones, args.sound_dir, sounds, obj,
+                      args.name or args.map, marker_ids)
+    else:
+        print(MapPackage(args.package).info())
@@ -0,0 +1,95 @@
+import copy
+import numpy as np
+
+
+# Constant-velocity Kalman filter on the pointer tip in map coordinates (cm).
+# The three axes share the same dynamics and noise, so they share one 2x2 covariance of (position, velocity).
+# update() takes the measured tip of each frame (None when the pointer marker was not found) with its capture time,
+# predict() extrapolates the tip to any later time, e.g. when the sound for it will start playing. Short dropouts are
+# bridged by extrapolation for up to max_dropout seconds, and a measurement more than gate_cm away from the
+# prediction restarts the filter there, as when the pointer is lifted and put down somewhere else.
+class PointerFilter:
+    def __init__(self, measurement_std=0.1, acceleration_std=100.0, max_dropout=0.25, lead_time=0.08, gate_cm=3.0,
+                 initial_velocity_std=30.0):
+        self.measurement_var = measurement_std ** 2  # cm^2
+        self.acceleration_var = acceleration_std ** 2  # (cm/s^2)^2
+        self.max_dropout = max_dropout  # seconds
+        self.lead_time = lead_time  # seconds from frame capture to the start of the sound
+        self.gate_cm = gate_cm
+        self.initial_velocity_var = initial_velocity_std ** 2
+        self.reset()
+
+    def reset(self):
+        self.position = None
+        self.velocity = None
+        self.covariance = None
+        self.time = None  # time of the state
+        self.measurement_time = None  # time of the last measurement
+
+    # Returns a filter with the same settings and no state, e.g. for another pointer
+    def copy(self):
+        pointer_filter = copy.copy(self)
+        pointer_filter.reset()
+        return pointer_filter
+
+    def is_tracking(self):
+        return self.position is not None
+
+    # Adds the tip measured at [timestamp] and returns whether the filter is tracking the pointer
+    def update(self, point, timestamp):
+        if self.position is not None and timestamp - self.measurement_time > self.max_dropout:
+            self.reset()
+        if point is None:
+            return self.is_tracking()
+
+        point = np.asarray(point, dtype=np.float64).ravel()[:3]
+        if self.position is None:
+            self._start(point, timestamp)
+            return True
+
+        self._propagate(timestamp)
+        innovation = point - self.position
+        if np.max(np.abs(innovation)) > self.gate_cm:
+            self._start(point, timestamp)
+            return True
+        gain = self.covariance[:, 0] / (self.covariance[0, 0] + self.measurement_var)
+        self.position = self.position + gain[0] * innovation
+        self.velocity = self.velocity + gain[1] * innovation
+        self.covariance = self.covariance - np.outer(gain, self.covariance[0, :])
+        self.measurement_time = timestamp
+        return True
+
+    # Tip position extrapolated to [timestamp] as a 3x1 array, None if the pointer is not tracked
+    def predict(self, timestamp):
+        if self.position is None or timestamp - self.measurement_time > self.max_dropout + self.lead_time:
+            return None
+        return (self.position + self.velocity * (timestamp - self.time)).reshape(3, 1)
+
+    # Confidence in predict([timestamp]) between 0 and 1: decays with the time since the last measurement and with
+    # the position uncertainty relative to the measurement noise
+    def confidence(self, timestamp):
+        if self.position is None:
+            return 0.0
+        dt = timestamp - self.time
+        variance = self._propagated_covariance(dt)[0, 0]
+        age = max(timestamp - self.measurement_time - self.lead_time, 0.0)
+        freshness = max(1.0 - age / self.max_dropout, 0.0)
+        return float(freshness * min(1.0, np.sqrt(self.measurement_var / variance)))
+
+    def _start(self, point, timestamp):
+        self.position = point
+        self.velocity = np.zeros(3)
+        self.covariance = np.diag([self.measurement_var, self.initial_velocity_var])
+        self.time = timestamp
+        self.measurement_time = timestamp
+
+    def _propagated_covariance(self, dt):
+        F = np.array([[1.0, dt], [0.0, 1.0]])
+        Q = self.acceleration_var * np.array([[dt ** 4 / 4, dt ** 3 / 2], [dt ** 3 / 2, dt ** 2]])
+        return F @ self.covariance @ F.T + Q
+
+    def _propagate(self, timestamp):
+        dt = timestamp - self.time
+        self.position = self.position + self.velocity * dt
+        self.covariance = self._propagated_covariance(dt)
+        self.time = timestamp
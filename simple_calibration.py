@@ -5,27 +5,9 @@ import numpy as np
 import argparse
 import pickle
 from typing import Tuple
-from scipy import optimize
 from map_parameters import *
-
-
-def solvePnP_lists_from_focal_length(fl, obj_list, scene_list, cx, cy):
-    sum_of_offsets = 0
-    for scene, obj in zip(scene_list, obj_list):
-        sum_of_offsets += solvePnP_from_focal_length(fl, obj, scene, cx, cy)
-    return sum_of_offsets
-
-
-def solvePnP_from_focal_length(fl, obj, scene, cx, cy):
-    intrinsic_matrix = np.transpose(np.array([[fl[0], 0.0, 0.0], [0.0, fl[0], 0.0], [cx, cy, 1.0]], dtype=np.float32))
-    retval, rvec, tvec = cv.solvePnP(obj, scene, intrinsic_matrix, None)
-    backprojection_pts, other = cv.projectPoints(obj, rvec, tvec, intrinsic_matrix, None)
-    offsets = []
-    for i in range(len(scene)):
-        offsets.append(np.sqrt(
-            (backprojection_pts[i, 0, 0] - scene[i, 0]) ** 2 + (backprojection_pts[i, 0, 1] - scene[i, 1]) ** 2))
-    mean_offset = np.mean(offsets)
-    return mean_offset
+from calibration_solver import calibrate, load_camera_parameters
+from calibration_capture import PoseDiversitySelector, BackgroundCalibrator
 
 
 # Function to sort corners by id based on how they are arranged
@@ -80,6 +62,19 @@ def resize_with_pad(image: np.array, new_shape: Tuple[int, int],
     return image
 
 
+# Saves the calibration to camera_parameters.pkl (with the distortion only if it was estimated) and prints it
+def save_calibration(res, views, with_distortion):
+    with open('camera_parameters.pkl', 'wb') as f:
+        pickle.dump(res.parameters() if with_distortion else res.parameters()[:4], f)
+    print(f"focal_length_x = {res.intrinsic_matrix[0, 0]} +/- {res.std['fx']}\n" +
+          f"focal_length_y = {res.intrinsic_matrix[1, 1]} +/- {res.std['fy']}\n" +
+          f"camera_center_x = {res.intrinsic_matrix[0, 2]} +/- {res.std.get('cx', 0.0)}\n" +
+          f"camera_center_y = {res.intrinsic_matrix[1, 2]} +/- {res.std.get('cy', 0.0)}")
+    if with_distortion:
+        print(f"distortion = {res.distortion}")
+    print(f"views: {views}, reprojection error: {res.rms_error} pixels")
+
+
 # ========================================
 pixels_per_cm_obj = 118.49  # text-with-aruco.png
 focal_length_x = 950.4602909088135
@@ -92,8 +87,15 @@ use_external_cam = 0
 
 parser = argparse.ArgumentParser(description='Code for calibration.')
 parser.add_argument('--input1', help='Path to input zone image.', default='zone_map.png')
+parser.add_argument('--distortion', help='Also estimate the distortion coefficients.', action='store_true')
+parser.add_argument('--workers', help='Processes used to solve the initial pose of each view.', type=int, default=1)
+parser.add_argument('--auto', help='Capture views automatically and save once the calibration has converged.',
+                    action='store_true')
 args = parser.parse_args()
 
+# Previous calibration, used as the starting point of the solver
+initial_parameters, initial_distortion = load_camera_parameters('camera_parameters.pkl')
+
 intrinsic_matrix = np.array([[focal_length_x, 0.00000000e+00, camera_center_x],
                              [0.00000000e+00, focal_length_y, camera_center_y],
                              [0.00000000e+00, 0.00000000e+00, 1.00000000e+00]], dtype=np.float32)
@@ -107,6 +109,18 @@ scene = np.empty((16, 2), dtype=np.float32)
 obj_list = []
 scene_list = []
 
+# Define aruco marker dictionary and parameters object to include subpixel resolution
+aruco_dict = cv.aruco.Dictionary_get(cv.aruco.DICT_4X4_50)
+arucoParams = cv.aruco.DetectorParameters_create()
+arucoParams.cornerRefinementMethod = cv.aruco.CORNER_REFINE_SUBPIX
+
+# Automatic capture: views are kept when the board is still, sharp and seen from a new pose, and the calibration
+# is re-solved in the background until it has converged
+selector = PoseDiversitySelector() if args.auto else None
+calibrator = None
+auto_saved = False
+overlay = None
+
 cap = cv.VideoCapture(use_external_cam)
 cap.set(cv.CAP_PROP_FRAME_HEIGHT,1080) #set camera image height
 cap.set(cv.CAP_PROP_FRAME_WIDTH,1920) #set camera image width
@@ -119,20 +133,30 @@ while cap.isOpened():
         print("No camera image returned.")
         break
 
-    img_scene_color = frame
-
     # load images grayscale
-    img_scene = cv.cvtColor(img_scene_color, cv.COLOR_BGR2GRAY)
-
-    # overlay template image on video stream
-    if img_scene_color.shape[1] != template_img.shape[1] or img_scene_color.shape[0] != template_img.shape[0]:
-        template_img = resize_with_pad(template_img, (img_scene_color.shape[1], img_scene_color.shape[0]), (0,0,0))
-    img_scene_color = (img_scene_color /2 + template_img /2) /255
+    img_scene = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+
+    # overlay template image on video stream, the template is resized once to the capture resolution and blended in
+    # 8 bits into a reused buffer
+    if frame.shape[1] != template_img.shape[1] or frame.shape[0] != template_img.shape[0]:
+        template_img = resize_with_pad(template_img, (frame.shape[1], frame.shape[0]), (0,0,0))
+    if overlay is None or overlay.shape != frame.shape:
+        overlay = np.empty_like(frame)
+    img_scene_color = cv.addWeighted(frame, 0.5, template_img, 0.5, 0, dst=overlay)
+
+    if initial_parameters is None:
+        initial_parameters = [focal_length_x, focal_length_y, frame.shape[1] / 2, frame.shape[0] / 2]
+    if args.auto and calibrator is None:
+        calibrator = BackgroundCalibrator(initial_parameters, initial_distortion, args.distortion)
+        calibrator.start()
+    if calibrator is not None:
+        status = f"views: {calibrator.view_count()}"
+        if calibrator.result is not None:
+            status += f", f = {calibrator.result.intrinsic_matrix[0, 0]:.1f} +/- {calibrator.result.std['fx']:.1f}"
+        if calibrator.converged.is_set():
+            status += ", converged"
+        cv.putText(img_scene_color, status, (10, 30), cv.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
 
-    # Define aruco marker dictionary and parameters object to include subpixel resolution
-    aruco_dict = cv.aruco.Dictionary_get(cv.aruco.DICT_4X4_50)
-    arucoParams = cv.aruco.DetectorParameters_create()
-    arucoParams.cornerRefinementMethod = cv.aruco.CORNER_REFINE_SUBPIX
     # Detect aruco markers in image
     (corners, ids, rejected) = cv.aruco.detectMarkers(img_scene, aruco_dict, parameters=arucoParams)
     scene, use_index = sort_corners_by_id(corners, id, scene)
@@ -151,6 +175,15 @@ while cap.isOpened():
     # Run solvePnP using the markers that have been observed
     retval, rvec, tvec = cv.solvePnP(obj[use_index, :], scene[use_index, :], intrinsic_matrix, None)
 
+    if calibrator is not None and not calibrator.converged.is_set():
+        if selector.consider(img_scene, rvec, tvec, scene[use_index, :]):
+            calibrator.add_view(obj[use_index, :], scene[use_index, :])
+            print(f"Captured view {calibrator.view_count()}.")
+    elif calibrator is not None and not auto_saved:
+        print("Calibration converged.")
+        save_calibration(calibrator.result, len(calibrator.result.view_errors), args.distortion)
+        auto_saved = True
+
     # Draw axes on the image
     axis = np.float32([[6, 0, 0], [0, 6, 0], [0, 0, -6], [0, 0, 0]]).reshape(-1, 3)
     axis_pts, other = cv.projectPoints(axis, rvec, tvec, intrinsic_matrix, None)
@@ -181,24 +214,18 @@ while cap.isOpened():
         if len(obj_list) == 0:
             obj_list.append(obj[use_index, :])
             scene_list.append(scene[use_index, :])
-        res = optimize.fmin(solvePnP_lists_from_focal_length, 1000,
-                            args=(obj_list, scene_list, camera_center_x, camera_center_y))
-        with open('camera_parameters.pkl', 'wb') as f:
-            pickle.dump([res[0], res[0], frame.shape[1]/2, frame.shape[0]/2], f)
-        print(f"focal_length_x = {res[0]}\nfocal_length_y = {res[0]}\n" +
-              f"camera_center_x = {frame.shape[1] / 2}\ncamera_center_y = {frame.shape[0] / 2}")
-        # minsums = []
-        # for fl in np.linspace(300,2300, 201):
-        #     minsums.append(solvePnP_lists_from_focal_length([fl], obj_list, scene_list, camera_center_x, camera_center_y))
-        # plt.scatter(np.linspace(300,2300, 201), minsums)
-        # plt.xlabel('Focal Length')
-        # plt.ylabel('Sum of Average Reprojection Error')
-        # plt.show()
+        # The camera center can only be estimated from several views at different angles
+        fixed = () if len(obj_list) >= 3 else ('cx', 'cy')
+        res = calibrate(obj_list, scene_list, initial_parameters, initial_distortion, args.distortion, fixed,
+                        workers=args.workers)
+        initial_parameters = res.parameters()[:4]
+        initial_distortion = res.distortion if args.distortion else initial_distortion
+        save_calibration(res, len(obj_list), args.distortion)
         obj_list = []
         scene_list = []
     if waitkey == ord('c'):
-        res = optimize.fmin(solvePnP_from_focal_length, 1800,
-                            args=(obj[use_index, :], scene[use_index, :], camera_center_x, camera_center_y))
-        print(f"focal_length_x = {res[0]}\nfocal_length_y = {res[0]}\n" +
+        res = calibrate([obj[use_index, :]], [scene[use_index, :]],
+                        [1800, 1800, frame.shape[1] / 2, frame.shape[0] / 2], fixed=('cx', 'cy'), equal_focal=True)
+        print(f"focal_length_x = {res.intrinsic_matrix[0, 0]}\nfocal_length_y = {res.intrinsic_matrix[1, 1]}\n" +
               f"camera_center_x = {frame.shape[1]/2}\ncamera_center_y = {frame.shape[0]/2}")
         #cv.imwrite(f'{now.strftime("%Y.%m.%d.%H.%M.%S")}_backproject.jpg', img_scene_color)
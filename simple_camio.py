@@ -1,36 +1,23 @@
+import time
+process_start = time.perf_counter()
 import os
 import cv2 as cv
 import datetime
-import time
 import numpy as np
 import pickle
 import argparse
-import pyglet.media
-from scipy import stats
 from map_parameters import *
-
-
-
-# Function to sort corners by id based on how they are arranged
-def sort_corners_by_id(corners, id, scene):
-    use_index = np.zeros(16, dtype=bool)
-    for i in range(len(corners)):
-        corner_num = ids[i, 0]
-        if corner_num < 4:
-            for j in range(4):
-                use_index[4 * corner_num + j] = True
-                scene[4 * corner_num + j, :] = corners[i][0][j]
-    return scene, use_index
-
-
-# Function to reverse the projection of a point given a rvec and tvec
-def reverse_project(point, rvec, tvec):
-    poi = np.matrix(point)
-    R, _ = cv.Rodrigues(rvec)
-    R_mat = np.matrix(R)
-    R_inv = np.linalg.inv(R_mat)
-    T = np.matrix(tvec)
-    return np.array(R_inv * (poi - T))
+from frame_processor import FrameProcessor
+from zone_resolver import ZoneResolver
+from pointer_filter import PointerFilter
+from audio_bank import AudioBank
+from control_channel import ControlChannel
+from camio_pipeline import CameraPipeline
+from camera_capture import CameraOpener
+from adaptive_scheduler import AdaptiveScheduler
+from zone_events import ZoneTracker, EventBus, AudioSink, LogSink, TcpSink
+from camio_metrics import Metrics, MetricsServer, CsvDumper, RateLimitedLog
+from startup_timer import StartupTimer
 
 
 # Function to create 3D points from 2D pixels on a sheet of paper
@@ -43,25 +30,6 @@ def get_3d_points_from_pixels(obj_pts, pixels_per_cm):
     return pts_3d
 
 
-# Draws the axes on the image
-def drawAxes(img, imgpts):
-    imgpts = imgpts.astype(int)
-    corner = tuple(imgpts[3].ravel())
-    img = cv.line(img, corner, tuple(imgpts[0].ravel()), (255, 0, 0), 5)
-    img = cv.line(img, corner, tuple(imgpts[1].ravel()), (0, 255, 0), 5)
-    img = cv.line(img, corner, tuple(imgpts[2].ravel()), (0, 0, 255), 5)
-    return img
-
-
-# Retrieves the zone of the point of interest on the map
-def get_zone(point_of_interest, img_map, pixels_per_cm):
-    x = int(point_of_interest[0] * pixels_per_cm)
-    y = int(point_of_interest[1] * pixels_per_cm)
-    if 0 <= x < img_map.shape[1] and 0 <= y < img_map.shape[0]:
-        return img_map[y, x]
-    else:
-        return 0
-
 #========================================
 pixels_per_cm_obj = 118.49  # text-with-aruco.png
 focal_length_x = 1.88842395e+03
@@ -74,11 +42,58 @@ use_external_cam = 0
 
 parser = argparse.ArgumentParser(description='Code for CamIO.')
 parser.add_argument('--input1', help='Path to input zone image.', default='zone_map.png')
+parser.add_argument('--map', help='Map package built with map_package.py, used instead of --input1 and the map ' +
+                    'parameters.')
+parser.add_argument('--maps', help='Directory of map packages: the map on the table is recognized by its marker ids ' +
+                    'and its zones and sounds are loaded when it appears.')
+parser.add_argument('--zones', help='Zones as polygons in a GeoJSON (in cm) or SVG (at pixels_per_cm_obj) file, ' +
+                    'used instead of --input1.')
+parser.add_argument('--camera', help='Camera index, or a video file, image directory or glob pattern to replay ' +
+                    '(default: use_external_cam).', default=str(use_external_cam))
+parser.add_argument('--camera-fps', help='Frame rate asked of the camera.', type=float, default=30.0)
+parser.add_argument('--camera-format', help='FOURCC pixel format asked of the camera, e.g. MJPG or YUYV.',
+                    default='MJPG')
+parser.add_argument('--color', help='Capture color frames (e.g. for snapshots) instead of grayscale only.',
+                    action='store_true')
+parser.add_argument('--downscale', help='Factor by which frames are downscaled for marker detection.',
+                    type=float, default=1.0)
+parser.add_argument('--headless', help='Run without the debug window, control from stdin or signals.',
+                    action='store_true')
+parser.add_argument('--debug-fps', help='Maximum frame rate of the debug window.', type=float, default=15.0)
+parser.add_argument('--no-pointer-filter', help='Look up zones at the raw pointer tip of each frame.',
+                    action='store_true')
+parser.add_argument('--pointer-ids', help='Marker ids of the pointers (default: any 5x5 marker).', type=int,
+                    nargs='+')
+parser.add_argument('--idle-after', help='Seconds without a pointer before switching to the idle scan (0: never).',
+                    type=float, default=10.0)
+parser.add_argument('--idle-fps', help='Frames per second checked for motion in idle mode.', type=float, default=15.0)
+parser.add_argument('--active-fps', help='Maximum frames per second processed in active mode.', type=float)
+parser.add_argument('--trace', help='Record the pointer poses, tips and zones to this trace file.')
+parser.add_argument('--trace-capacity', help='Records kept in the trace file before the oldest are overwritten.',
+                    type=int, default=1 << 20)
+parser.add_argument('--events-port', help='Send the zone events as JSON lines to TCP clients on this port.',
+                    type=int)
+parser.add_argument('--metrics-port', help='Serve the metrics as text at http://localhost:PORT/metrics.', type=int)
+parser.add_argument('--metrics-csv', help='Append the metrics to this CSV file every --metrics-interval seconds.')
+parser.add_argument('--metrics-interval', help='Seconds between CSV metrics dumps.', type=float, default=10.0)
+parser.add_argument('--log-interval', help='Minimum seconds between repeated log messages.', type=float, default=1.0)
 args = parser.parse_args()
+startup = StartupTimer(process_start)
+startup.record('imports')
+metrics = Metrics()
+log = RateLimitedLog(args.log_interval)
+
+# Opening and configuring the camera is slow, so it runs in the background while the map and the sounds load
+camera_opener = CameraOpener(args.camera, gray=not args.color, realtime=True, fps=args.camera_fps,
+                              fourcc=args.camera_format)
+camera_opener.start()
 
 if os.path.isfile('camera_parameters.pkl'):
     with open('camera_parameters.pkl', 'rb') as f:
-        focal_length_x, focal_length_y, camera_center_x, camera_center_y = pickle.load(f)
+        params = pickle.load(f)
+        focal_length_x, focal_length_y, camera_center_x, camera_center_y = params[:4]
+        if len(params) > 4:
+            distortion = np.array(params[4:], dtype=np.float32)
         print("loaded camera parameters from file.")
 
 intrinsic_matrix = np.array([[focal_length_x, 0.00000000e+00, camera_center_x],
@@ -86,136 +101,201 @@ intrinsic_matrix = np.array([[focal_length_x, 0.00000000e+00, camera_center_x],
                              [0.00000000e+00, 0.00000000e+00, 1.00000000e+00]], dtype=np.float32)
 # intrinsic_matrix = np.transpose(np.array([[1469.8549, 0.0, 0.0], [0.0, 1469.8549, 0.0], [964.5927, 718.271, 1.0]], dtype=np.float32))
 
+# Pointer filter: the tip is smoothed and predicted to when its sound will start, so the zone filter window can be
+# short. Without it, a longer window is needed against jitter at zone borders.
+pointer_lead_time = 0.08  # seconds from frame capture to the start of the sound
+pointer_max_dropout = 0.25  # seconds the tip is extrapolated while the pointer marker is not found
+
 # Zone filter logic
-prev_zone_name = None
-zone_filter_size = 10
-zone_filter = np.zeros(zone_filter_size, dtype=int)
-zone_filter_cnt = 0
-
-# Load color image
-img_map_color = cv.imread(args.input1, cv.IMREAD_COLOR)  # Image.open(cv.samples.findFile(args.input1))
-img_map = cv.cvtColor(img_map_color, cv.COLOR_BGR2GRAY)
-
-scene = np.empty((16, 2), dtype=np.float32)
-player = pyglet.media.Player()
-cap = cv.VideoCapture(use_external_cam)
-start_time = time.time()
-cap.set(cv.CAP_PROP_FRAME_HEIGHT,1080) #set camera image height
-cap.set(cv.CAP_PROP_FRAME_WIDTH,1920) #set camera image width
-cap.set(cv.CAP_PROP_FOCUS,0)
+zone_filter_size = 10 if args.no_pointer_filter else 3
+zone_min_votes = 1  # votes a new zone needs in the filter window before it is reported
+zone_dwell_frames = 1  # consecutive frames a new zone must lead the filter window before it is reported
+
+marker_ids = None
+maps = None
+with startup.step('map'):
+    if args.maps:
+        # Zones and sounds are loaded when a map of the library is recognized
+        from board_registry import MapLibrary
+        maps = MapLibrary(args.maps, filter_size=zone_filter_size, min_votes=zone_min_votes,
+                          dwell_frames=zone_dwell_frames)
+        print(maps.describe())
+        obj = None
+        zone_names = {}
+        audio_bank = AudioBank('', {}, metrics=metrics)
+    elif args.map:
+        # The zone raster is memory-mapped from the package and the sound files are read from it
+        from map_package import MapPackage
+        package = MapPackage(args.map)
+        img_map = None
+        zone_map = package.zone_map
+        pixels_per_cm_obj = package.pixels_per_cm
+        obj = package.obj
+        marker_ids = package.marker_ids
+        zone_names = package.zones
+        audio_bank = AudioBank('', package.sounds(), open_sound=package.open_sound, metrics=metrics)
+    elif args.zones:
+        # Polygon zones, with the names and sounds from the file if it has them
+        from vector_zones import VectorZoneMap
+        if args.zones.lower().endswith('.svg'):
+            zone_map = VectorZoneMap.from_svg(args.zones, pixels_per_cm_obj)
+        else:
+            zone_map = VectorZoneMap.from_geojson(args.zones)
+        img_map = None
+        zone_names = zone_map.names or map_dict_ukraine
+        audio_bank = AudioBank('./MP3/', zone_map.sounds or sound_dict_ukraine, metrics=metrics)
+    else:
+        # Load the zone image, decoded straight to grayscale
+        img_map = cv.imread(args.input1, cv.IMREAD_GRAYSCALE)
+        zone_map = None
+        zone_names = map_dict_ukraine
+        audio_bank = AudioBank('./MP3/', sound_dict_ukraine, metrics=metrics)
+
+# Decode all the sound clips in the background while the camera starts
+audio_bank.start()
+
+zone_resolver = None
+with startup.step('zone lookup'):
+    if maps is None:
+        zone_resolver = ZoneResolver(img_map, pixels_per_cm_obj, zone_names.keys(), zone_filter_size, zone_min_votes,
+                                     zone_dwell_frames, zone_map=zone_map)
+with startup.step('processing setup'):
+    pointer_filter = None
+    if not args.no_pointer_filter:
+        pointer_filter = PointerFilter(max_dropout=pointer_max_dropout, lead_time=pointer_lead_time)
+    processor = FrameProcessor(obj, intrinsic_matrix, distortion, zone_resolver, args.downscale, pointer_filter,
+                               metrics, args.pointer_ids, marker_ids=marker_ids, maps=maps)
+with startup.step('waiting for camera'):
+    cap = camera_opener.result()
+startup.record('camera open (background)', camera_opener.started, camera_opener.finished)
+print(cap.describe())
+metrics.add_source(cap.stats, 'capture_')
+
+# Capture and processing run on their own threads, this loop is the output stage. While nobody uses the map, the
+# scheduler only checks a few frames per second for motion.
+scheduler = None
+if args.idle_after > 0:
+    scheduler = AdaptiveScheduler(processor, args.idle_after, args.idle_fps, active_fps=args.active_fps)
+    metrics.add_source(scheduler.stats, 'scheduler_')
+    pipeline = CameraPipeline(cap, scheduler.process, metrics=metrics, frame_interval=scheduler.frame_interval)
+else:
+    pipeline = CameraPipeline(cap, processor.process, metrics=metrics)
+pipeline.start()
+
+# Stage latencies and counters, served over HTTP and dumped to CSV when asked for
+metrics.add_source(audio_bank.metrics, 'audio_')
+metrics_server = None
+if args.metrics_port is not None:
+    metrics_server = MetricsServer(metrics, args.metrics_port)
+    metrics_server.start()
+    print(f"Metrics at http://localhost:{metrics_server.port}/metrics")
+csv_dumper = None
+if args.metrics_csv:
+    csv_dumper = CsvDumper(metrics, args.metrics_csv, args.metrics_interval)
+    csv_dumper.start()
+trace = None
+if args.trace:
+    from trace_recorder import TraceRecorder
+    trace = TraceRecorder(args.trace, args.trace_capacity)
+    trace.start()
+    metrics.add_source(lambda: {'trace_dropped': trace.dropped})
+
+# Zone changes are published as events, consumed by the sinks on the event bus thread. Each pointer has its own
+# zone and plays on its own audio channel.
+zone_tracker = ZoneTracker(zone_names)
+events = EventBus()
+events.add_sink(AudioSink(audio_bank, metrics=metrics), maxsize=8)
+events.add_sink(LogSink(log))
+events_feed = None
+if args.events_port is not None:
+    events_feed = TcpSink(args.events_port)
+    events.add_sink(events_feed, maxsize=256)
+events.start()
+if events_feed is not None:
+    print(f"Zone events on TCP port {events_feed.port}")
+metrics.add_source(events.stats)
+
+# Control input comes from stdin and signals, and from the keys of the debug window when there is one
+controls = ControlChannel()
+controls.start_stdin()
+controls.install_signal_handlers()
+debug_view = None
+if not args.headless:
+    from debug_view import DebugView, draw_result
+    debug_view = DebugView(lambda img, result: draw_result(img, result, obj if result.map is None else
+                                                           result.map.board.obj, intrinsic_matrix, distortion),
+                           controls, args.debug_fps)
+    debug_view.start()
+last_result = None  # snapshots are taken from it, its frame stays valid until the next result is taken
+current_map = None
 
 # Main loop
-while cap.isOpened():
-    ret, frame = cap.read()
-    if not ret:
-        print("No camera image returned.")
+while pipeline.is_running():
+    commands = controls.poll()
+    if 'stats' in commands:
+        print(pipeline.counters)
+        print(audio_bank.metrics())
+        print(metrics.report())
+        if scheduler is not None:
+            print(scheduler.report())
+    if 'snapshot' in commands and last_result is not None:
+        now = datetime.datetime.now()
+        cv.imwrite(f'{now.strftime("%Y.%m.%d.%H.%M.%S")}_frame.jpg', last_result.frame)
+    if 'quit' in commands:
+        print('Quit.')
         break
 
-    img_scene_color = frame
-
-    # load images grayscale
-    img_scene = cv.cvtColor(img_scene_color, cv.COLOR_BGR2GRAY)
-
-    # Define aruco marker dictionary and parameters object to include subpixel resolution
-    aruco_dict = cv.aruco.Dictionary_get(cv.aruco.DICT_4X4_50)
-    arucoParams = cv.aruco.DetectorParameters_create()
-    arucoParams.cornerRefinementMethod = cv.aruco.CORNER_REFINE_SUBPIX
-    # Detect aruco markers in image
-    (corners, ids, rejected) = cv.aruco.detectMarkers(img_scene, aruco_dict, parameters=arucoParams)
-    scene, use_index = sort_corners_by_id(corners, id, scene)
-
-    if ids is None or not any(use_index):
-        print("No markers found.")
-        cv.imshow('image reprojection', img_scene_color)
-        waitkey = cv.waitKey(1)
-        if waitkey == 27:
-            print('Escape.')
-            cap.release()
-            cv.destroyAllWindows()
-            break
+    result = pipeline.get_result(timeout=0.1)
+    if result is None:
         continue
-
-    # Run solvePnP using the markers that have been observed
-    retval, rvec, tvec = cv.solvePnP(obj[use_index, :], scene[use_index, :], intrinsic_matrix, None)
-
-    # Draw axes on the image
-    axis = np.float32([[6, 0, 0], [0, 6, 0], [0, 0, -6], [0, 0, 0]]).reshape(-1, 3)
-    axis_pts, other = cv.projectPoints(axis, rvec, tvec, intrinsic_matrix, None)
-    img_scene_color = drawAxes(img_scene_color, axis_pts)
-
-    # Draw circles on the backprojected corner points
-    backprojection_pts, other = cv.projectPoints(obj, rvec, tvec, intrinsic_matrix, None)
-    for idx, pts in enumerate(backprojection_pts):
-        cv.circle(img_scene_color, (int(pts[0, 0]), int(pts[0, 1])), 4, (255, 255, 255), 2)
-        cv.line(img_scene_color, (int(pts[0, 0] - 1), int(pts[0, 1])), (int(pts[0, 0]) + 1, int(pts[0, 1])),
-                (255, 0, 0), 1)
-        cv.line(img_scene_color, (int(pts[0, 0]), int(pts[0, 1]) - 1), (int(pts[0, 0]), int(pts[0, 1]) + 1),
-                (255, 0, 0), 1)
-        # cv.line(img_scene_color, (int(pts[0,0]), int(pts[0,1])), (int(scene[idx,0]), int(scene[idx,1])), (0, 255, 0), 1)
-
-    # Set up aruco detection for the pointer marker
-    aruco_dict = cv.aruco.Dictionary_get(cv.aruco.DICT_5X5_50)
-    dp = cv.aruco.DetectorParameters_create()
-    dp.cornerRefinementMethod = cv.aruco.CORNER_REFINE_SUBPIX
-
-    corners, ids, _ = cv.aruco.detectMarkers(img_scene, aruco_dict, parameters=dp)
-    obj_aruco = np.empty((4, 3), dtype=np.float32)
-    scene_aruco = np.empty((4, 2), dtype=np.float32)
-
-    # if we are just using 1 large marker
-    obj_aruco[0, :] = [0.5, 0.5, 0]
-    obj_aruco[1, :] = [3.5, 0.5, 0]
-    obj_aruco[2, :] = [3.5, 3.5, 0]
-    obj_aruco[3, :] = [0.5, 3.5, 0]
-
-    if len(corners) > 0:
-        for i in range(4):
-            scene_aruco[i, :] = corners[0][0][i]
-            cv.circle(img_scene_color, (int(scene_aruco[i, 0]), int(scene_aruco[i, 1])), 3, (255, 255, 255), 2)
-
-    retval, rvec_aruco, tvec_aruco = cv.solvePnP(obj_aruco, scene_aruco, intrinsic_matrix, distortion)
-    # Backproject pointer tip and draw it on the image
-    backprojection_pt, other = cv.projectPoints(np.array([0, 0, 0], dtype=np.float32).reshape(1, 3), rvec_aruco,
-                                                tvec_aruco, intrinsic_matrix, distortion)
-    if len(corners) > 0:
-        cv.circle(img_scene_color, (int(backprojection_pt[0, 0, 0]), int(backprojection_pt[0, 0, 1])), 2, (0, 255, 0), 2)
-
-    # Get pointer location in coordinates of the aruco markers
-    point_of_interest = reverse_project(tvec_aruco, rvec, tvec)
-
-    # Filter the zones by returning the mode of the last [zone_filter_size] zones
-    zone_filter[zone_filter_cnt] = get_zone(point_of_interest, img_map, pixels_per_cm_obj)
-    zone_filter_cnt = (zone_filter_cnt + 1) % zone_filter_size
-    zone = stats.mode(zone_filter).mode[0]
-
-    # Check if the Z position is within the threshold, if so, play a sound
-    Z_threshold_cm = 2.0
-    if np.abs(point_of_interest[2]) < Z_threshold_cm:
-        zone_name = map_dict_ukraine.get(zone, None)
-        if zone_name:
-            if prev_zone_name != zone_name:
-                soundfile = './MP3/' + sound_dict_ukraine.get(zone, None)
-                if os.path.exists(soundfile) and time.time() - start_time > 0.5:
-                    sound = pyglet.media.load(soundfile, streaming=False)
-                    # player.next_source()
-                    # player.queue(sound)
-                    # player.play()
-                    sound.play()
-                    start_time = time.time()
-                    #playsound(soundfile, block=False)
-            prev_zone_name = zone_name
-            print(zone_name)
-        else:
-            prev_zone_name = None
-    # print(point_of_interest)#, dist, current_region)
-
-    now = datetime.datetime.now()
-    cv.imshow('image reprojection', img_scene_color)
-    waitkey = cv.waitKey(1)
-    if waitkey == ord('s'):
-        cv.imwrite(f'{now.strftime("%Y.%m.%d.%H.%M.%S")}_backproject.jpg', img_scene_color)
-    if waitkey == 27:#Escape key
-        print('Escape.')
-        cap.release()
-        cv.destroyAllWindows()
-        break
\ No newline at end of file
+    last_result = result
+    if startup is not None:
+        # The first processed frame ends the startup
+        startup.record('first result')
+        if audio_bank.preloaded.is_set():
+            startup.record('sounds decoded (background)', audio_bank.started, audio_bank.preload_finished)
+        print(startup.report())
+        metrics.set_gauge('startup_seconds', startup.steps[-1][2] - startup.start)
+        if not audio_bank.preloaded.is_set():
+            print("Sounds are still being decoded.")
+        startup = None
+    if debug_view is not None:
+        debug_view.update(result, str(pipeline.counters))
+    if trace is not None:
+        trace.record(result)
+    if result.map is not current_map:
+        # Another map of the library was put on the table
+        current_map = result.map
+        audio_bank.set_sounds('', current_map.package.sounds(), open_sound=current_map.package.open_sound)
+        zone_tracker.set_zones(current_map.zone_names)
+        print(f"Map: {current_map.name}")
+
+    if result.rvec is None:
+        metrics.increment('markers_lost')
+        log.log("No markers found.")
+        continue
+    if result.point_of_interest is None:
+        metrics.increment('pointer_lost')
+
+    # A pointer closer than 2 cm to the map enters the zone under it, which plays its sound
+    for event in zone_tracker.update(result):
+        if event.kind == 'enter':
+            metrics.increment('zone_changes')
+        events.publish(event)
+
+pipeline.stop()
+events.close()
+audio_bank.close()
+if debug_view is not None:
+    debug_view.stop()
+if metrics_server is not None:
+    metrics_server.stop()
+if csv_dumper is not None:
+    csv_dumper.stop()
+if trace is not None:
+    trace.close()
+print(pipeline.counters)
+print(audio_bank.metrics())
+print(metrics.report())
+if scheduler is not None:
+    print(scheduler.report())
@@ -0,0 +1,31 @@
+import contextlib
+import time
+
+
+# Start and end of each startup step, relative to the start of the process, to find what delays the first
+# interaction. Steps that run in the background are recorded with the times they were measured at.
+class StartupTimer:
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.steps = []  # (name, start, end) in perf_counter seconds
+
+    # Records a step that ran from [started] (default: the start of the process) until [finished] (default: now)
+    def record(self, name, started=None, finished=None):
+        started = self.start if started is None else started
+        finished = time.perf_counter() if finished is None else finished
+        self.steps.append((name, started, finished))
+
+    @contextlib.contextmanager
+    def step(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, started)
+
+    def report(self):
+        lines = [f"{'startup (ms)':32}{'start':>8}{'end':>8}{'took':>8}"]
+        for name, started, finished in self.steps:
+            lines.append(f"{name:32}{(started - self.start) * 1000:8.0f}{(finished - self.start) * 1000:8.0f}" +
+                         f"{(finished - started) * 1000:8.0f}")
+        return '\n'.join(lines)
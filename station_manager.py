@@ -0,0 +1,357 @@
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import time
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+import cv2 as cv
+import numpy as np
+import map_parameters
+from adaptive_scheduler import AdaptiveScheduler
+from audio_bank import AudioBank, decode_clip
+from calibration_solver import load_camera_parameters
+from camio_metrics import Metrics, MetricsServer
+from camio_pipeline import CameraPipeline
+from camera_capture import open_source
+from board_registry import MapLibrary
+from control_channel import ControlChannel
+from frame_processor import FrameProcessor
+from pointer_filter import PointerFilter
+from trace_recorder import TraceRecorder
+from zone_events import ZoneTracker, EventBus, AudioSink, TcpSink
+from zone_resolver import ZoneResolver, nearest_zone_map
+
+# Zone names and sound files of the maps a station can use
+MAPS = {'default': (map_parameters.map_dict, map_parameters.sound_dict),
+        'ukraine': (map_parameters.map_dict_ukraine, map_parameters.sound_dict_ukraine)}
+
+# Used when a station has no camera_parameters.pkl, as in simple_camio.py
+DEFAULT_CAMERA_PARAMETERS = [1.88842395e+03, 1.89329463e+03, 9.21949329e+02, 3.34464319e+02]
+
+
+# One camera and map pair, as listed in the stations file
+@dataclass
+class StationConfig:
+    name: str
+    camera: object = 0  # camera index, or video file / stream URL / image directory
+    camera_fps: float = 30.0
+    camera_format: str = 'MJPG'  # FOURCC pixel format asked of the camera
+    color: bool = False  # capture color frames instead of grayscale only
+    zone_map: str = 'zone_map.png'
+    map: str = 'ukraine'
+    sound_dir: str = './MP3/'
+    pixels_per_cm: float = 118.49
+    camera_parameters: str = 'camera_parameters.pkl'
+    downscale: float = 1.0
+    metrics_port: int = 0  # serve the metrics of the station at http://localhost:metrics_port/metrics if set
+    trace: str = ''  # trace file recording the interactions, if set
+    events_port: int = 0  # send the zone events as JSON lines to TCP clients on this port if set
+    idle_after: float = 10.0  # seconds without a pointer before switching to the idle scan, 0 to never idle
+    maps: str = ''  # directory of map packages recognized by their marker ids, used instead of zone_map and map
+
+
+# Health report sent by a station process
+@dataclass
+class StationStatus:
+    name: str
+    state: str  # starting, running, idle, no camera, camera lost, stopped, error
+    pid: int
+    fps: float = 0.0
+    latency: float = 0.0  # capture-to-result time of the last processed frame, in seconds
+    zone: int = 0
+
+
+def load_stations(path):
+    with open(path) as f:
+        return [StationConfig(**station) for station in json.load(f)['stations']]
+
+
+# NumPy array in a named shared memory block. The manager creates it, station processes attach to it by descriptor
+# and get a read-only view, so a station can't corrupt the assets of the others.
+class SharedArray:
+    def __init__(self, shm, shape, dtype):
+        self.shm = shm
+        self.array = np.ndarray(shape, dtype, buffer=shm.buf)
+
+    @classmethod
+    def create(cls, array):
+        shared = cls(shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1)), array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    @classmethod
+    def attach(cls, descriptor):
+        name, shape, dtype = descriptor
+        shared = cls(shared_memory.SharedMemory(name=name), shape, dtype)
+        shared.array.flags.writeable = False
+        return shared
+
+    def descriptor(self):
+        return self.shm.name, self.array.shape, self.array.dtype.str
+
+    def unlink(self):
+        self.array = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+# Body of a station process: the same capture, processing and output stages as simple_camio.py, with the zone map and
+# the decoded sound clips read from shared memory (neither is used by stations with maps). Exits with status 1 when the
+# camera is lost so that the manager restarts it.
+def run_station(config, zone_map_descriptor, clip_descriptors, status, stop_event, report_interval=1.0):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the manager stops the stations
+    pid = os.getpid()
+    status.put(StationStatus(config.name, 'starting', pid))
+
+    # Shared blocks stay mapped until the process exits
+    zone_map = SharedArray.attach(zone_map_descriptor) if zone_map_descriptor is not None else None
+    clips = {key: (SharedArray.attach(descriptor), fmt) for key, (descriptor, fmt) in clip_descriptors.items()}
+
+    map_dict, sound_dict = MAPS[config.map]
+    params, distortion = load_camera_parameters(config.camera_parameters)
+    fx, fy, cx, cy = params if params is not None else DEFAULT_CAMERA_PARAMETERS
+    intrinsic_matrix = np.array([[fx, 0.0, cx], [0.0, fy, cy], [0.0, 0.0, 1.0]], dtype=np.float32)
+    if distortion is None:
+        distortion = np.zeros(5, dtype=np.float32)
+
+    cap = open_source(config.camera, gray=not config.color, realtime=True, fps=config.camera_fps,
+                      fourcc=config.camera_format)
+    if not cap.isOpened():
+        status.put(StationStatus(config.name, 'no camera', pid))
+        sys.exit(1)
+
+    metrics = Metrics()
+    metrics.add_source(cap.stats, 'capture_')
+    if config.maps:
+        # The zones and sounds of the map in view are loaded from its package, per station
+        processor = FrameProcessor(None, intrinsic_matrix, distortion, None, config.downscale, PointerFilter(),
+                                   metrics, maps=MapLibrary(config.maps, filter_size=3))
+        audio_bank = AudioBank('', {}, metrics=metrics)
+        map_dict = {}
+    else:
+        zone_resolver = ZoneResolver(None, config.pixels_per_cm, filter_size=3, zone_map=zone_map.array)
+        processor = FrameProcessor(map_parameters.obj, intrinsic_matrix, distortion, zone_resolver, config.downscale,
+                                   PointerFilter(), metrics)
+        audio_bank = AudioBank(config.sound_dir, sound_dict,
+                               decoded={key: (clip.array, fmt) for key, (clip, fmt) in clips.items()}, metrics=metrics)
+    audio_bank.start()
+    scheduler = None
+    if config.idle_after > 0:
+        scheduler = AdaptiveScheduler(processor, config.idle_after)
+        metrics.add_source(scheduler.stats, 'scheduler_')
+        pipeline = CameraPipeline(cap, scheduler.process, metrics=metrics, frame_interval=scheduler.frame_interval)
+    else:
+        pipeline = CameraPipeline(cap, processor.process, metrics=metrics)
+    pipeline.start()
+    metrics.add_source(audio_bank.metrics, 'audio_')
+    metrics_server = None
+    if config.metrics_port:
+        metrics_server = MetricsServer(metrics, config.metrics_port)
+        metrics_server.start()
+    trace = None
+    if config.trace:
+        trace = TraceRecorder(config.trace)
+        trace.start()
+
+    zone_tracker = ZoneTracker(map_dict)
+    events = EventBus()
+    events.add_sink(AudioSink(audio_bank, metrics=metrics), maxsize=8)
+    if config.events_port:
+        events.add_sink(TcpSink(config.events_port), maxsize=256)
+    events.start()
+    metrics.add_source(events.stats)
+    zone = 0
+    current_map = None
+    last_report = time.monotonic()
+    last_processed = 0
+    while pipeline.is_running() and not stop_event.is_set():
+        result = pipeline.get_result(timeout=0.1)
+        if result is not None and result.rvec is None:
+            metrics.increment('markers_lost')
+        if result is not None:
+            if trace is not None:
+                trace.record(result)
+            if result.map is not current_map:
+                current_map = result.map
+                audio_bank.set_sounds('', current_map.package.sounds(), open_sound=current_map.package.open_sound)
+                zone_tracker.set_zones(current_map.zone_names)
+            for event in zone_tracker.update(result):
+                if event.kind == 'enter':
+                    metrics.increment('zone_changes')
+                events.publish(event)
+            # The status reports the pointer with the lowest id
+            if result.tip is not None and np.abs(result.tip[2]) < 2.0:
+                zone = result.zone
+
+        now = time.monotonic()
+        if now - last_report >= report_interval:
+            fps = (pipeline.counters.processed - last_processed) / (now - last_report)
+            state = 'idle' if scheduler is not None and scheduler.mode == 'idle' else 'running'
+            status.put(StationStatus(config.name, state, pid, fps, pipeline.counters.latency, zone))
+            last_report = now
+            last_processed = pipeline.counters.processed
+
+    camera_lost = not stop_event.is_set()
+    pipeline.stop()
+    events.close()
+    audio_bank.close()
+    if metrics_server is not None:
+        metrics_server.stop()
+    if trace is not None:
+        trace.close()
+    status.put(StationStatus(config.name, 'camera lost' if camera_lost else 'stopped', pid))
+    sys.exit(1 if camera_lost else 0)
+
+
+# Runs every station in its own process. Zone maps and sound clips are built and decoded once, in shared memory,
+# and mapped read-only by the station processes that use them. Stations whose process exits (e.g. because the
+# camera was unplugged) are restarted after restart_delay seconds, doubled on each consecutive failure up to
+# max_restart_delay. Processes are spawned, so each station starts with a fresh camera and audio state.
+class StationManager:
+    def __init__(self, stations, restart_delay=2.0, max_restart_delay=30.0, report_interval=1.0):
+        self.stations = {station.name: station for station in stations}
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.report_interval = report_interval
+
+        self.context = multiprocessing.get_context('spawn')
+        self.status = self.context.Queue()
+        self.stop_event = self.context.Event()
+        self.zone_maps = {}  # (zone map file, pixels per cm, map) -> SharedArray
+        self.clips = {}  # sound file -> (SharedArray, format)
+        self.processes = {}
+        self.health = {name: StationStatus(name, 'stopped', 0) for name in self.stations}
+        self.restarts = dict.fromkeys(self.stations, 0)
+        self.started_at = {}
+        self.next_start = {}
+        self.delays = dict.fromkeys(self.stations, restart_delay)
+
+    # Stations with maps load the zones and sounds of their map packages themselves
+    def load_assets(self):
+        for station in self.stations.values():
+            if station.maps:
+                continue
+            key = (station.zone_map, station.pixels_per_cm, station.map)
+            if key not in self.zone_maps:
+                img_map = cv.imread(station.zone_map, cv.IMREAD_GRAYSCALE)
+                if img_map is None:
+                    raise FileNotFoundError(station.zone_map)
+                zone_map = nearest_zone_map(img_map, 0.2 * station.pixels_per_cm, MAPS[station.map][0].keys())
+                self.zone_maps[key] = SharedArray.create(zone_map)
+
+            for filename in MAPS[station.map][1].values():
+                path = os.path.join(station.sound_dir, filename)
+                if path in self.clips:
+                    continue
+                try:
+                    samples, fmt = decode_clip(path)
+                except Exception as e:
+                    print(f"Could not decode {path}: {e}")
+                    continue
+                self.clips[path] = (SharedArray.create(samples), fmt)
+
+    def start(self):
+        self.load_assets()
+        for name in self.stations:
+            self._start(name)
+
+    # Collects the health reports and restarts the stations that exited. Call regularly from the main loop.
+    def poll(self):
+        while True:
+            try:
+                report = self.status.get_nowait()
+            except queue.Empty:
+                break
+            self.health[report.name] = report
+
+        now = time.monotonic()
+        for name, process in list(self.processes.items()):
+            if process.is_alive() or self.stop_event.is_set():
+                continue
+            process.join()
+            del self.processes[name]
+            if self.health[name].state not in ('no camera', 'camera lost'):
+                self.health[name] = StationStatus(name, 'error', process.pid)
+            # A station that ran for a while gets restarted quickly again
+            if now - self.started_at[name] > self.max_restart_delay:
+                self.delays[name] = self.restart_delay
+            self.next_start[name] = now + self.delays[name]
+            self.delays[name] = min(self.delays[name] * 2, self.max_restart_delay)
+
+        for name, start_time in list(self.next_start.items()):
+            if now >= start_time:
+                del self.next_start[name]
+                self.restarts[name] += 1
+                self._start(name)
+
+    def report(self):
+        lines = [f"{'station':16}{'state':14}{'FPS':>8}{'latency':>12}{'zone':>6}{'restarts':>10}"]
+        for name, health in self.health.items():
+            state = health.state if name not in self.next_start else f"{health.state}*"
+            lines.append(f"{name:16}{state:14}{health.fps:8.1f}{health.latency * 1000:9.1f} ms" +
+                         f"{health.zone:6d}{self.restarts[name]:10d}")
+        return '\n'.join(lines)
+
+    def stop(self):
+        self.stop_event.set()
+        for process in self.processes.values():
+            process.join(timeout=3.0)
+            if process.is_alive():
+                process.terminate()
+        self.processes = {}
+        for shared in self.zone_maps.values():
+            shared.unlink()
+        for shared, fmt in self.clips.values():
+            shared.unlink()
+        self.zone_maps = {}
+        self.clips = {}
+
+    def _start(self, name):
+        station = self.stations[name]
+        zone_map_descriptor = None
+        clip_descriptors = {}
+        if not station.maps:
+            zone_map_descriptor = self.zone_maps[(station.zone_map, station.pixels_per_cm, station.map)].descriptor()
+            for key, filename in MAPS[station.map][1].items():
+                path = os.path.join(station.sound_dir, filename)
+                if path in self.clips:
+                    shared, fmt = self.clips[path]
+                    clip_descriptors[key] = (shared.descriptor(), fmt)
+        process = self.context.Process(target=run_station, name=f"station-{name}",
+                                       args=(station, zone_map_descriptor, clip_descriptors, self.status,
+                                             self.stop_event, self.report_interval),
+                                       daemon=True)
+        process.start()
+        self.processes[name] = process
+        self.started_at[name] = time.monotonic()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs several CamIO stations on one host.')
+    parser.add_argument('stations', help='JSON file listing the stations.')
+    parser.add_argument('--report-interval', help='Seconds between health reports.', type=float, default=10.0)
+    args = parser.parse_args()
+
+    manager = StationManager(load_stations(args.stations))
+    manager.start()
+    controls = ControlChannel()
+    controls.start_stdin()
+    controls.install_signal_handlers()
+
+    last_report = time.monotonic()
+    while True:
+        commands = controls.poll()
+        if 'quit' in commands:
+            print('Quit.')
+            break
+        manager.poll()
+        if 'stats' in commands or time.monotonic() - last_report >= args.report_interval:
+            print(manager.report())
+            last_report = time.monotonic()
+        time.sleep(0.2)
+    manager.stop()
+    print(manager.report())
@@ -0,0 +1,79 @@
+import numpy as np
+from camera_capture import FramePool, FrameSource, to_gray
+
+
+# Reads 4x4 frames into the buffer it is given, or fails where [results] says so
+class ListSource(FrameSource):
+    def __init__(self, results, pool_size=2):
+        super().__init__(pool_size=pool_size)
+        self.results = list(results)
+
+    def _read(self, buffer):
+        if not self.results.pop(0):
+            return False, None
+        frame = np.empty((4, 4), np.uint8) if buffer is None else buffer
+        frame[:] = self.frames
+        return True, frame
+
+
+# A released frame is read into again, frames still in use are not
+def test_reuse_released_frames():
+    source = ListSource([True] * 4)
+    _, first = source.read()
+    _, second = source.read()
+    assert second is not first
+    source.release_frame(first)
+    _, third = source.read()
+    assert third is first and third[0, 0] == 2 and second[0, 0] == 1
+    _, fourth = source.read()
+    assert fourth is not first and fourth is not second
+    assert source.stats()['buffers'] == 2 and source.pool.reused == 1
+
+
+# Releasing a frame twice, or one that is not pooled, doesn't hand it out twice
+def test_release_twice():
+    source = ListSource([True] * 3, pool_size=1)
+    _, first = source.read()
+    source.release_frame(first)
+    source.release_frame(first)
+    source.release_frame(np.zeros((4, 4), np.uint8))
+    assert source.pool.free == [first]
+    _, second = source.read()
+    _, third = source.read()
+    assert second is first and third is not first
+
+
+# A failed read hands the buffer it was given back to the pool
+def test_failed_read_keeps_buffer():
+    source = ListSource([True, False, True])
+    _, first = source.read()
+    source.release_frame(first)
+    assert source.read() == (False, None)
+    _, second = source.read()
+    assert second is first
+
+
+# A frame the reader allocated itself leaves the buffer free, a frame of another size replaces it
+def test_give_unused_buffer():
+    pool = FramePool(1)
+    frame = np.zeros((4, 4), np.uint8)
+    pool.give(None, frame)
+    pool.release(frame)
+    buffer = pool.take()
+    pool.give(buffer, np.zeros((4, 4), np.uint8))
+    assert pool.free == [frame]
+    buffer = pool.take()
+    larger = np.zeros((8, 8), np.uint8)
+    pool.give(buffer, larger)
+    assert pool.buffers == [larger] and pool.free == []
+
+
+# Gray frames are copied, into the buffer when it fits, as the backend reads into them again
+def test_to_gray_copies_gray_frames():
+    raw = np.arange(16, dtype=np.uint8).reshape(4, 4)
+    gray = to_gray(raw)
+    assert gray is not raw and np.array_equal(gray, raw)
+    buffer = np.zeros((4, 4), np.uint8)
+    assert to_gray(raw, buffer) is buffer and np.array_equal(buffer, raw)
+    gray = to_gray(raw, np.zeros((2, 2), np.uint8))
+    assert gray is not raw and np.array_equal(gray, raw)
@@ -0,0 +1,57 @@
+import numpy as np
+from pointer_filter import PointerFilter
+
+
+def _track(pointer_filter, duration=1.0, fps=30.0, speed=10.0):
+    times = np.arange(0.0, duration, 1.0 / fps)
+    for t in times:
+        pointer_filter.update([speed * t, 5.0, 0.0], t)
+    return times[-1]
+
+
+# On a pointer moving at constant speed the prediction leads the last measurement by the velocity
+def test_predict_constant_velocity():
+    pointer_filter = PointerFilter()
+    last = _track(pointer_filter)
+    predicted = pointer_filter.predict(last + pointer_filter.lead_time)
+    assert predicted.shape == (3, 1)
+    assert np.allclose(predicted.ravel(), [10.0 * (last + pointer_filter.lead_time), 5.0, 0.0], atol=0.05)
+
+
+# Missed detections are bridged by extrapolation for max_dropout seconds, then the filter stops tracking
+def test_dropout():
+    pointer_filter = PointerFilter(max_dropout=0.25, lead_time=0.08)
+    last = _track(pointer_filter)
+    assert pointer_filter.update(None, last + 0.1)
+    assert pointer_filter.predict(last + 0.1 + pointer_filter.lead_time) is not None
+    assert pointer_filter.predict(last + 0.34) is None
+    assert not pointer_filter.update(None, last + 0.3)
+    assert pointer_filter.predict(last + 0.3) is None
+    assert pointer_filter.confidence(last + 0.3) == 0.0
+
+
+# The confidence decays with the time since the last measurement
+def test_confidence_decays():
+    pointer_filter = PointerFilter(max_dropout=0.25, lead_time=0.08)
+    last = _track(pointer_filter)
+    confidences = [pointer_filter.confidence(last + dt) for dt in [0.0, 0.08, 0.15, 0.25, 0.34, 0.4]]
+    assert confidences[0] == 1.0
+    assert all(a > b for a, b in zip(confidences[:-2], confidences[1:-1]))
+    assert confidences[-2:] == [0.0, 0.0]
+
+
+# A measurement far from the prediction restarts the filter there, at rest
+def test_gate_restarts():
+    pointer_filter = PointerFilter(gate_cm=3.0)
+    last = _track(pointer_filter)
+    assert pointer_filter.update([0.0, 20.0, 0.0], last + 1.0 / 30)
+    assert np.allclose(pointer_filter.predict(last + 0.1).ravel(), [0.0, 20.0, 0.0])
+
+
+# Copies share the settings but not the state
+def test_copy():
+    pointer_filter = PointerFilter(lead_time=0.05)
+    _track(pointer_filter)
+    other = pointer_filter.copy()
+    assert not other.is_tracking() and other.lead_time == 0.05
+    assert pointer_filter.is_tracking()
@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+import numpy as np
+from trace_recorder import TraceRecorder, load_trace
+
+
+def _record(path, frames, capacity=4, pointers=0):
+    recorder = TraceRecorder(str(path), capacity=capacity)
+    recorder.start()
+    for frame in range(frames):
+        tips = {marker_id: SimpleNamespace(point_of_interest=None, tip=None, tip_confidence=0.0, zone=frame)
+                for marker_id in range(pointers)}
+        recorder.record(SimpleNamespace(timestamp=float(frame), rvec=None, tvec=None, pointers=tips))
+    recorder.close()
+
+
+def test_before_wrap(tmp_path):
+    _record(tmp_path / 'trace', 3)
+    records, header = load_trace(tmp_path / 'trace')
+    assert header['count'] == 3
+    assert records['frame'].tolist() == [0, 1, 2] and records['marker_id'].tolist() == [-1, -1, -1]
+
+
+# Once the ring wraps around the newest records overwrite the oldest, and the oldest slot left is skipped
+def test_wrap_around(tmp_path):
+    _record(tmp_path / 'trace', 6)
+    records, header = load_trace(tmp_path / 'trace')
+    assert header['count'] == 6
+    assert records['frame'].tolist() == [3, 4, 5]
+    assert records['timestamp'].tolist() == [3.0, 4.0, 5.0]
+
+
+# Frames with several pointers take one record each, possibly across the end of the ring
+def test_wrap_around_pointers(tmp_path):
+    _record(tmp_path / 'trace', 3, capacity=5, pointers=2)
+    records, header = load_trace(tmp_path / 'trace')
+    assert header['count'] == 6
+    assert records['frame'].tolist() == [1, 1, 2, 2]
+    assert records['marker_id'].tolist() == [0, 1, 0, 1]
+    assert np.isnan(records['tip']).all()
+
+
+# A trace is continued where it stopped
+def test_continue(tmp_path):
+    _record(tmp_path / 'trace', 3)
+    _record(tmp_path / 'trace', 2)
+    records, header = load_trace(tmp_path / 'trace')
+    assert header['count'] == 5
+    assert records['frame'].tolist() == [2, 3, 4]
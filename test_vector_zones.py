@@ -0,0 +1,28 @@
+import numpy as np
+from vector_zones import VectorZoneMap
+
+
+# A map without zones (e.g. a package whose SVG has no zone shapes yet) resolves every point to 0
+def test_empty_zone_map():
+    zone_map = VectorZoneMap({})
+    points = np.array([[0.0, 0.0], [0.5, 0.5], [-3.0, 12.0]])
+    with np.errstate(all='raise'):
+        assert zone_map.zones_at(points).tolist() == [0, 0, 0]
+        zones, margins = zone_map.lookup(points)
+        assert zones.tolist() == [0, 0, 0]
+        assert zone_map.zone_at([0.5, 0.5, 0.0]) == 0
+
+
+def test_square_zone():
+    zone_map = VectorZoneMap({7: [[[0, 0], [4, 0], [4, 4], [0, 4]]]}, max_gap_cm=0.0)
+    assert zone_map.zones_at(np.array([[2.0, 2.0], [6.0, 2.0]])).tolist() == [7, 0]
+
+
+# The index grows with the outline of the zones, not with their area: a square 100 times larger uses about 100 times,
+# not 10000 times, more index memory
+def test_index_memory_follows_outline():
+    small = VectorZoneMap({1: [[[0, 0], [4, 0], [4, 4], [0, 4]]]})
+    large = VectorZoneMap({1: [[[0, 0], [400, 0], [400, 400], [0, 400]]]})
+    assert large.nbytes < 200 * small.nbytes
+    points = np.array([[200.0, 200.0], [1.0, 399.0], [401.0, 200.0]])
+    assert large.zones_at(points).tolist() == [1, 1, 0]
@@ -0,0 +1,58 @@
+import random
+from collections import Counter
+from zone_resolver import ZoneResolver
+
+
+def _resolver(**kwargs):
+    return ZoneResolver(None, 1.0, zone_map=object(), **kwargs)
+
+
+def _feed(resolver, zones):
+    return [resolver.update_zone(zone) for zone in zones]
+
+
+# A zone replaces the current one as soon as it is the mode of the window
+def test_mode():
+    assert _feed(_resolver(filter_size=5), [3, 3, 3, 3]) == [0, 0, 3, 3]
+
+
+# With dwell_frames the new zone has to stay the mode for that many frames
+def test_dwell_frames():
+    assert _feed(_resolver(filter_size=5, dwell_frames=2), [3, 3, 3, 3]) == [0, 0, 0, 3]
+    # A different mode restarts the dwell count
+    assert _feed(_resolver(filter_size=2, dwell_frames=2), [4, 4, 3, 3]) == [0, 0, 0, 3]
+
+
+# A mode with fewer than min_votes votes doesn't replace the current zone
+def test_min_votes():
+    assert _feed(_resolver(filter_size=4), [1, 2, 3, 4]) == [0, 0, 0, 1]
+    assert _feed(_resolver(filter_size=4, min_votes=2), [1, 2, 3, 4]) == [0, 0, 0, 0]
+
+
+# Ties keep the current zone
+def test_ties_keep_zone():
+    resolver = _resolver(filter_size=4)
+    assert _feed(resolver, [5, 5, 5, 7, 7]) == [0, 0, 5, 5, 5]
+    assert _feed(resolver, [7]) == [7]
+
+
+# The vote counts and buckets always match the counts of the window
+def test_buckets_match_window():
+    rng = random.Random(1)
+    resolver = _resolver(filter_size=7, min_votes=2, dwell_frames=2)
+    for _ in range(2000):
+        resolver.update_zone(rng.choice([0, 1, 2, 3, 3, 3]))
+        counts = Counter(resolver.history)
+        assert resolver.max_count == max(counts.values())
+        assert resolver.buckets[resolver.max_count] == {zone for zone, count in counts.items()
+                                                        if count == resolver.max_count}
+        assert {zone: count for zone, count in resolver.counts.items() if count} == counts
+
+
+# Copies share the settings but not the filter state
+def test_copy():
+    resolver = _resolver(filter_size=3)
+    _feed(resolver, [2, 2])
+    other = resolver.copy()
+    assert other.zone == 0 and other.history == [0, 0, 0] and other.filter_size == 3
+    assert resolver.zone == 2
@@ -0,0 +1,251 @@
+import argparse
+import queue
+import threading
+import time
+import numpy as np
+
+# Trace file layout: a header page, then a ring of fixed-size records. count is the number of records ever written,
+# record i is stored in slot i % capacity, so the file never grows and the newest records overwrite the oldest.
+MAGIC = b'CAMIOTRC'
+VERSION = 1
+PAGE_SIZE = 4096
+HEADER = np.dtype([('magic', 'S8'), ('version', '<u4'), ('record_size', '<u4'), ('capacity', '<u8'),
+                   ('count', '<u8'), ('wall_offset', '<f8')])  # wall_offset: time.time() - time.monotonic()
+
+# One record per tracked pointer and frame, or one with marker_id -1 for a frame without pointers.
+# rvec/tvec are the board pose, point the measured tip and tip the filtered one (map coordinates, cm); missing
+# values are NaN.
+RECORD = np.dtype([('timestamp', '<f8'), ('frame', '<u4'), ('zone', '<i4'), ('marker_id', '<i2'),
+                   ('flags', '<u2'), ('rvec', '<f4', 3), ('tvec', '<f4', 3), ('point', '<f4', 3),
+                   ('tip', '<f4', 3), ('confidence', '<f4')])
+BOARD_FOUND = 1
+POINTER_DETECTED = 2
+
+
+def _vector(value):
+    return np.full(3, np.nan, dtype=np.float32) if value is None else np.ravel(value)[:3]
+
+
+# Appends frame results to a trace file from a writer thread. record() only queues a few references, so the frame
+# loop never waits for the disk; if the writer falls behind by more than max_pending frames, frames are dropped and
+# counted. An existing trace with the same capacity is continued. The file is flushed every flush_interval seconds.
+class TraceRecorder:
+    def __init__(self, path, capacity=1 << 20, max_pending=1024, flush_interval=5.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.header, self.records = _open_ring(path, capacity)
+        self.capacity = capacity
+        self.pending = queue.Queue(max_pending)
+        self.dropped = 0
+        count = int(self.header['count'][0])
+        self.frame = int(self.records[(count - 1) % capacity]['frame']) + 1 if count else 0
+        self.thread = threading.Thread(target=self._run, name="TraceRecorder", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    # Queues a FrameResult for writing
+    def record(self, result):
+        pointers = [(marker_id, pointer.point_of_interest, pointer.tip, pointer.tip_confidence, pointer.zone)
+                    for marker_id, pointer in result.pointers.items()]
+        try:
+            self.pending.put_nowait((result.timestamp, result.rvec, result.tvec, pointers))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join(timeout=5.0)
+        self.records.flush()
+        self.header.flush()
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self.pending.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                return
+            if item:
+                self._write(*item)
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self.records.flush()
+                self.header.flush()
+                last_flush = time.monotonic()
+
+    def _write(self, timestamp, rvec, tvec, pointers):
+        count = int(self.header['count'][0])
+        flags = BOARD_FOUND if rvec is not None else 0
+        rvec = _vector(rvec)
+        tvec = _vector(tvec)
+        for i, (marker_id, point, tip, confidence, zone) in enumerate(pointers or [(-1, None, None, 0.0, 0)]):
+            self.records[(count + i) % self.capacity] = (
+                timestamp, self.frame, zone, marker_id, flags | (POINTER_DETECTED if point is not None else 0),
+                rvec, tvec, _vector(point), _vector(tip), confidence)
+        # The count is only advanced once the records are complete, so a reader never sees a partial record
+        self.header['count'] = count + max(len(pointers), 1)
+        self.frame += 1
+
+
+def _open_ring(path, capacity):
+    try:
+        header = np.memmap(path, dtype=HEADER, mode='r+', shape=(1,))
+        if header['magic'][0] != MAGIC or header['version'][0] != VERSION or \
+                header['record_size'][0] != RECORD.itemsize or header['capacity'][0] != capacity:
+            raise ValueError(f"{path} is not a trace with capacity {capacity}")
+    except FileNotFoundError:
+        # Preallocate the whole ring, so that writing never extends the file
+        with open(path, 'wb') as f:
+            f.truncate(PAGE_SIZE + capacity * RECORD.itemsize)
+        header = np.memmap(path, dtype=HEADER, mode='r+', shape=(1,))
+        header[0] = (MAGIC, VERSION, RECORD.itemsize, capacity, 0, time.time() - time.monotonic())
+    records = np.memmap(path, dtype=RECORD, mode='r+', offset=PAGE_SIZE, shape=(capacity,))
+    return header, records
+
+
+# Loads a trace as a record array in the order the records were written, and the header
+def load_trace(path):
+    header = np.fromfile(path, dtype=HEADER, count=1)[0]
+    if header['magic'] != MAGIC or header['version'] != VERSION or header['record_size'] != RECORD.itemsize:
+        raise ValueError(f"{path} is not a trace file of version {VERSION}")
+    capacity = int(header['capacity'])
+    count = int(header['count'])
+    ring = np.memmap(path, dtype=RECORD, mode='r', offset=PAGE_SIZE, shape=(capacity,))
+    if count <= capacity:
+        return np.array(ring[:count]), header
+    # The oldest slot may be overwritten while the trace is being recorded, so it is skipped
+    start = count % capacity
+    return np.concatenate([ring[start + 1:], ring[:start]]), header
+
+
+# Time spent by the pointers in each zone: zone -> (visits, seconds). A visit ends when the pointer moves to another
+# zone or is lost; records more than max_gap seconds apart are not counted as dwelling.
+def dwell_times(records, max_gap=0.5):
+    dwell = {}
+    for marker_id in np.unique(records['marker_id']):
+        if marker_id < 0:
+            continue
+        pointer = records[records['marker_id'] == marker_id]
+        durations = np.diff(pointer['timestamp'])
+        durations[durations > max_gap] = 0.0
+        zones = pointer['zone'][:-1]
+        starts = np.concatenate([[True], (zones[1:] != zones[:-1]) | (durations[:-1] == 0.0)])
+        for zone in np.unique(zones):
+            if zone == 0:
+                continue
+            in_zone = zones == zone
+            visits, seconds = dwell.get(int(zone), (0, 0.0))
+            dwell[int(zone)] = (visits + int(np.count_nonzero(starts & in_zone)),
+                                seconds + float(durations[in_zone].sum()))
+    return dwell
+
+
+# 2D histogram of the filtered tips on the map, cell_cm wide, as an array of counts indexed [y, x]
+def heatmap(records, size_cm, cell_cm=0.5):
+    tips = records['tip'][~np.isnan(records['tip'][:, 0])]
+    width, height = size_cm
+    counts, _, _ = np.histogram2d(tips[:, 1], tips[:, 0], bins=(int(np.ceil(height / cell_cm)),
+                                                                int(np.ceil(width / cell_cm))),
+                                  range=((0, height), (0, width)))
+    return counts
+
+
+# Shares of frames without the board and of pointer records bridged by the filter (tracked but not detected)
+def missed_detections(records):
+    frames = np.unique(records['frame'], return_index=True)[1]
+    board_missed = np.count_nonzero(records['flags'][frames] & BOARD_FOUND == 0)
+    pointers = records[records['marker_id'] >= 0]
+    pointer_missed = np.count_nonzero(pointers['flags'] & POINTER_DETECTED == 0)
+    return {'frames': len(frames),
+            'board_missed': board_missed / max(len(frames), 1),
+            'pointer_records': len(pointers),
+            'pointer_missed': pointer_missed / max(len(pointers), 1)}
+
+
+# Runs the recorded tip measurements through the pointer filter and zone resolver again, as FrameProcessor does
+# for each pointer, and returns the zone of each record. Comparing them to the recorded zones checks changes to the
+# filters against real interactions.
+def replay_zones(records, zone_resolver, pointer_filter=None, pointer_timeout=1.0):
+    zones = np.zeros(len(records), dtype=np.int32)
+    resolvers = {}
+    filters = {}
+    last_seen = {}
+    for i, record in enumerate(records):
+        marker_id = int(record['marker_id'])
+        if marker_id < 0 or not record['flags'] & BOARD_FOUND:
+            continue
+        if marker_id in last_seen and record['timestamp'] - last_seen[marker_id] > pointer_timeout:
+            del resolvers[marker_id]
+        if record['flags'] & POINTER_DETECTED:
+            last_seen[marker_id] = record['timestamp']
+        if marker_id not in resolvers:
+            resolvers[marker_id] = zone_resolver.copy()
+            filters[marker_id] = pointer_filter.copy() if pointer_filter is not None else None
+        point = None if np.isnan(record['point'][0]) else record['point'].astype(np.float64).reshape(3, 1)
+        if filters[marker_id] is None:
+            tip = point
+        else:
+            filters[marker_id].update(point, record['timestamp'])
+            tip = filters[marker_id].predict(record['timestamp'] + filters[marker_id].lead_time)
+        zones[i] = resolvers[marker_id].update(tip)
+    return zones
+
+
+if __name__ == '__main__':
+    import cv2 as cv
+    import map_parameters
+
+    parser = argparse.ArgumentParser(description='Analyzes CamIO interaction traces.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    info = subparsers.add_parser('info', help='Print a summary of a trace.')
+    info.add_argument('trace', help='Path of the trace.')
+    dwell = subparsers.add_parser('dwell', help='Print the time spent in each zone.')
+    dwell.add_argument('trace', help='Path of the trace.')
+    dwell.add_argument('--map', help='Zone names from map_parameters.py.', choices=['default', 'ukraine'],
+                       default='ukraine')
+    heat = subparsers.add_parser('heatmap', help='Save a heatmap of the pointer tips over the zone image.')
+    heat.add_argument('trace', help='Path of the trace.')
+    heat.add_argument('output', help='Image to write.')
+    heat.add_argument('--input1', help='Path to input zone image.', default='zone_map.png')
+    heat.add_argument('--pixels-per-cm', help='Resolution of the zone image.', type=float, default=118.49)
+    heat.add_argument('--cell-cm', help='Size of the heatmap cells.', type=float, default=0.5)
+    replay = subparsers.add_parser('replay', help='Replay the tips through the zone filters and compare the zones.')
+    replay.add_argument('trace', help='Path of the trace.')
+    replay.add_argument('--input1', help='Path to input zone image.', default='zone_map.png')
+    replay.add_argument('--pixels-per-cm', help='Resolution of the zone image.', type=float, default=118.49)
+    replay.add_argument('--no-pointer-filter', help='Replay without the pointer filter.', action='store_true')
+    args = parser.parse_args()
+
+    records, header = load_trace(args.trace)
+    if args.command == 'info':
+        duration = records['timestamp'][-1] - records['timestamp'][0] if len(records) else 0.0
+        start = time.localtime(records['timestamp'][0] + header['wall_offset']) if len(records) else None
+        print(f"records: {len(records)} of {header['capacity']} ({header['count']} written)")
+        print(f"start: {time.strftime('%Y-%m-%d %H:%M:%S', start) if start else '-'}  duration: {duration:.1f} s")
+        print(f"pointers: {sorted(int(i) for i in np.unique(records['marker_id']) if i >= 0)}")
+        print(missed_detections(records))
+    elif args.command == 'dwell':
+        names = map_parameters.map_dict_ukraine if args.map == 'ukraine' else map_parameters.map_dict
+        print(f"{'zone':40}{'visits':>8}{'seconds':>10}")
+        for zone, (visits, seconds) in sorted(dwell_times(records).items(), key=lambda item: -item[1][1]):
+            print(f"{names.get(zone, str(zone)):40}{visits:8d}{seconds:10.1f}")
+    elif args.command == 'heatmap':
+        img_map = cv.imread(args.input1)
+        size_cm = (img_map.shape[1] / args.pixels_per_cm, img_map.shape[0] / args.pixels_per_cm)
+        counts = heatmap(records, size_cm, args.cell_cm)
+        heat = np.uint8(255 * np.sqrt(counts / max(counts.max(), 1)))
+        heat = cv.resize(cv.applyColorMap(heat, cv.COLORMAP_JET), (img_map.shape[1], img_map.shape[0]),
+                         interpolation=cv.INTER_NEAREST)
+        cv.imwrite(args.output, cv.addWeighted(img_map, 0.5, heat, 0.5, 0))
+    else:
+        from zone_resolver import ZoneResolver
+        from pointer_filter import PointerFilter
+        img_map = cv.imread(args.input1, cv.IMREAD_GRAYSCALE)
+        zone_resolver = ZoneResolver(img_map, args.pixels_per_cm, map_parameters.map_dict_ukraine.keys(),
+                                     10 if args.no_pointer_filter else 3)
+        zones = replay_zones(records, zone_resolver, None if args.no_pointer_filter else PointerFilter())
+        pointers = records['marker_id'] >= 0
+        same = np.count_nonzero(zones[pointers] == records['zone'][pointers])
+        print(f"{same} of {np.count_nonzero(pointers)} pointer records resolve to the recorded zone")
@@ -0,0 +1,381 @@
+import json
+import re
+import xml.etree.ElementTree as ET
+import cv2 as cv
+import numpy as np
+
+
+# Even-odd test of points (N x 2) against the edges (M x 4: x0, y0, x1, y1) of a set of closed rings
+def points_in_rings(points, edges):
+    inside = np.zeros(len(points), dtype=bool)
+    x0, y0, x1, y1 = edges.T
+    chunk = max(1, 1000000 // max(len(edges), 1))
+    for start in range(0, len(points), chunk):
+        px = points[start:start + chunk, 0, None]
+        py = points[start:start + chunk, 1, None]
+        crosses = (y0 > py) != (y1 > py)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+        inside[start:start + chunk] = np.count_nonzero(crosses & (px < x_cross), axis=1) % 2 == 1
+    return inside
+
+
+# Distance from points (N x 2) to segments (N x 4), pairwise
+def point_segment_distance(points, segments):
+    a = segments[:, :2]
+    d = segments[:, 2:] - a
+    length2 = np.maximum(np.sum(d * d, axis=1), 1e-24)
+    t = np.clip(np.sum((points - a) * d, axis=1) / length2, 0.0, 1.0)
+    return np.linalg.norm(points - (a + t[:, None] * d), axis=1)
+
+
+# Indices of the concatenation of the ranges [starts[i], starts[i] + counts[i])
+def _ranges(starts, counts):
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + np.arange(int(np.sum(counts))) - offsets
+
+
+def _ring_area(ring):
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+
+# Zones defined as polygons in map coordinates (cm, x to the right and y down as on the printed map), looked up
+# through a uniform grid of cell_size cm. Each zone is a list of rings (K x 2 arrays); rings are combined with the
+# even-odd rule, so holes are just more rings. Zone ids are arbitrary integers and zones may be nested: a point gets
+# the innermost (smallest) zone containing it, and zone_chain_at() returns all of them.
+#
+# The index keeps the edges that cross each cell and the zones containing the cell centers. A point is inside a zone if
+# the cell center is, flipped by each edge of the zone crossed by the segment from the center to the point, so a
+# lookup only looks at the edges of one cell. Only the cells crossed by edges are stored, as sorted cell numbers
+# searched with np.searchsorted, and the centers only of those and of the first cell of each run without edges in a
+# row: no edge crosses the run, so all its centers are in the same zones. Memory thus depends on the length of the
+# zone outlines in cells, not on the map area, nor on raster pixels. Points closer than max_gap_cm to a zone but
+# outside of all zones resolve to the nearest zone, as with nearest_zone_map.
+class VectorZoneMap:
+    def __init__(self, zones, cell_size=0.5, max_gap_cm=0.2, names=None, sounds=None):
+        self.cell_size = cell_size
+        self.max_gap_cm = max_gap_cm
+        self.names = names or {}
+        self.sounds = sounds or {}
+
+        self.ids = np.array(sorted(zones), dtype=np.int64)
+        rings = [[np.asarray(ring, dtype=np.float64).reshape(-1, 2) for ring in zones[zone_id]]
+                 for zone_id in self.ids]
+        # Nesting order: the outer area of each zone
+        self.areas = np.array([max([_ring_area(ring) for ring in zone_rings] + [0.0]) for zone_rings in rings])
+
+        edges = []
+        edge_zone = []
+        for index, zone_rings in enumerate(rings):
+            for ring in zone_rings:
+                if len(ring) < 3:
+                    continue
+                edges.append(np.hstack([ring, np.roll(ring, -1, axis=0)]))
+                edge_zone.append(np.full(len(ring), index))
+        self.edges = np.concatenate(edges) if edges else np.zeros((0, 4))
+        self.edge_zone = np.concatenate(edge_zone) if edge_zone else np.zeros(0, dtype=int)
+
+        # Grid covering all the zones, with one cell of margin for the gap tolerance
+        points = self.edges[:, :2] if len(self.edges) else np.zeros((1, 2))
+        self.origin = points.min(axis=0) - cell_size
+        self.cols, self.rows = (np.ceil((points.max(axis=0) + cell_size - self.origin) / cell_size)).astype(int) + 1
+        self._index_edges()
+        self._index_centers()
+
+    # Zones of an array of points in cm (N x 2 or N x 3), 0 outside of all zones
+    def zones_at(self, points):
+        points, col, row, inside_grid = self._locate(points)
+        zones = self._containing_zones(points, col, row, inside_grid)
+
+        # Gaps between zones resolve to the nearest zone
+        if self.max_gap_cm > 0:
+            background = np.nonzero((zones == 0) & inside_grid)[0]
+            margins, nearest_zone = self._nearest_edges(points[background], col[background], row[background])
+            gap = (margins <= self.max_gap_cm) & (nearest_zone >= 0)
+            zones[background[gap]] = self.ids[nearest_zone[gap]]
+        return zones
+
+    # Returns the zones of an array of points in cm, as zones_at(), and their distance to the nearest zone edge in
+    # cm. Distances beyond cell_size are reported as cell_size.
+    def lookup(self, points):
+        points, col, row, inside_grid = self._locate(points)
+        zones = self._containing_zones(points, col, row, inside_grid)
+        margins = np.full(len(points), self.cell_size)
+        nearest_zone = np.full(len(points), -1)
+        valid = np.nonzero(inside_grid)[0]
+        margins[valid], nearest_zone[valid] = self._nearest_edges(points[valid], col[valid], row[valid])
+
+        gap = (zones == 0) & (margins <= self.max_gap_cm) & (nearest_zone >= 0)
+        zones[gap] = self.ids[nearest_zone[gap]]
+        return zones, margins
+
+    # Zone of the point of interest on the map
+    def zone_at(self, point_of_interest):
+        return int(self.zones_at(np.reshape(point_of_interest, (1, -1)))[0])
+
+    # All the zones containing a point, from the outermost to the innermost
+    def zone_chain_at(self, point_of_interest):
+        point = np.asarray(point_of_interest, dtype=np.float64).ravel()[:2].reshape(1, 2)
+        chain = []
+        for index in np.argsort(-self.areas):
+            if points_in_rings(point, self.edges[self.edge_zone == index])[0]:
+                chain.append(int(self.ids[index]))
+        return chain
+
+    # Size of the geometry and of the index in bytes
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in [self.edges, self.edge_zone, self.edge_cells, self.edge_start, self.cell_edges,
+                                      self.center_cells, self.center_start, self.center_zones])
+
+    def _locate(self, points):
+        points = np.asarray(points, dtype=np.float64).reshape(len(points), -1)[:, :2]
+        return (points,) + self._cells(points)
+
+    # Innermost zone containing each point, 0 if none
+    def _containing_zones(self, points, col, row, inside_grid):
+        n_zones = len(self.ids)
+        if n_zones == 0:
+            return np.zeros(len(points), dtype=np.int64)
+        cell = row * self.cols + col
+
+        # Zones containing the cell centers
+        valid = np.nonzero(inside_grid)[0]
+        starts, counts = self._center_ranges(cell[valid])
+        center_point = np.repeat(valid, counts)
+        center_zone = self.center_zones[_ranges(starts, counts)]
+
+        # Edges crossed by the segments from the cell centers to the points
+        starts, counts = self._edge_ranges(cell[valid])
+        pair_point = np.repeat(valid, counts)
+        pair_edge = self.cell_edges[_ranges(starts, counts)]
+        p = points[pair_point]
+        c = self._centers(col[pair_point], row[pair_point])
+        e0 = self.edges[pair_edge, :2]
+        e1 = self.edges[pair_edge, 2:]
+        crossed = ((_cross(e1 - e0, c - e0) > 0) != (_cross(e1 - e0, p - e0) > 0)) & \
+                  ((_cross(p - c, e0 - c) > 0) != (_cross(p - c, e1 - c) > 0))
+
+        # A point is inside a zone if the number of center containments and crossings is odd
+        keys = np.concatenate([center_point * n_zones + center_zone,
+                               pair_point[crossed] * n_zones + self.edge_zone[pair_edge[crossed]]])
+        keys, key_counts = np.unique(keys, return_counts=True)
+        keys = keys[key_counts % 2 == 1]
+        inside_point, inside_zone = keys // n_zones, keys % n_zones
+
+        # Innermost zone of each point
+        zones = np.zeros(len(points), dtype=np.int64)
+        order = np.lexsort((self.areas[inside_zone], inside_point))
+        first = np.unique(inside_point[order], return_index=True)[1]
+        zones[inside_point[order][first]] = self.ids[inside_zone[order][first]]
+        return zones
+
+    # Distance to the nearest edge among the 3 x 3 cells around each point, exact up to cell_size, and the index of
+    # its zone (-1 if there is none that close)
+    def _nearest_edges(self, points, col, row):
+        margins = np.full(len(points), self.cell_size)
+        nearest_zone = np.full(len(points), -1)
+        c2 = (col[:, None] + np.array([-1, 0, 1] * 3)).ravel()
+        r2 = (row[:, None] + np.repeat([-1, 0, 1], 3)).ravel()
+        point = np.repeat(np.arange(len(points)), 9)
+        ok = (0 <= c2) & (c2 < self.cols) & (0 <= r2) & (r2 < self.rows)
+        starts, counts = self._edge_ranges(r2[ok] * self.cols + c2[ok])
+        neighbour_point = np.repeat(point[ok], counts)
+        neighbour_edge = self.cell_edges[_ranges(starts, counts)]
+        if len(neighbour_point) > 0:
+            distances = point_segment_distance(points[neighbour_point], self.edges[neighbour_edge])
+            order = np.lexsort((distances, neighbour_point))
+            first = np.unique(neighbour_point[order], return_index=True)[1]
+            nearest = order[first]
+            near_point = neighbour_point[nearest]
+            margins[near_point] = np.minimum(distances[nearest], self.cell_size)
+            nearest_zone[near_point] = self.edge_zone[neighbour_edge[nearest]]
+        return margins, nearest_zone
+
+    def _cells(self, points):
+        col = np.floor((points[:, 0] - self.origin[0]) / self.cell_size).astype(int)
+        row = np.floor((points[:, 1] - self.origin[1]) / self.cell_size).astype(int)
+        inside = (0 <= col) & (col < self.cols) & (0 <= row) & (row < self.rows)
+        return np.clip(col, 0, self.cols - 1), np.clip(row, 0, self.rows - 1), inside
+
+    def _centers(self, col, row):
+        return self.origin + (np.stack([col, row], axis=-1) + 0.5) * self.cell_size
+
+    # Ranges of cell_edges holding the edges of each cell, empty for the cells no edge crosses
+    def _edge_ranges(self, cells):
+        slot = np.minimum(np.searchsorted(self.edge_cells, cells), len(self.edge_cells) - 1)
+        found = (slot >= 0) & (self.edge_cells[slot] == cells) if len(self.edge_cells) else np.zeros(len(cells), bool)
+        starts = np.where(found, self.edge_start[slot], 0)
+        return starts, np.where(found, self.edge_start[slot + 1] - starts, 0)
+
+    # Ranges of center_zones holding the zones containing the center of each cell: those stored for the cell, or for
+    # the cell starting its run in the row
+    def _center_ranges(self, cells):
+        slot = np.searchsorted(self.center_cells, cells, side='right') - 1
+        found = slot >= 0
+        found[found] = self.center_cells[slot[found]] // self.cols == cells[found] // self.cols
+        starts = np.where(found, self.center_start[np.maximum(slot, 0)], 0)
+        return starts, np.where(found, self.center_start[slot + 1] - starts, 0)
+
+    # Cells crossed by each edge: the edges are cut in pieces shorter than half a cell, and each piece can only touch
+    # the 2 x 2 cells around its bounding box
+    def _index_edges(self):
+        lengths = np.linalg.norm(self.edges[:, 2:] - self.edges[:, :2], axis=1)
+        pieces = np.ceil(lengths / (0.5 * self.cell_size)).astype(int) + 1
+        edge = np.repeat(np.arange(len(self.edges)), pieces)
+        t0 = (np.arange(len(edge)) - np.repeat(np.cumsum(pieces) - pieces, pieces)) / np.repeat(pieces, pieces)
+        t1 = t0 + 1.0 / np.repeat(pieces, pieces)
+        a = self.edges[edge, :2] + t0[:, None] * (self.edges[edge, 2:] - self.edges[edge, :2])
+        b = self.edges[edge, :2] + t1[:, None] * (self.edges[edge, 2:] - self.edges[edge, :2])
+        ca, ra, _ = self._cells(a)
+        cb, rb, _ = self._cells(b)
+        cells = np.concatenate([ra * self.cols + ca, ra * self.cols + cb, rb * self.cols + ca, rb * self.cols + cb])
+        pairs = np.unique(np.stack([cells, np.tile(edge, 4)], axis=1), axis=0).reshape(-1, 2)
+        self.cell_edges = pairs[:, 1]
+        self.edge_cells, self.edge_start = np.unique(pairs[:, 0], return_index=True)
+        self.edge_start = np.append(self.edge_start, len(pairs))
+
+    # Zones containing the centers of the cells crossed by edges and of the cells after them in their row (the first
+    # cells of the runs without edges; runs at the start of a row are in the empty margin of the grid), tested among
+    # those within the bounding box of each zone
+    def _index_centers(self):
+        after = self.edge_cells + 1
+        after = after[(after % self.cols != 0) & ~np.isin(after, self.edge_cells)]
+        self.center_cells = np.union1d(self.edge_cells, after)
+        col, row = self.center_cells % self.cols, self.center_cells // self.cols
+        slots = []
+        zones = []
+        for index in range(len(self.ids)):
+            edges = self.edges[self.edge_zone == index]
+            if len(edges) == 0:
+                continue
+            points = np.concatenate([edges[:, :2], edges[:, 2:]])
+            c0, r0, _ = self._cells(points.min(axis=0, keepdims=True))
+            c1, r1, _ = self._cells(points.max(axis=0, keepdims=True))
+            candidates = np.nonzero((c0[0] <= col) & (col <= c1[0]) & (r0[0] <= row) & (row <= r1[0]))[0]
+            inside = candidates[points_in_rings(self._centers(col[candidates], row[candidates]), edges)]
+            slots.append(inside)
+            zones.append(np.full(len(inside), index))
+        slots = np.concatenate(slots) if slots else np.zeros(0, dtype=int)
+        zones = np.concatenate(zones) if zones else np.zeros(0, dtype=int)
+        order = np.argsort(slots, kind='stable')
+        self.center_zones = zones[order]
+        self.center_start = np.searchsorted(slots[order], np.arange(len(self.center_cells) + 1))
+
+    # Zones from a GeoJSON FeatureCollection of Polygon and MultiPolygon features in map coordinates, units_per_cm
+    # units per cm. The zone id is the "zone" (or "id") property, and "name" and "sound" give its name and sound file.
+    @classmethod
+    def from_geojson(cls, path, units_per_cm=1.0, **kwargs):
+        with open(path) as f:
+            collection = json.load(f)
+        zones, names, sounds = {}, {}, {}
+        for feature in collection['features']:
+            properties = feature.get('properties') or {}
+            zone_id = int(properties.get('zone', properties.get('id', feature.get('id'))))
+            geometry = feature['geometry']
+            polygons = [geometry['coordinates']] if geometry['type'] == 'Polygon' else geometry['coordinates']
+            for polygon in polygons:
+                zones.setdefault(zone_id, []).extend(np.array(ring)[:, :2] / units_per_cm for ring in polygon)
+            if 'name' in properties:
+                names[zone_id] = properties['name']
+            if 'sound' in properties:
+                sounds[zone_id] = properties['sound']
+        return cls(zones, names=names, sounds=sounds, **kwargs)
+
+    # Zones from the <polygon>, <rect> and <path> elements of an SVG file drawn at pixels_per_cm. The zone id comes
+    # from a data-zone attribute or from an id such as "zone-12", and data-name gives its name. Paths may only use
+    # straight segments (M, L, H, V, Z) and transforms are not applied.
+    @classmethod
+    def from_svg(cls, path, pixels_per_cm, **kwargs):
+        zones, names = {}, {}
+        for element in ET.parse(path).iter():
+            tag = element.tag.rsplit('}', 1)[-1]
+            zone_id = element.get('data-zone')
+            if zone_id is None:
+                match = re.fullmatch(r'zone[-_]?(\d+)', element.get('id', ''))
+                zone_id = match.group(1) if match else None
+            if zone_id is None or tag not in ('polygon', 'rect', 'path'):
+                continue
+            if tag == 'polygon':
+                values = [float(v) for v in re.findall(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?',
+                                                       element.get('points'))]
+                rings = [np.array(values).reshape(-1, 2)]
+            elif tag == 'rect':
+                x, y = float(element.get('x', 0)), float(element.get('y', 0))
+                w, h = float(element.get('width')), float(element.get('height'))
+                rings = [np.array([[x, y], [x + w, y], [x + w, y + h], [x, y + h]])]
+            else:
+                rings = _svg_path_rings(element.get('d'))
+            zones.setdefault(int(zone_id), []).extend(ring / pixels_per_cm for ring in rings)
+            if element.get('data-name'):
+                names[int(zone_id)] = element.get('data-name')
+        return cls(zones, names=names, **kwargs)
+
+    # Zones traced from a zone raster such as zone_map.png, simplified to within tolerance_px pixels. Pixels whose
+    # value is not in zone_ids (or is 0 if zone_ids is None) are background.
+    @classmethod
+    def from_zone_map(cls, img_map, pixels_per_cm, zone_ids=None, tolerance_px=1.0, **kwargs):
+        if zone_ids is None:
+            zone_ids = [z for z in np.unique(img_map) if z != 0]
+        zones = {}
+        for zone_id in zone_ids:
+            mask = (img_map == zone_id).astype(np.uint8)
+            contours, _ = cv.findContours(mask, cv.RETR_CCOMP, cv.CHAIN_APPROX_SIMPLE)
+            contours = [cv.approxPolyDP(contour, tolerance_px, True) for contour in contours]
+            rings = [(contour.reshape(-1, 2) + 0.5) / pixels_per_cm for contour in contours if len(contour) >= 3]
+            if rings:
+                zones[int(zone_id)] = rings
+        return cls(zones, **kwargs)
+
+
+def _cross(a, b):
+    return a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]
+
+
+# Rings of an SVG path made of straight segments
+def _svg_path_rings(d):
+    rings = []
+    ring = []
+    position = np.zeros(2)
+    start = np.zeros(2)
+    command = None
+    tokens = re.findall(r'[MmLlHhVvZz]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?', d)
+    i = 0
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            command = tokens[i]
+            i += 1
+            if command in 'Zz':
+                if len(ring) >= 3:
+                    rings.append(np.array(ring))
+                ring = []
+                position = start.copy()
+                continue
+        if command is None or command not in 'MmLlHhVv':
+            raise ValueError(f"Unsupported SVG path command {command}, only straight segments are supported")
+        relative = command.islower()
+        if command in 'Mm':
+            if len(ring) >= 3:
+                rings.append(np.array(ring))
+            point = np.array([float(tokens[i]), float(tokens[i + 1])])
+            position = position + point if relative else point
+            start = position.copy()
+            ring = [position.copy()]
+            i += 2
+            command = 'l' if relative else 'L'  # further pairs are line segments
+            continue
+        if command in 'Hh':
+            position = np.array([position[0] * relative + float(tokens[i]), position[1]])
+            i += 1
+        elif command in 'Vv':
+            position = np.array([position[0], position[1] * relative + float(tokens[i])])
+            i += 1
+        else:
+            point = np.array([float(tokens[i]), float(tokens[i + 1])])
+            position = position + point if relative else point
+            i += 2
+        ring.append(position.copy())
+    if len(ring) >= 3:
+        rings.append(np.array(ring))
+    return rings
@@ -0,0 +1,281 @@
+import asyncio
+import collections
+import concurrent.futures
+import dataclasses
+import json
+import threading
+import traceback
+from dataclasses import dataclass
+import numpy as np
+
+
+# A pointer entering, leaving or hovering over a zone. timestamp is the capture time of the frame.
+@dataclass
+class ZoneEvent:
+    kind: str  # enter, leave, hover
+    marker_id: int
+    zone: int
+    name: str
+    timestamp: float
+    tip: tuple = None  # map coordinates in cm
+    confidence: float = 0.0
+
+    def to_json(self):
+        return json.dumps(dataclasses.asdict(self))
+
+
+# Turns the pointers of each frame into zone events. A pointer touching the map (closer than z_threshold_cm) enters
+# a named zone when it first touches it, leaves it when it touches another zone or the background, and hovers over
+# it at most every hover_interval seconds in between. Lifting the pointer doesn't leave the zone, so putting it down
+# again in the same zone doesn't repeat the zone. A pointer that FrameProcessor stopped tracking leaves its zone.
+class ZoneTracker:
+    def __init__(self, zone_names, z_threshold_cm=2.0, hover_interval=0.25):
+        self.zone_names = zone_names
+        self.z_threshold_cm = z_threshold_cm
+        self.hover_interval = hover_interval
+        self.zones = {}  # marker id -> (zone, time of the last event)
+
+    # Uses the zones of another map. Pointers in a zone of the old map are forgotten without leave events.
+    def set_zones(self, zone_names):
+        self.zone_names = zone_names
+        self.zones = {}
+
+    # Returns the events of a FrameResult
+    def update(self, result):
+        events = []
+        if result.rvec is None:
+            return events  # frames without the board say nothing about the pointers
+        for marker_id in list(self.zones):
+            if marker_id not in result.pointers:
+                zone, _ = self.zones.pop(marker_id)
+                events.append(ZoneEvent('leave', marker_id, zone, self.zone_names.get(zone), result.timestamp))
+
+        for marker_id, pointer in result.pointers.items():
+            if pointer.tip is None or np.abs(pointer.tip[2]) >= self.z_threshold_cm:
+                continue
+            zone = pointer.zone if pointer.zone in self.zone_names else 0
+            previous, last_event = self.zones.get(marker_id, (0, None))
+            tip = tuple(float(v) for v in np.ravel(pointer.tip))
+            if zone != previous:
+                if previous:
+                    events.append(ZoneEvent('leave', marker_id, previous, self.zone_names.get(previous),
+                                            result.timestamp, tip, pointer.tip_confidence))
+                if zone:
+                    events.append(ZoneEvent('enter', marker_id, zone, self.zone_names[zone], result.timestamp, tip,
+                                            pointer.tip_confidence))
+                    self.zones[marker_id] = (zone, result.timestamp)
+                else:
+                    self.zones.pop(marker_id, None)
+            elif zone and result.timestamp - last_event >= self.hover_interval:
+                events.append(ZoneEvent('hover', marker_id, zone, self.zone_names[zone], result.timestamp, tip,
+                                        pointer.tip_confidence))
+                self.zones[marker_id] = (zone, result.timestamp)
+        return events
+
+
+# Bounded event queue of one sink. When it is full, the oldest (or with drop='newest', the new) event is dropped.
+# Events whose kind is in coalesce replace a queued event of the same kind and pointer instead of queuing up, so a
+# slow sink only gets the latest hover position.
+class SinkQueue:
+    def __init__(self, maxsize=64, drop='oldest', coalesce=('hover',)):
+        self.maxsize = maxsize
+        self.drop = drop
+        self.coalesce = coalesce
+        self.items = collections.deque()
+        self.ready = asyncio.Event()
+        self.dropped = 0
+        self.coalesced = 0
+
+    def put(self, event):
+        if event.kind in self.coalesce:
+            for i, queued in enumerate(self.items):
+                if queued.kind == event.kind and queued.marker_id == event.marker_id:
+                    self.items[i] = event
+                    self.coalesced += 1
+                    return
+        if len(self.items) >= self.maxsize:
+            self.dropped += 1
+            if self.drop == 'newest':
+                return
+            self.items.popleft()
+        self.items.append(event)
+        self.ready.set()
+
+    async def get(self):
+        while not self.items:
+            self.ready.clear()
+            await self.ready.wait()
+        return self.items.popleft()
+
+
+# Output of zone events. handle() runs on the event loop of the bus and must not block it: slow work goes to an
+# executor or to non-blocking writes.
+class EventSink:
+    name = 'sink'
+
+    async def start(self):
+        pass
+
+    async def handle(self, event):
+        pass
+
+    async def close(self):
+        pass
+
+
+# Plays the sound of each zone entered, on the audio channel of the pointer, at most once every min_interval seconds
+# per pointer
+class AudioSink(EventSink):
+    name = 'audio'
+
+    def __init__(self, audio_bank, min_interval=0.5, metrics=None):
+        self.audio_bank = audio_bank
+        self.min_interval = min_interval
+        self.metrics = metrics
+        self.last_start = {}  # marker id -> timestamp of the last sound started
+
+    async def handle(self, event):
+        if event.kind != 'enter' or not self.audio_bank.has_sound(event.zone):
+            return
+        if event.timestamp - self.last_start.get(event.marker_id, -self.min_interval) <= self.min_interval:
+            return
+        if self.metrics is not None:
+            with self.metrics.timer('audio_dispatch'):
+                self.audio_bank.play(event.zone, event.marker_id)
+        else:
+            self.audio_bank.play(event.zone, event.marker_id)
+        self.last_start[event.marker_id] = event.timestamp
+
+
+# Prints the zones entered through a RateLimitedLog, on its own thread so a slow console only delays the log. Each
+# pointer and zone pair is limited on its own, so only a pointer flickering in and out of the same zone is quieted.
+class LogSink(EventSink):
+    name = 'log'
+
+    def __init__(self, log):
+        self.log = log
+        self.executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="LogSink")
+
+    async def handle(self, event):
+        if event.kind == 'enter':
+            await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.log.log, f"pointer {event.marker_id}: {event.name}",
+                (event.marker_id, event.zone))
+
+    async def close(self):
+        self.executor.shutdown(wait=False)
+
+
+# Sends every event as a JSON line to the TCP clients connected to host:port, e.g. companion apps. Writes never wait
+# for a client: events for a client with more than max_buffer bytes unsent are dropped.
+class TcpSink(EventSink):
+    name = 'tcp'
+
+    def __init__(self, port, host='127.0.0.1', max_buffer=64 * 1024):
+        self.port = port
+        self.host = host
+        self.max_buffer = max_buffer
+        self.server = None
+        self.writers = set()
+        self.dropped = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._connected, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def handle(self, event):
+        line = (event.to_json() + '\n').encode()
+        for writer in list(self.writers):
+            if writer.is_closing():
+                self.writers.discard(writer)
+            elif writer.transport.get_write_buffer_size() > self.max_buffer:
+                self.dropped += 1
+            else:
+                writer.write(line)
+
+    async def close(self):
+        self.server.close()
+        for writer in self.writers:
+            writer.close()
+
+    async def _connected(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            await reader.read()  # until the client disconnects
+        except ConnectionError:
+            pass
+        self.writers.discard(writer)
+        writer.close()
+
+
+# Delivers zone events to the sinks on an asyncio event loop in its own thread. publish() only schedules the event
+# on the loop, so the tracking loop never waits for a sink; each sink consumes its own bounded SinkQueue, so a slow
+# sink drops or coalesces its own events without delaying the others.
+class EventBus:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name="EventBus", daemon=True)
+        self.sinks = []  # (sink, queue settings)
+        self.queues = {}  # sink -> SinkQueue
+        self.tasks = []
+        self.published = 0
+
+    # Adds a sink with its queue settings (see SinkQueue). Must be called before start().
+    def add_sink(self, sink, maxsize=64, drop='oldest', coalesce=('hover',)):
+        self.sinks.append((sink, (maxsize, drop, coalesce)))
+
+    def start(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+
+    def publish(self, event):
+        self.published += 1
+        self.loop.call_soon_threadsafe(self._dispatch, event)
+
+    def stats(self):
+        stats = {'events_published': self.published}
+        for sink, queue in self.queues.items():
+            stats[f"{sink.name}_dropped"] = queue.dropped + getattr(sink, 'dropped', 0)
+            stats[f"{sink.name}_coalesced"] = queue.coalesced
+        return stats
+
+    # Delivers the queued events for up to timeout seconds, then stops the sinks and the loop
+    def close(self, timeout=1.0):
+        if self.thread.is_alive():
+            try:
+                asyncio.run_coroutine_threadsafe(self._close(timeout), self.loop).result(timeout + 1.0)
+            except concurrent.futures.TimeoutError:
+                pass
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=1.0)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _start(self):
+        for sink, (maxsize, drop, coalesce) in self.sinks:
+            self.queues[sink] = SinkQueue(maxsize, drop, coalesce)
+            await sink.start()
+            self.tasks.append(asyncio.ensure_future(self._consume(sink, self.queues[sink])))
+
+    def _dispatch(self, event):
+        for queue in self.queues.values():
+            queue.put(event)
+
+    async def _consume(self, sink, queue):
+        while True:
+            event = await queue.get()
+            try:
+                await sink.handle(event)
+            except Exception:
+                traceback.print_exc()
+
+    async def _close(self, timeout):
+        deadline = self.loop.time() + timeout
+        while any(queue.items for queue in self.queues.values()) and self.loop.time() < deadline:
+            await asyncio.sleep(0.01)
+        for task in self.tasks:
+            task.cancel()
+        for sink in self.queues:
+            await sink.close()
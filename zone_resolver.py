@@ -0,0 +1,121 @@
+import copy
+import cv2 as cv
+import numpy as np
+
+
+# Builds a zone map where the background pixels closer than max_gap_px to a zone take the id of the nearest zone,
+# so points falling on the thin gaps between streets still resolve to a zone. Pixels whose value is not in zone_ids
+# are background (0); if zone_ids is None only the pixels with value 0 are background.
+def nearest_zone_map(img_map, max_gap_px, zone_ids=None):
+    if zone_ids is None:
+        background = img_map == 0
+    else:
+        background = ~np.isin(img_map, list(zone_ids))
+    zone_map = img_map.copy()
+    zone_map[background] = 0
+    if max_gap_px <= 0 or background.all():
+        return zone_map
+
+    distance, labels = cv.distanceTransformWithLabels(background.astype(np.uint8), cv.DIST_L2, 5,
+                                                      labelType=cv.DIST_LABEL_PIXEL)
+    # Zone pixels are labelled 1, 2, ... in row-major order
+    label_to_zone = np.concatenate([[0], zone_map[~background]]).astype(img_map.dtype)
+    zone_map = label_to_zone[labels]
+    zone_map[distance > max_gap_px] = 0
+    return zone_map
+
+
+# Resolves the zone under the pointer and filters it over the last [filter_size] frames.
+# The filtered zone is the mode of the window, kept up to date in O(1) with per-zone vote counts and buckets of
+# zones by vote count. A new zone only replaces the current one after it has at least [min_votes] votes and has been
+# the mode for [dwell_frames] consecutive frames; ties keep the current zone.
+# A zone_map already built by nearest_zone_map (e.g. in shared memory) can be passed instead of img_map, or any
+# object with a zones_at(points) method such as a VectorZoneMap.
+class ZoneResolver:
+    def __init__(self, img_map, pixels_per_cm, zone_ids=None, filter_size=10, min_votes=1, dwell_frames=1,
+                 max_gap_cm=0.2, zone_map=None):
+        self.pixels_per_cm = pixels_per_cm
+        if zone_map is None:
+            zone_map = nearest_zone_map(img_map, max_gap_cm * pixels_per_cm, zone_ids)
+        self.zone_map = zone_map
+        self.filter_size = filter_size
+        self.min_votes = min_votes
+        self.dwell_frames = dwell_frames
+        self.reset()
+
+    def reset(self):
+        self.history = [0] * self.filter_size
+        self.history_cnt = 0
+        self.counts = {0: self.filter_size}
+        self.buckets = [set() for _ in range(self.filter_size + 1)]
+        self.buckets[self.filter_size].add(0)
+        self.max_count = self.filter_size
+        self.zone = 0
+        self.candidate = 0
+        self.candidate_frames = 0
+
+    # Returns a resolver sharing the zone map and the settings, with its own filter state (e.g. for another pointer)
+    def copy(self):
+        resolver = copy.copy(self)
+        resolver.reset()
+        return resolver
+
+    # Returns the zones of an array of points in cm (N x 2 or N x 3), 0 outside of the map
+    def zones_at(self, points):
+        if not isinstance(self.zone_map, np.ndarray):
+            return self.zone_map.zones_at(points)
+        points = np.asarray(points, dtype=np.float64).reshape(len(points), -1)
+        x = (points[:, 0] * self.pixels_per_cm).astype(int)
+        y = (points[:, 1] * self.pixels_per_cm).astype(int)
+        inside = (0 <= x) & (x < self.zone_map.shape[1]) & (0 <= y) & (y < self.zone_map.shape[0])
+        zones = np.zeros(len(points), dtype=self.zone_map.dtype)
+        zones[inside] = self.zone_map[y[inside], x[inside]]
+        return zones
+
+    # Returns the zone of the point of interest on the map
+    def zone_at(self, point_of_interest):
+        return int(self.zones_at(np.reshape(point_of_interest, (1, -1)))[0])
+
+    # Adds the point of interest of a new frame (None if there is no pointer) and returns the filtered zone
+    def update(self, point_of_interest):
+        zone = 0 if point_of_interest is None else self.zone_at(point_of_interest)
+        return self.update_zone(zone)
+
+    # Adds the zone of a new frame and returns the filtered zone
+    def update_zone(self, zone):
+        old = self.history[self.history_cnt]
+        self.history[self.history_cnt] = zone
+        self.history_cnt = (self.history_cnt + 1) % self.filter_size
+        if old != zone:
+            self._add_vote(old, -1)
+            self._add_vote(zone, 1)
+
+        modes = self.buckets[self.max_count]
+        mode = self.zone if self.zone in modes else min(modes)
+        if mode == self.zone:
+            self.candidate = mode
+            self.candidate_frames = 0
+            return self.zone
+
+        if mode == self.candidate:
+            self.candidate_frames += 1
+        else:
+            self.candidate = mode
+            self.candidate_frames = 1
+        if self.candidate_frames >= self.dwell_frames and self.max_count >= self.min_votes:
+            self.zone = mode
+            self.candidate_frames = 0
+        return self.zone
+
+    def _add_vote(self, zone, delta):
+        count = self.counts.get(zone, 0)
+        if count > 0:
+            self.buckets[count].discard(zone)
+        count += delta
+        self.counts[zone] = count
+        if count > 0:
+            self.buckets[count].add(zone)
+        if count > self.max_count:
+            self.max_count = count
+        elif not self.buckets[self.max_count]:
+            self.max_count -= 1